@@ -0,0 +1,342 @@
+"""
+端到端延迟基准测试
+
+启动本地 LLM/TTS 替身服务和一个 socket 服务器进程（完整的 PipelineManager 管道，
+VAD/ASR 使用真实模型），客户端按 --speed 倍实时速度回放 WAV 文件（分帧协议），
+每句话后补静音直到服务器检测到句尾，然后等待回复结束。
+
+输出（JSON，键有序、数值取整，不同提交的结果可以直接 diff）：
+- 客户端测得的句尾检测、首包（端到端）、回复时长的分位数
+- 服务器轮次追踪（--trace_file）中各阶段耗时的分位数
+- ASR 实时率（识别耗时 / 语音时长）
+- 服务器进程的 CPU 占用和内存
+
+用法：
+    python -m benchmarks.e2e_bench --wav 天龙八部0107.wav --turns 5 --output bench.json
+    python -m benchmarks.e2e_bench --turns 5 --speed 2 --baseline bench.json
+    python -m benchmarks.e2e_bench --server_args "--inference_workers 2"
+"""
+import argparse
+import json
+import logging
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from benchmarks.stub_servers import add_stub_arguments, start_stub_servers, stub_config
+from utils.audio_codec import encode_hello, read_hello
+from utils.protocol import ControlEvent, FrameReader, FrameType, FrameWriter, now_us
+
+SAMPLE_RATE = 16000
+FRAME_MS = 20
+FRAME_BYTES = SAMPLE_RATE * FRAME_MS // 1000 * 2
+
+
+def percentiles(values: List[float], digits: int = 1) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), digits),
+        "p50": round(pick(0.5), digits),
+        "p90": round(pick(0.9), digits),
+        "p99": round(pick(0.99), digits),
+    }
+
+
+def read_wav(path: str) -> bytes:
+    with wave.open(path, "rb") as wav_file:
+        if wav_file.getsampwidth() != 2 or wav_file.getnchannels() != 1 or wav_file.getframerate() != SAMPLE_RATE:
+            raise ValueError(f"{path}: WAV file must be 16kHz, 16-bit, mono")
+        return wav_file.readframes(wav_file.getnframes())
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ProcessSampler:
+    """定期读取 /proc 中服务器进程的 CPU 时间和内存"""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.rss_mb = []
+        self._stop = threading.Event()
+        self._start = None
+
+    def cpu_seconds(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except (OSError, IndexError, ValueError):
+            return None
+
+    def status_mb(self, key: str) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith(key + ":"):
+                        return int(line.split()[1]) / 1024
+        except OSError:
+            pass
+        return None
+
+    def start(self) -> None:
+        self._start = (time.monotonic(), self.cpu_seconds())
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            rss = self.status_mb("VmRSS")
+            if rss is not None:
+                self.rss_mb.append(rss)
+
+    def stop(self) -> Dict[str, float]:
+        self._stop.set()
+        start_time, start_cpu = self._start
+        cpu = self.cpu_seconds()
+        result = {}
+        if cpu is not None and start_cpu is not None:
+            result["cpu_percent"] = round((cpu - start_cpu) / (time.monotonic() - start_time) * 100, 1)
+        if self.rss_mb:
+            result["rss_mb_mean"] = round(sum(self.rss_mb) / len(self.rss_mb), 1)
+        peak = self.status_mb("VmHWM")
+        if peak is not None:
+            result["rss_mb_peak"] = round(peak, 1)
+        return result
+
+
+class BenchClient:
+    """分帧协议客户端，记录每轮的事件时间"""
+
+    def __init__(self, host: str, port: int):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.sendall(encode_hello({"codec": "pcm", "frame_ms": FRAME_MS, "protocol": "framed"}))
+        reply = read_hello(self.sock)
+        if reply.get("error"):
+            raise ConnectionRefusedError(f"Server rejected connection: {reply}")
+        self.writer = FrameWriter()
+        self.send_lock = threading.Lock()
+        self.turn: Dict[str, float] = {}
+        self.user_turn_end = threading.Event()
+        self.turn_end = threading.Event()
+        threading.Thread(target=self._receive, daemon=True).start()
+
+    def send(self, data: bytes) -> None:
+        with self.send_lock:
+            self.sock.sendall(data)
+
+    def _receive(self) -> None:
+        reader = FrameReader()
+        while data := self.sock.recv(65536):
+            for frame in reader.feed(data):
+                now = time.monotonic()
+                if frame.type == FrameType.AUDIO:
+                    if "first_audio" not in self.turn:
+                        self.turn["first_audio"] = now
+                        self.send(self.writer.control(ControlEvent.PLAYBACK_STARTED))
+                    self.turn["audio_ms"] = self.turn.get("audio_ms", 0.0) + len(frame.payload) / 32
+                    continue
+                message = frame.control()
+                event = message.get("event")
+                if event == ControlEvent.USER_TURN_END:
+                    self.turn["user_turn_end"] = now
+                    self.turn["utterance_ms"] = message.get("duration_ms", 0.0)
+                    self.user_turn_end.set()
+                elif event == ControlEvent.TURN_END:
+                    self.turn["turn_end"] = now
+                    self.send(self.writer.control(ControlEvent.PLAYBACK_DONE))
+                    self.turn_end.set()
+        self.turn_end.set()
+
+    def stream(self, pcm: bytes, speed: float, stop: Optional[threading.Event] = None) -> None:
+        """按 speed 倍实时速度发送音频，stop 被设置时提前结束"""
+        interval = FRAME_MS / 1000 / speed
+        start = time.monotonic()
+        for i, offset in enumerate(range(0, len(pcm), FRAME_BYTES)):
+            if stop is not None and stop.is_set():
+                return
+            delay = start + i * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.send(self.writer.audio(pcm[offset:offset + FRAME_BYTES], now_us()))
+
+    def run_turn(self, pcm: bytes, speed: float, timeout: float) -> Dict[str, float]:
+        self.turn = {}
+        self.user_turn_end.clear()
+        self.turn_end.clear()
+        self.stream(pcm, speed)
+        speech_end = time.monotonic()
+        # 补静音直到服务器检测到句尾
+        self.stream(bytes(SAMPLE_RATE * 2 * 5), speed, stop=self.user_turn_end)
+        if not self.turn_end.wait(timeout):
+            logging.warning("Timed out waiting for the reply")
+        turn = self.turn
+        result = {"utterance_ms": turn.get("utterance_ms", 0.0), "reply_audio_ms": turn.get("audio_ms", 0.0)}
+        if "user_turn_end" in turn:
+            result["endpoint_ms"] = (turn["user_turn_end"] - speech_end) * 1000
+        if "first_audio" in turn:
+            result["first_audio_ms"] = (turn["first_audio"] - speech_end) * 1000
+        if "turn_end" in turn and "first_audio" in turn:
+            result["reply_ms"] = (turn["turn_end"] - turn["first_audio"]) * 1000
+        return result
+
+    def close(self) -> None:
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def start_server(args: argparse.Namespace, port: int, llm_url: str, tts_url: str, trace_file: str, log_file):
+    command = [
+        sys.executable, "-m", "server.server_socket",
+        "--host", "127.0.0.1", "--port", str(port),
+        "--llm_base_url", llm_url, "--llm_api_key", "stub", "--llm_model_name", "stub",
+        "--tts_backend", "siliconflow", "--tts_api_key", "stub", "--tts_url", tts_url,
+        "--trace_file", trace_file,
+    ] + shlex.split(args.server_args)
+    logging.info(f"Starting server: {' '.join(command)}")
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    process = subprocess.Popen(command, cwd=root, stdout=log_file, stderr=subprocess.STDOUT)
+    # 等待服务器日志中的监听行；不能用探测连接判断，每个连接都会让服务器构建一条管道
+    ready_line = f"Listening on 127.0.0.1:{port}"
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}, see {log_file.name}")
+        with open(log_file.name, encoding="utf-8", errors="replace") as f:
+            if ready_line in f.read():
+                return process
+        time.sleep(0.5)
+    process.kill()
+    raise TimeoutError("Server did not start in time")
+
+
+def read_traces(path: str) -> Dict[str, List[float]]:
+    spans = defaultdict(list)
+    if not os.path.exists(path):
+        return spans
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            if record["status"] != "ok":
+                continue
+            durations = {span["name"]: span["duration_ms"] for span in record["spans"]}
+            for name, duration in durations.items():
+                spans[name].append(duration)
+            utterance_ms = record["attributes"].get("utterance_ms")
+            if "asr" in durations and utterance_ms:
+                spans["asr_rtf"].append(durations["asr"] / utterance_ms)
+    return spans
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """与基准结果比较 p50/p90，变化超过 threshold 的标出"""
+    lines = []
+
+    def walk(current, base, path):
+        for key, value in current.items():
+            if key not in base:
+                continue
+            if isinstance(value, dict):
+                walk(value, base[key], f"{path}{key}.")
+            elif key in ("p50", "p90", "cpu_percent", "rss_mb_peak") and base[key]:
+                change = (value - base[key]) / base[key]
+                flag = " <-- regression" if change > threshold else ""
+                lines.append(f"{path}{key}: {base[key]} -> {value} ({change:+.1%}){flag}")
+
+    walk(results, baseline, "")
+    return lines
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s|%(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='端到端延迟基准测试')
+    parser.add_argument('--wav', nargs='+', default=['天龙八部0107.wav'], help='回放的WAV文件（16kHz单声道），轮流使用')
+    parser.add_argument('--turns', type=int, default=5, help='对话轮数')
+    parser.add_argument('--speed', type=float, default=1.0, help='回放速度（相对实时）')
+    parser.add_argument('--gap_s', type=float, default=0.5, help='两轮之间的间隔（秒）')
+    parser.add_argument('--turn_timeout', type=float, default=60, help='等待一轮回复的最长时间（秒）')
+    parser.add_argument('--startup_timeout', type=float, default=300, help='等待服务器启动（加载模型）的最长时间（秒）')
+    parser.add_argument('--server_args', default='', help='传给服务器的额外参数')
+    parser.add_argument('--output', default='', help='结果JSON文件，为空时打印到标准输出')
+    parser.add_argument('--baseline', default='', help='与之比较的结果JSON文件')
+    parser.add_argument('--regression_threshold', type=float, default=0.1, help='标记为退化的相对变化')
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    wavs = [read_wav(path) for path in args.wav]
+    llm_url, tts_url, _ = start_stub_servers(stub_config(args))
+    work_dir = tempfile.mkdtemp(prefix="e2e_bench_")
+    trace_file = os.path.join(work_dir, "turns.jsonl")
+    port = free_port()
+
+    with open(os.path.join(work_dir, "server.log"), "w") as log_file:
+        process = start_server(args, port, llm_url, tts_url, trace_file, log_file)
+        try:
+            sampler = ProcessSampler(process.pid)
+            sampler.start()
+            client = BenchClient("127.0.0.1", port)
+            turns = []
+            for i in range(args.turns):
+                turn = client.run_turn(wavs[i % len(wavs)], args.speed, args.turn_timeout)
+                logging.info(f"Turn {i + 1}/{args.turns}: {turn}")
+                turns.append(turn)
+                time.sleep(args.gap_s)
+            client.close()
+            resources = sampler.stop()
+            # 等待服务器写完最后一轮的追踪记录
+            time.sleep(1)
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+    client_metrics = defaultdict(list)
+    for turn in turns:
+        for key in ("endpoint_ms", "first_audio_ms", "reply_ms"):
+            if key in turn:
+                client_metrics[key].append(turn[key])
+    traces = read_traces(trace_file)
+    results = {
+        "config": {
+            "wav": args.wav, "turns": args.turns, "speed": args.speed, "server_args": args.server_args,
+            **{key: value for key, value in vars(stub_config(args)).items() if key != "llm_reply"},
+        },
+        "completed_turns": sum(1 for turn in turns if "reply_ms" in turn),
+        "client": {key: percentiles(values) for key, values in sorted(client_metrics.items())},
+        "stages": {name: percentiles(values) for name, values in sorted(traces.items()) if name != "asr_rtf"},
+        "asr_rtf": percentiles(traces.get("asr_rtf", []), digits=3),
+        "server": resources,
+    }
+
+    output = json.dumps(results, indent=2, sort_keys=True, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        logging.info(f"Results written to {args.output}, server log and traces in {work_dir}")
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            print("\n".join(compare(results, json.load(f), args.regression_threshold)))
+
+
+if __name__ == "__main__":
+    main()
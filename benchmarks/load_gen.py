@@ -0,0 +1,290 @@
+"""
+多会话压测客户端
+
+用 asyncio 在一个进程中模拟大量通话：每个会话按实时速度发送 WAV 录音，说完后像真实麦克风一样
+继续发送静音，收到回复并模拟播放结束后停顿一段随机的思考时间再说下一句。会话数按
+--ramp_step / --ramp_interval_s 逐步增加到 --sessions，每一档输出一行 JSON：
+
+- 响应延迟（说完到收到第一块回复音频）的分位数
+- 迟到音频：按 --playout_delay_ms 的固定播放缓冲模拟播放，到达时已经该播放的帧
+- 丢失音频：帧序号不连续
+- 连接失败（连接错误、服务器拒绝）和会话中途断开
+
+用法：
+    python -m benchmarks.load_gen --port 65432 --sessions 200 --ramp_step 20 --ramp_interval_s 30
+    python -m benchmarks.load_gen --transport ws --url ws://localhost:8765 --sessions 100
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import struct
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.e2e_bench import FRAME_BYTES, FRAME_MS, SAMPLE_RATE, percentiles, read_wav
+from utils.audio_codec import HELLO_MAGIC, encode_hello
+from utils.protocol import ControlEvent, Frame, FrameReader, FrameType, FrameWriter, now_us, unpack_frame
+
+HELLO = {"codec": "pcm", "frame_ms": FRAME_MS, "protocol": "framed"}
+SILENCE = bytes(FRAME_BYTES)
+
+
+class SocketTransport:
+    """分帧协议的 TCP 连接"""
+
+    async def connect(self, args: argparse.Namespace) -> Dict:
+        self.reader, self.writer = await asyncio.open_connection(args.host, args.port)
+        self.frames = FrameReader()
+        self.writer.write(encode_hello(HELLO))
+        await self.writer.drain()
+        head = await self.reader.readexactly(len(HELLO_MAGIC) + 2)
+        if head[:len(HELLO_MAGIC)] != HELLO_MAGIC:
+            raise ConnectionError("Invalid hello reply")
+        (length,) = struct.unpack("!H", head[len(HELLO_MAGIC):])
+        return json.loads(await self.reader.readexactly(length))
+
+    async def send(self, data: bytes) -> None:
+        self.writer.write(data)
+        await self.writer.drain()
+
+    async def receive(self) -> List[Frame]:
+        data = await self.reader.read(65536)
+        if not data:
+            raise ConnectionError("Connection closed by server")
+        return self.frames.feed(data)
+
+    async def close(self) -> None:
+        self.writer.close()
+
+
+class WebSocketTransport:
+    """分帧协议的 websocket 连接"""
+
+    async def connect(self, args: argparse.Namespace) -> Dict:
+        from websockets.asyncio.client import connect
+        from websockets.exceptions import InvalidStatus
+
+        try:
+            self.websocket = await connect(args.url, compression=None, max_size=None)
+        except InvalidStatus as e:
+            # 服务器满载时在 HTTP 握手阶段返回 503，与握手消息中的 busy 一样算作拒绝
+            if e.response.status_code != 503:
+                raise
+            self.websocket = None
+            return {"error": "busy", "retry_after": e.response.headers.get("Retry-After")}
+        await self.websocket.send(json.dumps(HELLO))
+        return json.loads(await self.websocket.recv())
+
+    async def send(self, data: bytes) -> None:
+        await self.websocket.send(data)
+
+    async def receive(self) -> List[Frame]:
+        return [unpack_frame(await self.websocket.recv())]
+
+    async def close(self) -> None:
+        if self.websocket is not None:
+            await self.websocket.close()
+
+
+class Stats:
+    """按压测档位汇总的统计"""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.turns = 0
+        self.timeouts = 0
+        self.frames = 0
+        self.late_frames = 0
+        self.lost_frames = 0
+        self.connect_failures = 0
+        self.rejected = 0
+        self.disconnects = 0
+
+    def summary(self) -> Dict:
+        return {
+            "turns": self.turns,
+            "timeouts": self.timeouts,
+            "latency_ms": percentiles(self.latencies),
+            "frames": self.frames,
+            "late_frames": self.late_frames,
+            "lost_frames": self.lost_frames,
+            "connect_failures": self.connect_failures,
+            "rejected": self.rejected,
+            "disconnects": self.disconnects,
+        }
+
+
+class CallerSession:
+    """一个模拟通话"""
+
+    def __init__(self, index: int, args: argparse.Namespace, wavs: List[bytes], generator: "LoadGenerator"):
+        self.index = index
+        self.args = args
+        self.wavs = wavs
+        self.generator = generator
+        self.rng = random.Random(args.seed + index)
+        self.transport = SocketTransport() if args.transport == "socket" else WebSocketTransport()
+        self.writer = FrameWriter()
+
+        self.speech_end: Optional[float] = None
+        self.first_audio = False
+        self.playout_start = 0.0
+        self.played_ms = 0.0
+        self.last_seq: Optional[int] = None
+        self.turn_end = asyncio.Event()
+
+    @property
+    def stats(self) -> Stats:
+        return self.generator.current
+
+    async def run(self) -> None:
+        try:
+            reply = await self.transport.connect(self.args)
+        except Exception as e:
+            logging.debug(f"Session {self.index} failed to connect: {e}")
+            self.stats.connect_failures += 1
+            return
+        if reply.get("error"):
+            self.stats.rejected += 1
+            await self.transport.close()
+            return
+
+        receiver = asyncio.create_task(self.receive())
+        try:
+            await self.talk()
+        except Exception as e:
+            logging.debug(f"Session {self.index} ended: {e}")
+            if not self.generator.stopping:
+                self.stats.disconnects += 1
+        finally:
+            receiver.cancel()
+            await self.transport.close()
+
+    async def stream(self, pcm: bytes, until: Optional[asyncio.Event] = None, max_seconds: float = 0) -> None:
+        """按实时速度发送音频；pcm 为空时发送静音直到 until 被设置或超过 max_seconds"""
+        interval = FRAME_MS / 1000
+        start = time.monotonic()
+        i = 0
+        while True:
+            if pcm:
+                chunk = pcm[i * FRAME_BYTES:(i + 1) * FRAME_BYTES]
+                if not chunk:
+                    return
+            else:
+                if (until is not None and until.is_set()) or i * interval >= max_seconds:
+                    return
+                chunk = SILENCE
+            delay = start + i * interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.transport.send(self.writer.audio(chunk, now_us()))
+            i += 1
+
+    async def talk(self) -> None:
+        # 接通后先静音一会儿，错开各会话的说话时间
+        await self.stream(b"", max_seconds=self.rng.uniform(0, self.args.think_s))
+        while not self.generator.stopping:
+            self.turn_end.clear()
+            self.first_audio = False
+            await self.stream(self.rng.choice(self.wavs))
+            self.speech_end = time.monotonic()
+            # 等待回复和模拟播放期间麦克风继续发送静音
+            await self.stream(b"", until=self.turn_end, max_seconds=self.args.turn_timeout_s)
+            if not self.turn_end.is_set():
+                self.stats.timeouts += 1
+            else:
+                self.stats.turns += 1
+            await self.stream(b"", max_seconds=self.rng.uniform(self.args.think_s / 2, self.args.think_s * 1.5))
+
+    async def receive(self) -> None:
+        while True:
+            for frame in await self.transport.receive():
+                if self.last_seq is not None and frame.seq > self.last_seq + 1:
+                    self.stats.lost_frames += frame.seq - self.last_seq - 1
+                self.last_seq = frame.seq
+                if frame.type == FrameType.AUDIO:
+                    self.on_audio(frame)
+                elif frame.control().get("event") == ControlEvent.TURN_END:
+                    # 模拟播放完剩余的缓冲再开始下一句
+                    remaining = self.playout_start + self.played_ms / 1000 - time.monotonic()
+                    if remaining > 0:
+                        await asyncio.sleep(remaining)
+                    await self.transport.send(self.writer.control(ControlEvent.PLAYBACK_DONE))
+                    self.turn_end.set()
+
+    def on_audio(self, frame: Frame) -> None:
+        now = time.monotonic()
+        self.stats.frames += 1
+        if not self.first_audio:
+            self.first_audio = True
+            self.playout_start = now + self.args.playout_delay_ms / 1000
+            self.played_ms = 0.0
+            if self.speech_end is not None:
+                self.stats.latencies.append((now - self.speech_end) * 1000)
+            asyncio.create_task(self.transport.send(self.writer.control(ControlEvent.PLAYBACK_STARTED)))
+        elif now > self.playout_start + self.played_ms / 1000:
+            # 到达时已经该播放了：播放端欠载
+            self.stats.late_frames += 1
+            self.playout_start = now - self.played_ms / 1000
+        self.played_ms += len(frame.payload) / (SAMPLE_RATE * 2 / 1000)
+
+
+class LoadGenerator:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.wavs = [read_wav(path) for path in args.wav]
+        self.current = Stats()
+        self.stopping = False
+        self.tasks: List[asyncio.Task] = []
+
+    async def run(self) -> List[Dict]:
+        args = self.args
+        results = []
+        while len(self.tasks) < args.sessions:
+            target = min(len(self.tasks) + args.ramp_step, args.sessions)
+            while len(self.tasks) < target:
+                session = CallerSession(len(self.tasks), args, self.wavs, self)
+                self.tasks.append(asyncio.create_task(session.run()))
+                await asyncio.sleep(args.connect_interval_s)
+            self.current = Stats()
+            await asyncio.sleep(args.ramp_interval_s)
+            active = sum(1 for task in self.tasks if not task.done())
+            result = {"sessions": len(self.tasks), "active": active, **self.current.summary()}
+            print(json.dumps(result, ensure_ascii=False), flush=True)
+            results.append(result)
+        self.stopping = True
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        return results
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s|%(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='多会话压测客户端')
+    parser.add_argument('--transport', default='socket', choices=['socket', 'ws'], help='连接方式')
+    parser.add_argument('--host', default='localhost', help='socket服务器地址')
+    parser.add_argument('--port', type=int, default=65432, help='socket服务器端口')
+    parser.add_argument('--url', default='ws://localhost:8765', help='websocket服务器地址')
+    parser.add_argument('--wav', nargs='+', default=['天龙八部0107.wav'], help='每句话随机选用的WAV文件（16kHz单声道）')
+    parser.add_argument('--sessions', type=int, default=100, help='最大并发会话数')
+    parser.add_argument('--ramp_step', type=int, default=10, help='每档增加的会话数')
+    parser.add_argument('--ramp_interval_s', type=float, default=30, help='每档持续的时间（秒）')
+    parser.add_argument('--connect_interval_s', type=float, default=0.05, help='同一档内新建连接的间隔（秒）')
+    parser.add_argument('--think_s', type=float, default=2.0, help='收到回复后的平均思考时间（秒）')
+    parser.add_argument('--turn_timeout_s', type=float, default=30, help='等待回复的最长时间（秒）')
+    parser.add_argument('--playout_delay_ms', type=float, default=100, help='模拟播放端的固定缓冲（毫秒）')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    parser.add_argument('--output', default='', help='把各档结果写入JSON文件')
+    args = parser.parse_args()
+
+    results = asyncio.run(LoadGenerator(args).run())
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
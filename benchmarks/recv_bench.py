@@ -0,0 +1,119 @@
+"""
+socket 接收路径基准测试：每会话分钟的系统调用次数和内存分配次数
+
+对比旧的 recv(1024) + astype/concatenate 路径与 RecvBufferPool + Float32Accumulator 路径。
+发送端按 32ms 一块发送一分钟的 16kHz PCM，--speed 控制相对实时的加速倍数，
+--burst 表示不限速（模拟接收端积压）。
+
+用法：
+    python -m benchmarks.recv_bench --speed 20
+    python -m benchmarks.recv_bench --burst --recv_size 16384
+"""
+import argparse
+import socket
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+from utils.audio_buffer import Float32Accumulator, RecvBufferPool, release_buffer
+
+SAMPLE_RATE = 16000
+CHUNK_BYTES = 1024  # 32ms
+
+
+def send_audio(sock: socket.socket, seconds: float, speed: float, burst: bool) -> None:
+    chunk = np.random.randint(-3000, 3000, CHUNK_BYTES // 2, dtype=np.int16).tobytes()
+    interval = CHUNK_BYTES / 2 / SAMPLE_RATE / speed
+    total = int(seconds * SAMPLE_RATE * 2 / CHUNK_BYTES)
+    start = time.perf_counter()
+    for i in range(total):
+        if not burst:
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        sock.sendall(chunk)
+    sock.shutdown(socket.SHUT_WR)
+
+
+def receive_legacy(sock: socket.socket, utterance_samples: int) -> dict:
+    """旧路径：每次 recv 新建 bytes，转换时 astype、除法、concatenate 各分配一个数组"""
+    syscalls = allocations = 0
+    carry = b""
+    audio = np.array([], dtype=np.float32)
+    while True:
+        data = sock.recv(1024)
+        syscalls += 1
+        allocations += 1
+        if not data:
+            break
+        data = carry + data
+        aligned = len(data) - len(data) % 2
+        data, carry = data[:aligned], data[aligned:]
+        frame = np.frombuffer(data, dtype=np.int16).astype(np.float32) / 32768
+        audio = np.concatenate([audio, frame])
+        allocations += 3
+        if audio.shape[0] >= utterance_samples:
+            audio = np.array([], dtype=np.float32)
+    return {"syscalls": syscalls, "allocations": allocations}
+
+
+def receive_pooled(sock: socket.socket, utterance_samples: int, recv_size: int, count: int) -> dict:
+    """新路径：recv_into 读入缓冲池，float32 直接写入累积缓冲"""
+    pool = RecvBufferPool(read_size=recv_size, count=count)
+    pcm = Float32Accumulator()
+    while True:
+        data = pool.recv(sock)
+        if data is None:
+            break
+        pcm.append(data)
+        release_buffer(data)
+        if len(pcm) >= utterance_samples:
+            pcm.clear()
+    return {"syscalls": pool.syscalls, "allocations": pool.allocations + pcm.allocations}
+
+
+def run(mode: str, args: argparse.Namespace) -> dict:
+    receiver, sender = socket.socketpair()
+    thread = threading.Thread(target=send_audio, args=(sender, args.seconds, args.speed, args.burst))
+    utterance_samples = int(args.utterance_s * SAMPLE_RATE)
+
+    tracemalloc.start()
+    thread.start()
+    cpu = time.thread_time()
+    if mode == "legacy":
+        result = receive_legacy(receiver, utterance_samples)
+    else:
+        result = receive_pooled(receiver, utterance_samples, args.recv_size, args.recv_buffers)
+    result["cpu_seconds"] = time.thread_time() - cpu
+    result["peak_bytes"] = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    thread.join()
+    receiver.close()
+    sender.close()
+
+    # 换算为每会话分钟
+    scale = 60 / args.seconds
+    return {key: value * scale if key != "peak_bytes" else value for key, value in result.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='socket接收路径基准测试')
+    parser.add_argument('--seconds', type=float, default=60, help='发送的音频时长（秒）')
+    parser.add_argument('--speed', type=float, default=20, help='相对实时的发送加速倍数')
+    parser.add_argument('--burst', action='store_true', help='不限速发送')
+    parser.add_argument('--utterance_s', type=float, default=10, help='每句话的时长（秒），之后清空累积缓冲')
+    parser.add_argument('--recv_size', type=int, default=4096, help='单次socket读取的最大字节数')
+    parser.add_argument('--recv_buffers', type=int, default=32, help='预先分配的接收缓冲数')
+    args = parser.parse_args()
+
+    print(f"{'path':<8}{'syscalls/min':>14}{'allocs/min':>12}{'cpu s/min':>11}{'peak KiB':>10}")
+    for mode in ("legacy", "pooled"):
+        result = run(mode, args)
+        print(f"{mode:<8}{result['syscalls']:>14.0f}{result['allocations']:>12.0f}"
+              f"{result['cpu_seconds']:>11.3f}{result['peak_bytes'] / 1024:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
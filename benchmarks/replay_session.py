@@ -0,0 +1,209 @@
+"""
+重放服务器录下的会话（--record_dir）
+
+按录音中的到达时间把上行音频和控制消息（静音、取消）重新发给一个 socket 服务器，播放确认
+按重放时收到的回复生成。比较原会话和重放的每轮句尾、识别结果和响应延迟（句尾到第一块
+回复音频），用于在本地复现线上的延迟问题，可以配合 benchmarks.stub_servers 固定 LLM/TTS 的耗时。
+
+用法：
+    python -m benchmarks.replay_session --record_dir records --session 1a2b3c4d --port 65432
+    python -m benchmarks.replay_session --files records/1a2b3c4d.0000.rec --export_dir replay/
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import wave
+from typing import Any, Dict, List, Tuple
+
+from utils.audio_codec import SAMPLE_RATE, SAMPLE_WIDTH, encode_hello, read_hello
+from utils.protocol import ControlEvent, FrameReader, FrameType, FrameWriter, now_us
+from utils.session_recorder import Record, RecordKind, read_session, session_files
+
+# 由客户端根据收到的回复生成，重放时不照搬录音
+REACTIVE_EVENTS = {ControlEvent.PLAYBACK_STARTED, ControlEvent.PLAYBACK_DONE}
+
+
+def analyze(records: List[Record]) -> List[Dict[str, Any]]:
+    """从下行记录中整理每轮的句尾时间、识别结果、响应延迟和回复时长（毫秒）"""
+    turns: List[Dict[str, Any]] = []
+    turn = None
+    for record in records:
+        offset_ms = record.offset_us / 1000
+        if record.kind == RecordKind.DOWNLINK_AUDIO:
+            if turn is not None and "response_ms" not in turn:
+                turn["response_ms"] = offset_ms - turn["user_turn_end_ms"]
+                turn["first_audio_ms"] = offset_ms
+        elif record.kind == RecordKind.DOWNLINK_CONTROL:
+            message = record.control()
+            event = message.get("event")
+            if event == ControlEvent.USER_TURN_END:
+                turn = {"user_turn_end_ms": offset_ms, "utterance_ms": message.get("duration_ms", 0.0)}
+                turns.append(turn)
+            elif turn is not None and event == ControlEvent.TRANSCRIPT:
+                turn["transcript"] = message.get("text", "")
+            elif turn is not None and event == ControlEvent.TURN_END and "first_audio_ms" in turn:
+                turn["reply_ms"] = offset_ms - turn.pop("first_audio_ms")
+    for turn in turns:
+        turn.pop("first_audio_ms", None)
+    return turns
+
+
+def write_timeline(path: str, items: List[Tuple[int, bytes]]) -> None:
+    """把带时间的音频块按时间排成一条 WAV，块之间补静音"""
+    audio = bytearray()
+    for offset_us, pcm in items:
+        position = offset_us * SAMPLE_RATE // 1_000_000 * SAMPLE_WIDTH
+        if position > len(audio):
+            audio += bytes(position - len(audio))
+        audio += pcm
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(SAMPLE_WIDTH)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(bytes(audio))
+
+
+class ReplayClient:
+    """分帧协议客户端，按录音时间发送上行，收到的下行按与录音相同的格式记录"""
+
+    def __init__(self, host: str, port: int):
+        self.sock = socket.create_connection((host, port))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.sock.sendall(encode_hello({"codec": "pcm", "protocol": "framed"}))
+        reply = read_hello(self.sock)
+        if reply.get("error"):
+            raise ConnectionRefusedError(f"Server rejected connection: {reply}")
+        self.writer = FrameWriter()
+        self.send_lock = threading.Lock()
+        self.started = time.monotonic()
+        self.received: List[Record] = []
+        self.replying = False
+        threading.Thread(target=self._receive, daemon=True).start()
+
+    def send(self, data: bytes) -> None:
+        with self.send_lock:
+            self.sock.sendall(data)
+
+    def _offset_us(self) -> int:
+        return int((time.monotonic() - self.started) * 1e6)
+
+    def _receive(self) -> None:
+        reader = FrameReader()
+        try:
+            while data := self.sock.recv(65536):
+                for frame in reader.feed(data):
+                    if frame.type == FrameType.AUDIO:
+                        self.received.append(Record(RecordKind.DOWNLINK_AUDIO, self._offset_us(), 0, frame.payload))
+                        if not self.replying:
+                            self.replying = True
+                            self.send(self.writer.control(ControlEvent.PLAYBACK_STARTED))
+                        continue
+                    self.received.append(Record(RecordKind.DOWNLINK_CONTROL, self._offset_us(), 0, frame.payload))
+                    if frame.control().get("event") == ControlEvent.TURN_END:
+                        self.replying = False
+                        self.send(self.writer.control(ControlEvent.PLAYBACK_DONE))
+        except OSError:
+            pass
+
+    def replay(self, records: List[Record], speed: float = 1.0) -> None:
+        """按录音中的到达时间发送上行音频和控制消息，采集时间戳平移到现在"""
+        self.started = time.monotonic()
+        base_us = now_us()
+        first_capture = next((record.capture_us for record in records
+                              if record.kind == RecordKind.UPLINK_AUDIO and record.capture_us), 0)
+        for record in records:
+            if record.kind not in (RecordKind.UPLINK_AUDIO, RecordKind.UPLINK_CONTROL):
+                continue
+            delay = self.started + record.offset_us / 1e6 / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            capture_us = base_us + record.capture_us - first_capture if record.capture_us and first_capture else now_us()
+            if record.kind == RecordKind.UPLINK_AUDIO:
+                self.send(self.writer.audio(record.payload, capture_us))
+                continue
+            message = record.control()
+            event = message.pop("event", None)
+            if event is not None and event not in REACTIVE_EVENTS:
+                self.send(self.writer.control(event, capture_us, **message))
+
+    def close(self) -> None:
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def compare(original: List[Dict[str, Any]], replayed: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    rows = []
+    for i in range(max(len(original), len(replayed))):
+        before = original[i] if i < len(original) else {}
+        after = replayed[i] if i < len(replayed) else {}
+        row = {"turn": i + 1}
+        for key in ("user_turn_end_ms", "response_ms", "reply_ms", "transcript"):
+            row[key] = [before.get(key), after.get(key)]
+        rows.append(row)
+    return rows
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s|%(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='重放录下的会话')
+    parser.add_argument('--record_dir', default='', help='服务器的录音目录')
+    parser.add_argument('--session', default='', help='会话ID')
+    parser.add_argument('--files', nargs='*', default=[], help='直接指定录音文件（按顺序）')
+    parser.add_argument('--host', default='localhost', help='socket服务器地址')
+    parser.add_argument('--port', type=int, default=65432, help='socket服务器端口，0表示只分析录音不重放')
+    parser.add_argument('--speed', type=float, default=1.0, help='重放速度（相对录音时间）')
+    parser.add_argument('--tail_s', type=float, default=10, help='发送完后等待回复的时间（秒）')
+    parser.add_argument('--export_dir', default='', help='导出上行、原下行和重放下行的WAV（按时间对齐）')
+    parser.add_argument('--output', default='', help='结果JSON文件，为空时打印到标准输出')
+    args = parser.parse_args()
+
+    paths = args.files or session_files(args.record_dir, args.session)
+    if not paths:
+        parser.error("No recording found, use --record_dir with --session, or --files")
+    records = list(read_session(paths))
+    logging.info(f"Loaded {len(records)} records from {len(paths)} files, "
+                 f"{records[-1].offset_us / 1e6 if records else 0:.1f} s")
+
+    original = analyze(records)
+    results: Dict[str, Any] = {"files": paths, "original": original}
+    received: List[Record] = []
+    if args.port > 0:
+        client = ReplayClient(args.host, args.port)
+        try:
+            client.replay(records, args.speed)
+            time.sleep(args.tail_s)
+        finally:
+            client.close()
+        received = list(client.received)
+        replayed = analyze(received)
+        results["replay"] = replayed
+        results["turns"] = compare(original, replayed)
+
+    if args.export_dir:
+        os.makedirs(args.export_dir, exist_ok=True)
+        audio = {
+            "uplink.wav": [(r.offset_us, r.payload) for r in records if r.kind == RecordKind.UPLINK_AUDIO],
+            "downlink.wav": [(r.offset_us, r.payload) for r in records if r.kind == RecordKind.DOWNLINK_AUDIO],
+            "replay_downlink.wav": [(r.offset_us, r.payload) for r in received if r.kind == RecordKind.DOWNLINK_AUDIO],
+        }
+        for name, items in audio.items():
+            if items:
+                write_timeline(os.path.join(args.export_dir, name), items)
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+"""
+基准测试使用的本地替身服务
+
+- OpenAI 兼容的 LLM 接口（POST /v1/chat/completions，支持 stream），按 ttft_ms 延迟输出第一个
+  token，之后按 tokens_per_s 的速度逐字输出固定回复
+- SiliconFlow 兼容的语音合成接口（POST /v1/audio/speech），按 ttfb_ms 延迟输出第一块音频，
+  之后按 audio_rate 倍实时速度流式输出 16kHz PCM，音频时长为 字数 × ms_per_char
+
+单独运行：
+    python -m benchmarks.stub_servers --llm_port 18000 --tts_port 18001 --llm_ttft_ms 300
+"""
+import argparse
+import json
+import logging
+import math
+import threading
+import time
+from array import array
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+SAMPLE_RATE = 16000
+
+
+@dataclass
+class StubConfig:
+    llm_ttft_ms: float = 300
+    llm_tokens_per_s: float = 30
+    llm_reply: str = "好的，我明白了。这是一个用于基准测试的固定回复，长度和真实回复差不多。"
+    tts_ttfb_ms: float = 150
+    tts_audio_rate: float = 2.0  # 相对实时的输出速度
+    tts_ms_per_char: float = 250
+    tts_chunk_ms: int = 100
+
+
+def tone(samples: int, frequency: float = 220.0) -> bytes:
+    return array("h", (int(6000 * math.sin(2 * math.pi * frequency * i / SAMPLE_RATE))
+                       for i in range(samples))).tobytes()
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def read_json(self) -> dict:
+        return json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+
+
+def make_llm_handler(config: StubConfig):
+    class LLMStubHandler(_QuietHandler):
+        def do_POST(self):
+            request = self.read_json()
+            created = int(time.time())
+            if not request.get("stream"):
+                time.sleep((config.llm_ttft_ms + len(config.llm_reply) / config.llm_tokens_per_s * 1000) / 1000)
+                body = json.dumps({
+                    "id": "stub", "object": "chat.completion", "created": created, "model": request.get("model", ""),
+                    "choices": [{"index": 0, "message": {"role": "assistant", "content": config.llm_reply},
+                                 "finish_reason": "stop"}],
+                }).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                return
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            time.sleep(config.llm_ttft_ms / 1000)
+            interval = 1 / config.llm_tokens_per_s
+            for i, token in enumerate(list(config.llm_reply) + [None]):
+                chunk = {
+                    "id": "stub", "object": "chat.completion.chunk", "created": created,
+                    "model": request.get("model", ""),
+                    "choices": [{"index": 0, "delta": {"content": token} if token else {},
+                                 "finish_reason": None if token else "stop"}],
+                }
+                self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+                if token and i + 1 < len(config.llm_reply):
+                    time.sleep(interval)
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+
+    return LLMStubHandler
+
+
+def make_tts_handler(config: StubConfig):
+    chunk_samples = SAMPLE_RATE * config.tts_chunk_ms // 1000
+    chunk = tone(chunk_samples)
+
+    class TTSStubHandler(_QuietHandler):
+        def do_POST(self):
+            request = self.read_json()
+            duration_ms = len(request.get("input", "").strip()) * config.tts_ms_per_char
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/pcm")
+            self.end_headers()
+            time.sleep(config.tts_ttfb_ms / 1000)
+            start = time.monotonic()
+            for i in range(math.ceil(duration_ms / config.tts_chunk_ms)):
+                delay = start + i * config.tts_chunk_ms / 1000 / config.tts_audio_rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                self.wfile.write(chunk)
+                self.wfile.flush()
+
+    return TTSStubHandler
+
+
+def start_stub_servers(config: StubConfig, host: str = "127.0.0.1", llm_port: int = 0,
+                       tts_port: int = 0) -> Tuple[str, str, list]:
+    """在后台线程中启动替身服务，返回 (LLM base_url, TTS url, 服务器列表)"""
+    servers = []
+    for port, handler in ((llm_port, make_llm_handler(config)), (tts_port, make_tts_handler(config))):
+        server = ThreadingHTTPServer((host, port), handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    llm_url = f"http://{host}:{servers[0].server_port}/v1"
+    tts_url = f"http://{host}:{servers[1].server_port}/v1/audio/speech"
+    return llm_url, tts_url, servers
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser) -> None:
+    defaults = StubConfig()
+    parser.add_argument('--llm_ttft_ms', type=float, default=defaults.llm_ttft_ms, help='LLM首个token的延迟（毫秒）')
+    parser.add_argument('--llm_tokens_per_s', type=float, default=defaults.llm_tokens_per_s, help='LLM每秒输出的token（字）数')
+    parser.add_argument('--llm_reply', default=defaults.llm_reply, help='LLM固定回复')
+    parser.add_argument('--tts_ttfb_ms', type=float, default=defaults.tts_ttfb_ms, help='TTS首包延迟（毫秒）')
+    parser.add_argument('--tts_audio_rate', type=float, default=defaults.tts_audio_rate, help='TTS输出音频相对实时的速度')
+    parser.add_argument('--tts_ms_per_char', type=float, default=defaults.tts_ms_per_char, help='每个字合成的音频时长（毫秒）')
+
+
+def stub_config(args: argparse.Namespace) -> StubConfig:
+    return StubConfig(
+        llm_ttft_ms=args.llm_ttft_ms,
+        llm_tokens_per_s=args.llm_tokens_per_s,
+        llm_reply=args.llm_reply,
+        tts_ttfb_ms=args.tts_ttfb_ms,
+        tts_audio_rate=args.tts_audio_rate,
+        tts_ms_per_char=args.tts_ms_per_char,
+    )
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s|%(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='LLM/TTS本地替身服务')
+    parser.add_argument('--host', default='127.0.0.1', help='监听地址')
+    parser.add_argument('--llm_port', type=int, default=18000, help='LLM接口端口')
+    parser.add_argument('--tts_port', type=int, default=18001, help='TTS接口端口')
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    llm_url, tts_url, _ = start_stub_servers(stub_config(args), args.host, args.llm_port, args.tts_port)
+    logging.info(f"LLM: {llm_url}  TTS: {tts_url}")
+    threading.Event().wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,39 +2,96 @@ import argparse
 import logging
 import socket
 import threading
-from queue import Queue, Empty
-from threading import Event
+import time
+from queue import Queue
+from threading import Event, Lock
 
-import pyaudio
+from client.dtx import SilenceSuppressor
+from client.jitter_buffer import JitterBuffer, create_output
+from client.session import ClientSession
+from utils.audio_codec import encode_hello, read_hello
 
 
 class AudioClient:
     """音频客户端，用于发送音频数据到服务器"""
 
-    def __init__(self, host: str = "localhost", port: int = 65432):
+    def __init__(self, host: str = "localhost", port: int = 65432, codec: str = "pcm", frame_ms: int = 20,
+                 output: str = "pyaudio", block_ms: int = 10, jitter_min_ms: int = 20, jitter_max_ms: int = 300,
+                 dtx: bool = False, reconnect_s: float = 30):
+        """
+        Args:
+            reconnect_s: 连接断开后尝试重连的时长（秒），服务器保留着会话时接回原来的对话，0表示不重连
+        """
         self.host = host
         self.port = port
+        self.jitter = JitterBuffer(block_ms=block_ms, min_ms=jitter_min_ms, max_ms=jitter_max_ms)
+        self.output = create_output(output, self.jitter)
+        # 静音抑制：静音期间不发送音频
+        self.dtx = SilenceSuppressor() if dtx else None
+        self.session = ClientSession(codec=codec, frame_ms=frame_ms, jitter=self.jitter, dtx=self.dtx)
+        self.send_lock = Lock()  # 麦克风线程和播放线程都会写 socket
         self.stop_event = Event()
+        self.closed = Event()  # 服务器关闭连接
         self.audio_queue = Queue()
         self.EXPECTED_SAMPLE_RATE = 16000  # 添加 EXPECTED_SAMPLE_RATE 常量
+        self.reconnect_s = reconnect_s
 
         self.socket = None
 
     def connect(self) -> None:
         """连接到服务器"""
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
-            self.socket.connect((self.host, self.port))
+            sock.connect((self.host, self.port))
             logging.info(f"Connected to server at {self.host}:{self.port}")
+            # 握手：协商编解码和分帧协议，服务器不支持 Opus 时回退到PCM；重连时带上会话令牌
+            sock.sendall(encode_hello(self.session.hello()))
+            self.session.accept_hello(read_hello(sock))
         except Exception as e:
             logging.error(f"Failed to connect to server: {e}")
+            sock.close()
             raise
+        with self.send_lock:
+            self.socket = sock
+
+    def reconnect(self) -> bool:
+        """连接断开后在 reconnect_s 内重试，成功时返回 True"""
+        deadline = time.monotonic() + self.reconnect_s
+        delay = 0.2
+        self.socket.close()
+        while not self.stop_event.is_set() and time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                self.connect()
+                logging.info(f"Reconnected in {(time.perf_counter() - start) * 1000:.0f} ms")
+                return True
+            except Exception:
+                time.sleep(delay)
+                delay = min(delay * 2, 2.0)
+        return False
 
     def disconnect(self) -> None:
         """断开与服务器的连接"""
+        self.stop_event.set()
+        self.output.stop()
         if hasattr(self, 'socket'):
             self.socket.close()
-            logging.info("Disconnected from server")
+            logging.info(f"Disconnected from server, transport stats: {self.session.stats()}")
+
+    def send(self, messages) -> None:
+        with self.send_lock:
+            try:
+                for message in messages:
+                    if message:
+                        self.socket.sendall(message)
+            except OSError:
+                if self.reconnect_s <= 0:
+                    raise
+                # 等待重连，断开期间的音频丢弃
+
+    def cancel(self) -> None:
+        """打断当前回复"""
+        self.send([self.session.cancel()])
 
     def microphone_start(self):
         import sounddevice as sd
@@ -45,7 +102,7 @@ class AudioClient:
                     print("Input buffer overflow detected. Consider increasing blocksize.")
             # Convert the audio data to a format suitable for worker.on_audio_frame
             frame = bytes(indata)
-            self.socket.sendall(frame)
+            self.send(self.session.encode_audio(frame))
 
         # 使用 RawInputStream 替换 InputStream
         send_stream = sd.RawInputStream(
@@ -58,21 +115,34 @@ class AudioClient:
         threading.Thread(target=send_stream.start).start()
 
     def play(self):
-        self._player = pyaudio.PyAudio()
-        self._stream = self._player.open(format=pyaudio.paInt16, channels=1, rate=16000, output=True)
+        """收到的音频写入抖动缓冲，由输出设备的回调按块取出播放"""
+        self.output.start()
 
-        def play_audio():
+        def receive_audio():
             while True:
                 try:
-                    response = self.socket.recv(1024)
-                    self._stream.write(response)
-                except Empty:
-                    continue
+                    response = self.socket.recv(4096)
+                    if not response:
+                        raise ConnectionError("Server closed connection")
+                    for pcm in self.session.on_stream_data(response):
+                        self.jitter.push(pcm)
                 except Exception as e:
                     print(f"Error receiving message: {e}")
+                    if self.reconnect_s > 0 and self.reconnect():
+                        continue
                     break
+            self.closed.set()
 
-        threading.Thread(target=play_audio).start()
+        def send_control():
+            while True:
+                try:
+                    self.send([self.session.outgoing.get()])
+                except Exception as e:
+                    print(f"Error sending control message: {e}")
+                    break
+
+        threading.Thread(target=receive_audio, daemon=True).start()
+        threading.Thread(target=send_control, daemon=True).start()
 
 
 def main():
@@ -87,21 +157,44 @@ def main():
     parser = argparse.ArgumentParser(description='音频客户端')
     parser.add_argument('--host', default='localhost', help='服务器地址')
     parser.add_argument('--port', type=int, default=65432, help='服务器端口')
+    parser.add_argument('--codec', default='pcm', choices=['pcm', 'opus'], help='音频编码')
+    parser.add_argument('--frame_ms', type=int, default=20, help='Opus帧长（毫秒）')
+    parser.add_argument('--output', default='pyaudio', choices=['pyaudio', 'null'], help='输出设备，null表示不播放（没有声卡时）')
+    parser.add_argument('--no_mic', action='store_true', help='不打开麦克风')
+    parser.add_argument('--block_ms', type=int, default=10, help='播放回调的块长（毫秒）')
+    parser.add_argument('--jitter_min_ms', type=int, default=20, help='抖动缓冲最小目标深度（毫秒）')
+    parser.add_argument('--jitter_max_ms', type=int, default=300, help='抖动缓冲最大目标深度（毫秒）')
+    parser.add_argument('--dtx', action='store_true', help='静音抑制，静音期间不发送音频')
+    parser.add_argument('--reconnect_s', type=float, default=30, help='连接断开后尝试重连的时长（秒），0表示不重连')
     args = parser.parse_args()
 
     # 创建客户端实例
-    client = AudioClient(host=args.host, port=args.port)
+    client = AudioClient(
+        host=args.host,
+        port=args.port,
+        codec=args.codec,
+        frame_ms=args.frame_ms,
+        output=args.output,
+        block_ms=args.block_ms,
+        jitter_min_ms=args.jitter_min_ms,
+        jitter_max_ms=args.jitter_max_ms,
+        dtx=args.dtx,
+        reconnect_s=args.reconnect_s,
+    )
 
     try:
         # 连接服务器
         client.connect()
 
         # 麦克风
-        client.microphone_start()
+        if not args.no_mic:
+            client.microphone_start()
         # 播放
         client.play()
 
-        input("按回车键停止客户端...\n")
+        # 输入 c 打断当前回复，直接回车退出
+        while input("输入 c 回车打断回复，直接回车停止客户端...\n").strip().lower() == "c":
+            client.cancel()
 
     except KeyboardInterrupt:
         logging.info("接收到停止信号")
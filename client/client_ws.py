@@ -1,39 +1,70 @@
+import argparse
+import json
 import logging
 import threading
 
-import pyaudio
-import sounddevice as sd
 from websockets.sync.client import connect
 
+from client.dtx import SilenceSuppressor
+from client.jitter_buffer import JitterBuffer, create_output
+from client.session import ClientSession
+
 
 class AudioClient:
-    def __init__(self, url: str = "ws://localhost:8765"):
+    def __init__(self, url: str = "ws://localhost:8765", codec: str = "pcm", frame_ms: int = 20,
+                 output: str = "pyaudio", block_ms: int = 10, jitter_min_ms: int = 20, jitter_max_ms: int = 300,
+                 dtx: bool = False, mic: bool = True):
         self.url = url
+        self.mic = mic
+        self.jitter = JitterBuffer(block_ms=block_ms, min_ms=jitter_min_ms, max_ms=jitter_max_ms)
+        self.output = create_output(output, self.jitter)
+        # 静音抑制：静音期间不发送音频
+        self.dtx = SilenceSuppressor() if dtx else None
+        self.session = ClientSession(codec=codec, frame_ms=frame_ms, jitter=self.jitter, dtx=self.dtx)
         self.EXPECTED_SAMPLE_RATE = 16000
 
         self.websocket = None
-        self._player = None
-        self._stream = None
+        self.closed = threading.Event()
 
-    def start(self):
-        """启动客户端"""
+    def start(self, interactive: bool = True):
+        """启动客户端，interactive=False 时一直运行到服务器关闭连接"""
         try:
             logging.info(f"连接服务器: {self.url}")
             with connect(self.url) as websocket:
                 self.websocket = websocket
                 logging.info("已连接到服务器")
+                # 握手：协商编解码和分帧协议，服务器不支持 Opus 时回退到PCM
+                websocket.send(json.dumps(self.session.hello()))
+                self.session.accept_hello(json.loads(websocket.recv()))
 
                 # 麦克风
-                threading.Thread(target=self.microphone_start, daemon=True).start()
+                if self.mic:
+                    threading.Thread(target=self.microphone_start, daemon=True).start()
                 # 播放
+                self.output.start()
                 threading.Thread(target=self.play, daemon=True).start()
+                threading.Thread(target=self.send_control, daemon=True).start()
 
-                input("按回车键停止客户端...\n")
+                if interactive:
+                    # 输入 c 打断当前回复，直接回车退出
+                    while input("输入 c 回车打断回复，直接回车停止客户端...\n").strip().lower() == "c":
+                        self.send([self.session.cancel()])
+                else:
+                    self.closed.wait()
+                logging.info(f"传输统计: {self.session.stats()}")
+                self.output.stop()
 
         except Exception as e:
             logging.error(f"连接错误: {e}")
 
+    def send(self, messages) -> None:
+        for message in messages:
+            if message:
+                self.websocket.send(message)
+
     def microphone_start(self):
+        import sounddevice as sd
+
         def callback(indata, frames: int, time, status):
             if status:
                 print("status", status)
@@ -41,7 +72,7 @@ class AudioClient:
                     print("Input buffer overflow detected. Consider increasing blocksize.")
             # Convert the audio data to a format suitable for worker.on_audio_frame
             frame = bytes(indata)
-            self.websocket.send(frame)
+            self.send(self.session.encode_audio(frame))
 
         # 使用 RawInputStream 替换 InputStream
         send_stream = sd.RawInputStream(
@@ -53,16 +84,29 @@ class AudioClient:
         send_stream.start()
 
     def play(self):
-        self._player = pyaudio.PyAudio()
-        self._stream = self._player.open(format=pyaudio.paInt16, channels=1, rate=16000, output=True)
+        """收到的音频写入抖动缓冲，由输出设备的回调按块取出播放"""
+        try:
+            while True:
+                try:
+                    response = self.websocket.recv()
+                    for pcm in self.session.on_message(response):
+                        self.jitter.push(pcm)
+                except Exception as e:
+                    print(f"Error receiving message: {e}")
+                    break
+        finally:
+            self.closed.set()
+
+    def send_control(self):
+        """发送播放确认等控制消息"""
         while True:
             try:
-                response = self.websocket.recv()
-                self._stream.write(response)
+                self.send([self.session.outgoing.get()])
             except Exception as e:
-                print(f"Error receiving message: {e}")
+                print(f"Error sending control message: {e}")
                 break
 
+
 def main():
     """主函数"""
     logging.basicConfig(
@@ -71,7 +115,29 @@ def main():
         encoding='utf-8'
     )
     
-    client = AudioClient()
+    parser = argparse.ArgumentParser(description='WebSocket音频客户端')
+    parser.add_argument('--url', default='ws://localhost:8765', help='服务器地址')
+    parser.add_argument('--codec', default='pcm', choices=['pcm', 'opus'], help='音频编码')
+    parser.add_argument('--frame_ms', type=int, default=20, help='Opus帧长（毫秒）')
+    parser.add_argument('--output', default='pyaudio', choices=['pyaudio', 'null'], help='输出设备，null表示不播放（没有声卡时）')
+    parser.add_argument('--no_mic', action='store_true', help='不打开麦克风')
+    parser.add_argument('--block_ms', type=int, default=10, help='播放回调的块长（毫秒）')
+    parser.add_argument('--jitter_min_ms', type=int, default=20, help='抖动缓冲最小目标深度（毫秒）')
+    parser.add_argument('--jitter_max_ms', type=int, default=300, help='抖动缓冲最大目标深度（毫秒）')
+    parser.add_argument('--dtx', action='store_true', help='静音抑制，静音期间不发送音频')
+    args = parser.parse_args()
+
+    client = AudioClient(
+        url=args.url,
+        codec=args.codec,
+        frame_ms=args.frame_ms,
+        output=args.output,
+        block_ms=args.block_ms,
+        jitter_min_ms=args.jitter_min_ms,
+        jitter_max_ms=args.jitter_max_ms,
+        dtx=args.dtx,
+        mic=not args.no_mic,
+    )
     try:
         client.start()
     except KeyboardInterrupt:
@@ -7,13 +7,17 @@ from threading import Event
 
 import pyaudio
 
+from client.dtx import SilenceSuppressor
+
 
 class AudioClient:
     """音频客户端，用于发送音频数据到服务器"""
 
-    def __init__(self, host: str = "localhost", port: int = 65432):
+    def __init__(self, host: str = "localhost", port: int = 65432, dtx: bool = False):
         self.host = host
         self.port = port
+        # 静音抑制：原始PCM协议无法发送静音标记，说话结束后的 hangover 让服务器VAD看到尾部静音
+        self.dtx = SilenceSuppressor() if dtx else None
         self.stop_event = Event()
         self.audio_queue = Queue()
         self.EXPECTED_SAMPLE_RATE = 16000  # 添加 EXPECTED_SAMPLE_RATE 常量
@@ -35,6 +39,8 @@ class AudioClient:
         if hasattr(self, 'socket'):
             self.socket.close()
             logging.info("Disconnected from server")
+            if self.dtx is not None:
+                logging.info(f"DTX stats: {self.dtx.stats()}")
 
     def microphone_start(self):
         import sounddevice as sd
@@ -45,7 +51,12 @@ class AudioClient:
                     print("Input buffer overflow detected. Consider increasing blocksize.")
             # Convert the audio data to a format suitable for worker.on_audio_frame
             frame = bytes(indata)
-            self.socket.sendall(frame)
+            if self.dtx is None:
+                self.socket.sendall(frame)
+                return
+            blocks, _ = self.dtx.process(frame)
+            for _, block in blocks:
+                self.socket.sendall(block)
 
         # 使用 RawInputStream 替换 InputStream
         send_stream = sd.RawInputStream(
@@ -87,10 +98,11 @@ def main():
     parser = argparse.ArgumentParser(description='音频客户端')
     parser.add_argument('--host', default='localhost', help='服务器地址')
     parser.add_argument('--port', type=int, default=65432, help='服务器端口')
+    parser.add_argument('--dtx', action='store_true', help='静音抑制，静音期间不发送音频')
     args = parser.parse_args()
 
     # 创建客户端实例
-    client = AudioClient(host=args.host, port=args.port)
+    client = AudioClient(host=args.host, port=args.port, dtx=args.dtx)
 
     try:
         # 连接服务器
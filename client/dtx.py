@@ -0,0 +1,115 @@
+import math
+from collections import deque
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from utils.protocol import now_us
+
+SAMPLE_RATE = 16000
+
+
+class SilenceSuppressor:
+    """
+    客户端静音抑制（DTX）
+
+    按块计算音量（dBFS），跟踪背景噪声，音量高于 max(噪声 + margin_db, min_threshold_db)
+    视为说话。说话结束后继续发送 hangover_ms，让服务器 VAD 看到足够的尾部静音，然后停止发送；
+    静音期间保留最近 preroll_ms 的音频，重新开始说话时连同这部分一起发送，避免切掉开头。
+    """
+
+    def __init__(
+            self,
+            min_threshold_db: float = -50.0,
+            margin_db: float = 10.0,
+            hangover_ms: int = 400,
+            preroll_ms: int = 200,
+    ):
+        """
+        Args:
+            min_threshold_db: 最低的说话音量阈值
+            margin_db: 说话音量高于背景噪声的幅度
+            hangover_ms: 说话结束后继续发送的时长
+            preroll_ms: 静音期间保留的音频时长
+        """
+        self.min_threshold_db = min_threshold_db
+        self.margin_db = margin_db
+        self.hangover_ms = hangover_ms
+        self.preroll_ms = preroll_ms
+
+        self.noise_db = min_threshold_db - margin_db
+        self.active = True  # 是否正在发送
+        self._silent_ms = 0.0
+        self._preroll: deque = deque()
+        self._preroll_duration = 0.0
+
+        self.sent_ms = 0.0
+        self.suppressed_ms = 0.0
+
+    @staticmethod
+    def level_db(pcm: bytes) -> float:
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+        rms = math.sqrt(float(np.mean(samples * samples))) if samples.size else 0.0
+        return 20 * math.log10(max(rms, 1.0) / 32768)
+
+    def _update_noise(self, level: float) -> None:
+        # 噪声估计下降快、上升慢
+        if level < self.noise_db:
+            self.noise_db += (level - self.noise_db) * 0.5
+        else:
+            self.noise_db += (level - self.noise_db) * 0.01
+
+    def process(self, pcm: bytes, capture_us: Optional[int] = None) -> Tuple[List[Tuple[int, bytes]], bool]:
+        """
+        处理一块麦克风音频
+
+        Returns:
+            (需要发送的 [(采集时间戳, 音频)], 是否刚进入静音)
+        """
+        if capture_us is None:
+            capture_us = now_us()
+        duration = len(pcm) / 2 / SAMPLE_RATE * 1000
+        level = self.level_db(pcm)
+        speech = level > max(self.noise_db + self.margin_db, self.min_threshold_db)
+        if not speech:
+            self._update_noise(level)
+
+        if self.active:
+            self._silent_ms = 0.0 if speech else self._silent_ms + duration
+            if self._silent_ms <= self.hangover_ms:
+                self.sent_ms += duration
+                return [(capture_us, pcm)], False
+            self.active = False
+            self._remember(capture_us, pcm, duration)
+            return [], True
+
+        if not speech:
+            self._remember(capture_us, pcm, duration)
+            return [], False
+
+        # 重新开始说话，补发 pre-roll
+        self.active = True
+        self._silent_ms = 0.0
+        blocks = list(self._preroll) + [(capture_us, pcm)]
+        self.suppressed_ms -= self._preroll_duration
+        self.sent_ms += self._preroll_duration + duration
+        self._preroll.clear()
+        self._preroll_duration = 0.0
+        return blocks, False
+
+    def _remember(self, capture_us: int, pcm: bytes, duration: float) -> None:
+        self.suppressed_ms += duration
+        self._preroll.append((capture_us, pcm))
+        self._preroll_duration += duration
+        while self._preroll and self._preroll_duration - len(self._preroll[0][1]) / 2 / SAMPLE_RATE * 1000 >= self.preroll_ms:
+            _, dropped = self._preroll.popleft()
+            self._preroll_duration -= len(dropped) / 2 / SAMPLE_RATE * 1000
+
+    def stats(self) -> dict:
+        total = self.sent_ms + self.suppressed_ms
+        return {
+            "dtx_sent_ms": self.sent_ms,
+            "dtx_suppressed_ms": self.suppressed_ms,
+            "dtx_suppressed_ratio": self.suppressed_ms / total if total else 0.0,
+            "dtx_noise_db": self.noise_db,
+        }
@@ -0,0 +1,237 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Any, Optional
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+BYTES_PER_MS = SAMPLE_RATE * SAMPLE_WIDTH // 1000
+
+
+class JitterBuffer:
+    """
+    播放端的自适应抖动缓冲
+
+    网络线程调用 push 写入收到的 PCM，音频回调调用 read 取出固定大小的块。
+    每块音频的迟到时间 = 到达时间 - 按音频时长推算的应到时间（以本段最早的一块为基准），
+    目标缓冲深度取最近 window 块迟到时间的 quantile 分位数再加一个播放块，限制在
+    [min_ms, max_ms]。缓冲为空时先攒到目标深度再开始播放；缓冲超过目标较多时每次
+    少量丢弃，让延迟慢慢回落。另外按 RFC 3550 的方法统计到达抖动用于报告。
+    """
+
+    def __init__(
+            self,
+            block_ms: int = 10,
+            min_ms: int = 20,
+            max_ms: int = 300,
+            quantile: float = 0.95,
+            window: int = 200,
+            drift_ms: int = 60,
+    ):
+        """
+        Args:
+            block_ms: 音频回调每次取出的时长
+            min_ms: 最小目标缓冲深度
+            max_ms: 最大目标缓冲深度
+            quantile: 目标深度覆盖的迟到时间分位数
+            window: 统计迟到时间的块数
+            drift_ms: 缓冲超过目标深度多少时开始丢弃音频
+        """
+        self.block_bytes = block_ms * BYTES_PER_MS
+        self.block_ms = block_ms
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.quantile = quantile
+        self.drift_ms = drift_ms
+
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self.playing = False  # 是否在输出缓冲中的音频（否则在攒缓冲）
+        self.ending = False  # 本段音频已全部收到，播完不算欠载
+
+        # 开始输出真实音频、一段音频完整播完时的回调（在音频回调线程中执行）
+        self.on_start: Optional[Callable[[], None]] = None
+        self.on_drain: Optional[Callable[[], None]] = None
+
+        self.jitter_ms = 0.0
+        self._last_arrival = None
+        self._last_duration_ms = 0.0
+        self._media_ms = 0.0  # 本段已收到的音频时长
+        self._base_ms = None  # 本段 (到达时间 - 音频时间) 的最小值
+        self._segment_ended = False
+        self._lateness = deque(maxlen=window)
+        self._target_ms = float(min_ms)
+
+        self.underruns = 0
+        self.dropped_ms = 0.0
+        self._delay_sum = 0.0
+        self._delay_count = 0
+
+    @property
+    def target_ms(self) -> float:
+        return self._target_ms
+
+    def _update_target(self) -> None:
+        ordered = sorted(self._lateness)
+        lateness = ordered[min(int(len(ordered) * self.quantile), len(ordered) - 1)]
+        self._target_ms = min(max(lateness + self.block_ms, self.min_ms), self.max_ms)
+
+    @property
+    def depth_ms(self) -> float:
+        return len(self._buffer) / BYTES_PER_MS
+
+    def push(self, pcm: bytes, arrival: Optional[float] = None) -> None:
+        """写入收到的音频，arrival 为到达时间（秒），默认当前时间"""
+        if not pcm:
+            return
+        if arrival is None:
+            arrival = time.monotonic()
+        duration_ms = len(pcm) / BYTES_PER_MS
+        arrival_ms = arrival * 1000
+        with self._lock:
+            new_segment = (self._last_arrival is None or self._segment_ended
+                           or (arrival - self._last_arrival) * 1000 - self._last_duration_ms > 1000)
+            self._segment_ended = False
+            if new_segment:
+                # 上一段已结束或间隔超过 1 秒，视为新的一段回复，重新计算应到时间
+                self._media_ms = 0.0
+                self._base_ms = None
+            else:
+                deviation = (arrival - self._last_arrival) * 1000 - self._last_duration_ms
+                self.jitter_ms += (abs(deviation) - self.jitter_ms) / 16
+
+            relative = arrival_ms - self._media_ms
+            if self._base_ms is None or relative < self._base_ms:
+                self._base_ms = relative
+            self._lateness.append(relative - self._base_ms)
+            self._update_target()
+            self._media_ms += duration_ms
+            self._last_arrival = arrival
+            self._last_duration_ms = duration_ms
+            self._buffer += pcm
+            self.ending = False
+
+    def mark_end(self) -> None:
+        """本段音频已全部收到，之后播空不算欠载，并立即开始播放剩余部分"""
+        with self._lock:
+            drained = not self._buffer
+            self.ending = not drained
+            self._segment_ended = True
+        if drained and self.on_drain:
+            self.on_drain()
+
+    def clear(self) -> None:
+        """丢弃缓冲中的音频（取消或打断）"""
+        with self._lock:
+            self._buffer.clear()
+            self.playing = False
+            self.ending = False
+            self._segment_ended = True
+
+    def read(self, size: Optional[int] = None) -> bytes:
+        """音频回调取出 size 字节，数据不足时补静音"""
+        size = size or self.block_bytes
+        started = drained = False
+        with self._lock:
+            if not self.playing:
+                if not self._buffer or (self.depth_ms < self.target_ms and not self.ending):
+                    return bytes(size)
+                self.playing = started = True
+
+            self._delay_sum += self.depth_ms
+            self._delay_count += 1
+            excess = self.depth_ms - self.target_ms - self.drift_ms
+            if excess > 0 and not self.ending:
+                # 每次最多丢弃块长的十分之一，相当于加速 10% 播放，避免明显的跳变
+                drop = min(int(excess), max(self.block_ms // 10, 1)) * BYTES_PER_MS
+                del self._buffer[:drop]
+                self.dropped_ms += drop / BYTES_PER_MS
+
+            data = bytes(self._buffer[:size])
+            del self._buffer[:size]
+            if not self._buffer:
+                self.playing = False
+                if self.ending:
+                    drained = True
+                else:
+                    self.underruns += 1
+                self.ending = False
+
+        if started and self.on_start:
+            self.on_start()
+        if drained and self.on_drain:
+            self.on_drain()
+        if len(data) < size:
+            data += bytes(size - len(data))
+        return data
+
+    def stats(self) -> Dict[str, Any]:
+        """获取播放延迟和欠载统计"""
+        return {
+            "playout_delay_ms": self._delay_sum / self._delay_count if self._delay_count else 0.0,
+            "jitter_ms": self.jitter_ms,
+            "target_ms": self.target_ms,
+            "underruns": self.underruns,
+            "dropped_ms": self.dropped_ms,
+        }
+
+
+class NullOutput:
+    """没有声卡时的输出设备：按实时速度从抖动缓冲取出音频并丢弃"""
+
+    def __init__(self, jitter: JitterBuffer):
+        self.jitter = jitter
+        self._stop = threading.Event()
+
+    def start(self) -> None:
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        interval = self.jitter.block_ms / 1000
+        next_time = time.monotonic()
+        while not self._stop.is_set():
+            self.jitter.read()
+            next_time += interval
+            time.sleep(max(0.0, next_time - time.monotonic()))
+
+
+class PyAudioOutput:
+    """PyAudio 回调模式输出，每次回调从抖动缓冲取出 block_ms 的音频"""
+
+    def __init__(self, jitter: JitterBuffer):
+        self.jitter = jitter
+        self._player = None
+        self._stream = None
+
+    def start(self) -> None:
+        import pyaudio
+
+        def callback(in_data, frame_count, time_info, status):
+            return self.jitter.read(frame_count * SAMPLE_WIDTH), pyaudio.paContinue
+
+        self._player = pyaudio.PyAudio()
+        self._stream = self._player.open(
+            format=pyaudio.paInt16,
+            channels=1,
+            rate=SAMPLE_RATE,
+            output=True,
+            frames_per_buffer=self.jitter.block_bytes // SAMPLE_WIDTH,
+            stream_callback=callback,
+        )
+        self._stream.start_stream()
+
+    def stop(self) -> None:
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._player.terminate()
+
+
+def create_output(name: str, jitter: JitterBuffer):
+    """创建输出设备：pyaudio 为声卡，null 为没有声卡时的模拟输出"""
+    if name == "null":
+        return NullOutput(jitter)
+    return PyAudioOutput(jitter)
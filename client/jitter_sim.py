@@ -0,0 +1,148 @@
+"""
+不需要声卡和真实服务器的抖动缓冲测试
+
+启动一个模拟服务器，按实时速度发送若干段回复音频（分帧协议），每帧叠加随机的网络延迟
+（指数分布，另有少量尖峰），然后用 null 输出设备运行 socket 或 websocket 客户端，
+打印播放延迟、抖动估计和欠载次数。
+
+用法：
+    python -m client.jitter_sim --transport socket --jitter_ms 30
+    python -m client.jitter_sim --transport ws --jitter_ms 80 --spike_prob 0.02
+"""
+import argparse
+import json
+import logging
+import math
+import random
+import socket
+import threading
+import time
+from array import array
+from typing import Callable, List
+
+from client.jitter_buffer import SAMPLE_RATE
+from utils.audio_codec import encode_hello, read_hello
+from utils.protocol import ControlEvent, FrameReader, FrameType, FrameWriter
+
+
+def tone(seconds: float, frequency: float = 440.0) -> bytes:
+    samples = array("h", (int(8000 * math.sin(2 * math.pi * frequency * i / SAMPLE_RATE))
+                          for i in range(int(seconds * SAMPLE_RATE))))
+    return samples.tobytes()
+
+
+def jittered_schedule(count: int, frame_ms: int, jitter_ms: float, spike_prob: float, rng: random.Random) -> List[float]:
+    """每帧的发送时间（秒）：实时进度加随机延迟，保持顺序"""
+    times, last = [], 0.0
+    for i in range(count):
+        delay = rng.expovariate(1 / jitter_ms) if jitter_ms > 0 else 0.0
+        if rng.random() < spike_prob:
+            delay += jitter_ms * 5
+        last = max(last, i * frame_ms / 1000 + delay / 1000)
+        times.append(last)
+    return times
+
+
+def serve_turns(send: Callable[[bytes], None], args: argparse.Namespace) -> None:
+    """发送 args.turns 段回复"""
+    rng = random.Random(args.seed)
+    writer = FrameWriter()
+    frame_bytes = SAMPLE_RATE * args.frame_ms // 1000 * 2
+    pcm = tone(args.reply_s)
+    frames = [pcm[i:i + frame_bytes] for i in range(0, len(pcm), frame_bytes)]
+    for _ in range(args.turns):
+        send(writer.control(ControlEvent.TURN_START))
+        start = time.monotonic()
+        for send_at, frame in zip(jittered_schedule(len(frames), args.frame_ms, args.jitter_ms, args.spike_prob, rng), frames):
+            time.sleep(max(0.0, start + send_at - time.monotonic()))
+            send(writer.audio(frame))
+        send(writer.control(ControlEvent.TURN_END))
+        time.sleep(args.gap_s)
+
+
+def log_controls(frames) -> None:
+    for frame in frames:
+        if frame.type == FrameType.CONTROL:
+            logging.info(f"客户端控制消息: {frame.control()}")
+
+
+def run_socket(args: argparse.Namespace):
+    from client.client_socket import AudioClient
+
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    port = listener.getsockname()[1]
+
+    def server():
+        conn, _ = listener.accept()
+        read_hello(conn)
+        conn.sendall(encode_hello({"codec": "pcm", "sample_rate": SAMPLE_RATE, "protocol": "framed"}))
+
+        def receive():
+            reader = FrameReader()
+            while data := conn.recv(4096):
+                log_controls(reader.feed(data))
+
+        threading.Thread(target=receive, daemon=True).start()
+        serve_turns(conn.sendall, args)
+        conn.shutdown(socket.SHUT_RDWR)
+        conn.close()
+        listener.close()
+
+    threading.Thread(target=server, daemon=True).start()
+    client = AudioClient(port=port, output="null", block_ms=args.block_ms)
+    client.connect()
+    client.play()
+    client.closed.wait()
+    client.disconnect()
+    return client.session.stats()
+
+
+def run_ws(args: argparse.Namespace):
+    from websockets.sync.server import serve
+
+    from client.client_ws import AudioClient
+    from utils.protocol import unpack_frame
+
+    def handler(websocket):
+        websocket.recv()
+        websocket.send(json.dumps({"codec": "pcm", "sample_rate": SAMPLE_RATE, "protocol": "framed"}))
+
+        def receive():
+            for message in websocket:
+                log_controls([unpack_frame(message)])
+
+        threading.Thread(target=receive, daemon=True).start()
+        serve_turns(websocket.send, args)
+
+    with serve(handler, "127.0.0.1", 0, compression=None) as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.socket.getsockname()[1]
+        client = AudioClient(url=f"ws://127.0.0.1:{port}", output="null", block_ms=args.block_ms, mic=False)
+        client.start(interactive=False)
+        server.shutdown()
+    return client.session.stats()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s|%(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description='抖动缓冲模拟测试')
+    parser.add_argument('--transport', default='socket', choices=['socket', 'ws'], help='使用的客户端')
+    parser.add_argument('--jitter_ms', type=float, default=30, help='平均网络延迟抖动（毫秒）')
+    parser.add_argument('--spike_prob', type=float, default=0.01, help='每帧出现延迟尖峰的概率')
+    parser.add_argument('--frame_ms', type=int, default=20, help='服务器发送的帧长（毫秒）')
+    parser.add_argument('--block_ms', type=int, default=10, help='播放回调的块长（毫秒）')
+    parser.add_argument('--reply_s', type=float, default=3, help='每段回复的时长（秒）')
+    parser.add_argument('--gap_s', type=float, default=0.5, help='两段回复之间的间隔（秒）')
+    parser.add_argument('--turns', type=int, default=3, help='回复段数')
+    parser.add_argument('--seed', type=int, default=0, help='随机种子')
+    args = parser.parse_args()
+
+    stats = run_socket(args) if args.transport == 'socket' else run_ws(args)
+    keys = ("playout_delay_ms", "jitter_ms", "target_ms", "underruns", "dropped_ms")
+    print(json.dumps({key: stats[key] for key in keys}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
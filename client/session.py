@@ -0,0 +1,180 @@
+import logging
+from queue import Queue
+from typing import Any, Dict, List, Optional
+
+from client.dtx import SilenceSuppressor
+from client.jitter_buffer import JitterBuffer
+from utils.audio_codec import PcmCodec, negotiate_codec
+from utils.protocol import ControlEvent, Frame, FrameReader, FrameType, FrameWriter, LateFrameFilter, now_us, \
+    unpack_frame
+
+
+class ClientSession:
+    """
+    客户端的协议状态，由 socket 和 websocket 客户端共用
+
+    负责握手、上行音频分帧（携带序号和采集时间戳）、下行帧解析、丢弃迟到或已取消的
+    音频，以及回传播放确认（playback_started / playback_done）。
+
+    给定 jitter 时，播放确认由抖动缓冲在真正开始播放和播完时触发；给定 dtx 时，
+    静音期间不发送音频，进入静音时发送 silence 控制消息。
+
+    服务器在握手回复中给出会话令牌，断线重连时放在握手消息中（resume），服务器还保留着
+    会话时接回原来的对话，下行帧序号接着之前的；会话已经过期时服务器开始新会话，这里也重新开始。
+    """
+
+    def __init__(self, codec: str = "pcm", frame_ms: int = 20, max_late_ms: float = 500,
+                 jitter: Optional[JitterBuffer] = None, dtx: Optional[SilenceSuppressor] = None):
+        self.requested = {"codec": codec, "frame_ms": frame_ms, "protocol": "framed"}
+        self.codec = PcmCodec()
+        self.framed = False
+        self.reader = FrameReader()
+        self.writer = FrameWriter()
+        self.max_late_ms = max_late_ms
+        self.late_filter = LateFrameFilter(max_late_ms)
+        self.token = None  # 会话恢复令牌
+        self.resumes = 0
+
+        self.playing = False  # 当前回复是否已经开始播放
+        self.dropping = False  # 取消后丢弃旧回复的音频，直到下一个 turn_start
+        # 待发送的控制消息，播放确认可能在音频回调线程中产生，由客户端的发送线程取出
+        self.outgoing = Queue()
+
+        self.dtx = dtx
+        self.jitter = jitter
+        if jitter is not None:
+            jitter.on_start = self.on_played
+            jitter.on_drain = self.on_drained
+
+    def hello(self) -> Dict[str, Any]:
+        if self.token:
+            return {**self.requested, "resume": self.token}
+        return self.requested
+
+    def accept_hello(self, reply: Dict[str, Any]) -> None:
+        if reply.get("error"):
+            raise ConnectionRefusedError(f"Server rejected connection: {reply}")
+        # 旧连接中不完整的帧不要了
+        self.reader = FrameReader()
+        if reply.get("resumed"):
+            # 编解码状态和帧序号接着之前的
+            self.resumes += 1
+        else:
+            if self.token:
+                # 原来的会话已经过期，服务器的帧序号从头开始
+                self.late_filter = LateFrameFilter(self.max_late_ms)
+                self.dropping = False
+                self.playing = False
+            self.codec = negotiate_codec(reply)
+            self.framed = reply.get("protocol") == "framed"
+        self.token = reply.get("session_token")
+        logging.info(f"Negotiated transport: {reply}")
+
+    def encode_audio(self, pcm: bytes) -> List[bytes]:
+        """编码一块麦克风音频，返回待发送的消息"""
+        capture_us = now_us()
+        if self.dtx is None:
+            return self._encode(pcm, capture_us)
+        blocks, silence = self.dtx.process(pcm, capture_us)
+        messages = []
+        for block_capture_us, block in blocks:
+            messages += self._encode(block, block_capture_us)
+        if silence:
+            # 发出编码器中剩余不足一帧的数据
+            pending_us = int(self.codec.pending_ms() * 1000)
+            messages += self._packets(self.codec.flush(), capture_us - pending_us)
+            # 时间戳为第一块没有发送的音频的采集时间，服务器据此计算静音时长
+            message = self.control(ControlEvent.SILENCE, timestamp_us=capture_us)
+            if message is not None:
+                messages.append(message)
+        return messages
+
+    def _encode(self, pcm: bytes, capture_us: int) -> List[bytes]:
+        # 编码器中上一块剩下的数据先于本块采集
+        start_us = capture_us - int(self.codec.pending_ms() * 1000)
+        return self._packets(self.codec.encode(pcm), start_us)
+
+    def _packets(self, packets: List[bytes], start_us: int) -> List[bytes]:
+        """
+        Args:
+            start_us: 第一个包的第一个采样的采集时间戳。pre-roll 补发的块带着原来的采集时间，
+                之后的包按编码帧长依次后推
+        """
+        if not self.framed:
+            return packets
+        frame_us = self.codec.frame_ms * 1000
+        return [self.writer.audio(packet, start_us + i * frame_us) for i, packet in enumerate(packets)]
+
+    def control(self, event: str, timestamp_us: Optional[int] = None, **fields) -> Optional[bytes]:
+        if not self.framed:
+            return None
+        return self.writer.control(event, timestamp_us, **fields)
+
+    def cancel(self) -> Optional[bytes]:
+        """取消当前回复，返回待发送的取消消息"""
+        self.dropping = True
+        if self.jitter is not None:
+            self.jitter.clear()
+        return self.control(ControlEvent.CANCEL)
+
+    def on_stream_data(self, data: bytes) -> List[bytes]:
+        """处理从 TCP 字节流收到的数据，返回需要播放的 PCM"""
+        if not self.framed:
+            return [self.codec.decode(data)]
+        pcm = []
+        for frame in self.reader.feed(data):
+            pcm += self.on_frame(frame)
+        return pcm
+
+    def on_message(self, data) -> List[bytes]:
+        """处理从 websocket 收到的一条消息，返回需要播放的 PCM"""
+        if not self.framed:
+            return [self.codec.decode(data)]
+        return self.on_frame(unpack_frame(data))
+
+    def on_frame(self, frame: Frame) -> List[bytes]:
+        if frame.type == FrameType.AUDIO:
+            if self.dropping or not self.late_filter.accept(frame):
+                return []
+            return [self.codec.decode(frame.payload)]
+
+        message = frame.control()
+        event = message.get("event")
+        if event == ControlEvent.TURN_START:
+            self.dropping = False
+            self.playing = False
+        elif event == ControlEvent.TRANSCRIPT:
+            logging.info(f"识别结果: {message.get('text')}")
+        elif event == ControlEvent.TURN_END:
+            if self.jitter is not None:
+                # 缓冲播完时再回传 playback_done
+                self.jitter.mark_end()
+            else:
+                # 之前收到的音频都已经交给播放设备
+                self.on_drained()
+        return []
+
+    def on_played(self) -> None:
+        """写入播放设备后调用，本轮第一次播放时发送 playback_started"""
+        if not self.playing:
+            self.playing = True
+            self._send_control(ControlEvent.PLAYBACK_STARTED)
+
+    def on_drained(self) -> None:
+        """本轮回复播放完毕"""
+        if self.playing:
+            self.playing = False
+            self._send_control(ControlEvent.PLAYBACK_DONE)
+
+    def _send_control(self, event: str) -> None:
+        message = self.control(event)
+        if message is not None:
+            self.outgoing.put(message)
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {**self.codec.stats(client=True), "late_frames_dropped": self.late_filter.dropped, "resumes": self.resumes}
+        if self.jitter is not None:
+            stats.update(self.jitter.stats())
+        if self.dtx is not None:
+            stats.update(self.dtx.stats())
+        return stats
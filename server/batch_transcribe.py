@@ -0,0 +1,318 @@
+"""
+离线批量转写
+
+不经过实时管道，直接对录音文件做离线（非流式）FSMN-VAD 分段，把分段按批送入 SenseVoice，
+多个进程并行处理不同的文件，结果以 JSONL 写出（每行一段：文件、起止毫秒、文本）。
+
+- 16 位 PCM 的 16kHz WAV 用内存映射读取，其他格式（OGG、其他采样率）用 soundfile 按窗口读取并重采样
+- 长文件按 window_s 分窗做 VAD，跨窗口的语音段并入下一窗，内存占用与文件长度无关
+- 进度文件（输出路径 + ".progress"）记录已完成的文件和输出文件的长度，中断后重新运行会截掉
+  未完成文件写了一半的输出并跳过已完成的文件
+- 结束时报告吞吐：音频小时数 / 墙上时间小时数 / 使用的 CPU 核数
+
+用法：
+    python -m server.batch_transcribe calls/ --output transcripts.jsonl --workers 8
+"""
+import argparse
+import json
+import logging
+import os
+import struct
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass
+from math import gcd
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from utils.audio_buffer import split_utterance
+
+SAMPLE_RATE = 16000
+AUDIO_EXTENSIONS = (".wav", ".ogg", ".oga", ".flac")
+
+
+@dataclass
+class BatchOptions:
+    language: str = "zh"
+    batch_size: int = 16  # 每次送入 SenseVoice 的分段数
+    max_segment_s: float = 20.0  # 分段的最大长度，合并和拆分都以此为上限
+    merge_gap_ms: float = 300  # 间隔小于该值的相邻分段合并
+    window_s: float = 300.0  # 每次 VAD 处理的音频长度
+    threads_per_worker: int = 1
+
+
+class AudioSource:
+    """16kHz 单声道 float32 音频，按采样位置读取"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._pcm = _map_wav(path)
+        if self._pcm is not None:
+            self._file = None
+            self._rate = SAMPLE_RATE
+            self.frames = self._pcm.shape[0]
+        else:
+            import soundfile
+
+            self._file = soundfile.SoundFile(path)
+            self._rate = self._file.samplerate
+            self.frames = self._file.frames * SAMPLE_RATE // self._rate
+
+    @property
+    def duration(self) -> float:
+        return self.frames / SAMPLE_RATE
+
+    def read(self, start: int, end: int) -> np.ndarray:
+        end = min(end, self.frames)
+        if start >= end:
+            return np.zeros(0, dtype=np.float32)
+        if self._pcm is not None:
+            data = np.asarray(self._pcm[start:end], dtype=np.float32)
+            return (data.mean(axis=1) if data.ndim > 1 else data) / 32768.0
+
+        from scipy.signal import resample_poly
+
+        self._file.seek(start * self._rate // SAMPLE_RATE)
+        data = self._file.read(end * self._rate // SAMPLE_RATE - start * self._rate // SAMPLE_RATE,
+                               dtype="float32", always_2d=True).mean(axis=1)
+        if self._rate != SAMPLE_RATE:
+            factor = gcd(SAMPLE_RATE, self._rate)
+            data = resample_poly(data, SAMPLE_RATE // factor, self._rate // factor).astype(np.float32)
+        return data
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self._pcm = None
+
+
+def _map_wav(path: str) -> Optional[np.memmap]:
+    """16kHz 16 位 PCM WAV 的数据块映射为 int16 数组（多声道为二维），其他格式返回 None"""
+    if not path.lower().endswith(".wav"):
+        return None
+    with open(path, "rb") as f:
+        header = f.read(12)
+        if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+            return None
+        fmt = None
+        while True:
+            chunk = f.read(8)
+            if len(chunk) < 8:
+                return None
+            chunk_id, size = struct.unpack("<4sI", chunk)
+            if chunk_id == b"fmt ":
+                fmt = struct.unpack("<HHIIHH", f.read(16))
+                f.seek(size - 16 + (size & 1), os.SEEK_CUR)
+            elif chunk_id == b"data":
+                offset = f.tell()
+                break
+            else:
+                f.seek(size + (size & 1), os.SEEK_CUR)
+    if fmt is None:
+        return None
+    audio_format, channels, rate, _, _, bits = fmt
+    if audio_format != 1 or rate != SAMPLE_RATE or bits != 16:
+        return None
+    # 录音中断时头中的长度可能不对，以文件实际长度为准
+    frames = min(size, os.path.getsize(path) - offset) // (2 * channels)
+    if frames <= 0:
+        return None
+    return np.memmap(path, dtype="<i2", mode="r", offset=offset, shape=(frames, channels) if channels > 1 else (frames,))
+
+
+def merge_segments(segments: List[Tuple[int, int]], max_ms: float, gap_ms: float) -> List[Tuple[int, int]]:
+    """合并间隔很短的相邻分段，合并后不超过 max_ms"""
+    merged: List[List[int]] = []
+    for beg, end in segments:
+        if merged and beg - merged[-1][1] <= gap_ms and end - merged[-1][0] <= max_ms:
+            merged[-1][1] = end
+        else:
+            merged.append([beg, end])
+    return [(beg, end) for beg, end in merged]
+
+
+# 工作进程中的模型，由 _init_worker 加载
+_models: Dict[str, Any] = {}
+
+
+def _init_worker(options: BatchOptions) -> None:
+    import torch
+
+    from server.modules.asr_handler import load_asr_model
+    from server.modules.vad_handler import load_vad_model
+
+    torch.set_num_threads(options.threads_per_worker)
+    # 离线分段使用模型自带的尾部静音判断，单段不超过 max_segment_s
+    _models["vad"] = load_vad_model(max_end_silence_time=800,
+                                    max_single_segment_time=int(options.max_segment_s * 1000))
+    _models["asr"] = load_asr_model()
+
+
+def _vad_windows(source: AudioSource, options: BatchOptions) -> Iterator[Tuple[int, List[Tuple[int, int]]]]:
+    """按窗口做 VAD，产出 (窗口起始采样, 窗口内的分段毫秒列表)；延伸到窗口末尾的分段留给下一个窗口"""
+    window = int(options.window_s * SAMPLE_RATE)
+    start = 0
+    while start < source.frames:
+        audio = source.read(start, start + window)
+        result = _models["vad"].generate(input=audio)
+        segments = [(beg, end) for beg, end in result[0]["value"]] if result else []
+        next_start = start + audio.shape[0]
+        if next_start < source.frames and segments and segments[-1][1] >= audio.shape[0] * 1000 // SAMPLE_RATE - 50:
+            carried = start + segments[-1][0] * SAMPLE_RATE // 1000
+            if carried > start:
+                segments.pop()
+                next_start = carried
+        yield start, segments
+        start = next_start
+
+
+def transcribe_file(path: str, options: BatchOptions) -> Dict[str, Any]:
+    """在工作进程中转写一个文件，返回文件时长、分段结果和耗时"""
+    from server.modules.asr_handler import transcribe_batch
+
+    started = time.monotonic()
+    source = AudioSource(path)
+    results = []
+    try:
+        for window_start, segments in _vad_windows(source, options):
+            base_ms = window_start * 1000 // SAMPLE_RATE
+            pieces = []
+            for beg, end in merge_segments(segments, options.max_segment_s * 1000, options.merge_gap_ms):
+                audio = source.read(window_start + beg * SAMPLE_RATE // 1000, window_start + end * SAMPLE_RATE // 1000)
+                offset = beg
+                for chunk in split_utterance(audio, options.max_segment_s):
+                    length = chunk.shape[0] * 1000 // SAMPLE_RATE
+                    pieces.append((base_ms + offset, base_ms + offset + length, chunk))
+                    offset += length
+            for i in range(0, len(pieces), options.batch_size):
+                batch = pieces[i:i + options.batch_size]
+                texts = transcribe_batch(_models["asr"], [chunk for _, _, chunk in batch], options.language)
+                results.extend({"start_ms": beg, "end_ms": end, "text": text}
+                               for (beg, end, _), text in zip(batch, texts) if text)
+    finally:
+        source.close()
+    return {"file": path, "audio_s": source.duration, "elapsed_s": time.monotonic() - started, "segments": results}
+
+
+def find_audio_files(paths: List[str]) -> List[str]:
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names if name.lower().endswith(AUDIO_EXTENSIONS))
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+class BatchTranscriber:
+    """把多个文件分给进程池转写，结果追加写入 JSONL，可中断后继续"""
+
+    def __init__(self, workers: int = 4, options: Optional[BatchOptions] = None):
+        self.workers = workers
+        self.options = options or BatchOptions()
+
+    def _resume(self, output: str, progress: str) -> Dict[str, float]:
+        """读取进度文件，返回已完成文件的时长，并把输出截到最后一个完成的文件"""
+        done: Dict[str, float] = {}
+        offset = 0
+        if os.path.exists(progress):
+            with open(progress, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # 最后一行可能没写完
+                    done[record["file"]] = record["audio_s"]
+                    offset = record["output_offset"]
+        if os.path.exists(output) and os.path.getsize(output) > offset:
+            with open(output, "r+b") as f:
+                f.truncate(offset)
+        if done:
+            logging.info(f"Resuming: {len(done)} files already transcribed")
+        return done
+
+    def run(self, paths: List[str], output: str) -> Dict[str, Any]:
+        """转写 paths 中的文件和目录，返回吞吐报告"""
+        progress = output + ".progress"
+        done = self._resume(output, progress)
+        files = [path for path in find_audio_files(paths) if path not in done]
+        logging.info(f"Transcribing {len(files)} files with {self.workers} workers")
+
+        started = time.monotonic()
+        audio_s = 0.0
+        segments = 0
+        failed = []
+        with open(output, "ab") as out, open(progress, "a", encoding="utf-8") as prog, \
+                ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.options,)) as pool:
+            futures = {pool.submit(transcribe_file, path, self.options): path for path in files}
+            for i, future in enumerate(as_completed(futures), 1):
+                path = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logging.error(f"Failed to transcribe {path}: {e}")
+                    failed.append(path)
+                    continue
+                # 先写完整个文件的结果，再记录进度，中断时最多重做一个文件
+                out.write("".join(
+                    json.dumps({"file": path, **segment}, ensure_ascii=False) + "\n" for segment in result["segments"]
+                ).encode("utf-8"))
+                out.flush()
+                os.fsync(out.fileno())
+                prog.write(json.dumps({"file": path, "audio_s": result["audio_s"], "output_offset": out.tell()},
+                                      ensure_ascii=False) + "\n")
+                prog.flush()
+                audio_s += result["audio_s"]
+                segments += len(result["segments"])
+                logging.info(f"[{i}/{len(files)}] {path}: {result['audio_s']:.1f} s audio in "
+                             f"{result['elapsed_s']:.1f} s, {len(result['segments'])} segments")
+
+        wall_s = time.monotonic() - started
+        cores = self.workers * self.options.threads_per_worker
+        return {
+            "files": len(files) - len(failed),
+            "failed": failed,
+            "skipped": len(done),
+            "segments": segments,
+            "audio_hours": audio_s / 3600,
+            "wall_hours": wall_s / 3600,
+            "cores": cores,
+            # 每核每小时墙上时间处理的音频小时数
+            "throughput_per_core": audio_s / wall_s / cores if wall_s > 0 else 0.0,
+        }
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s|%(levelname)s - %(message)s')
+    defaults = BatchOptions()
+    parser = argparse.ArgumentParser(description='离线批量转写')
+    parser.add_argument('paths', nargs='+', help='音频文件或目录（递归查找 WAV/OGG/FLAC）')
+    parser.add_argument('--output', default='transcripts.jsonl', help='转写结果JSONL文件')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='工作进程数')
+    parser.add_argument('--threads_per_worker', type=int, default=defaults.threads_per_worker, help='每个工作进程的推理线程数')
+    parser.add_argument('--language', default=defaults.language, help='识别语言')
+    parser.add_argument('--batch_size', type=int, default=defaults.batch_size, help='每批识别的分段数')
+    parser.add_argument('--max_segment_s', type=float, default=defaults.max_segment_s, help='分段的最大长度（秒）')
+    parser.add_argument('--merge_gap_ms', type=float, default=defaults.merge_gap_ms, help='合并相邻分段的最大间隔（毫秒）')
+    parser.add_argument('--window_s', type=float, default=defaults.window_s, help='每次VAD处理的音频长度（秒）')
+    args = parser.parse_args()
+    if args.max_segment_s <= 0:
+        parser.error("--max_segment_s must be positive")
+
+    options = BatchOptions(
+        language=args.language,
+        batch_size=args.batch_size,
+        max_segment_s=args.max_segment_s,
+        merge_gap_ms=args.merge_gap_ms,
+        window_s=args.window_s,
+        threads_per_worker=args.threads_per_worker,
+    )
+    logging.info(f"Options: {asdict(options)}")
+    report = BatchTranscriber(args.workers, options).run(args.paths, args.output)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,30 +1,92 @@
 import logging
 from asyncio import Event
-from typing import Generator
+from queue import Queue
+from typing import Generator, List
 
+import numpy as np
 from funasr import AutoModel
 from funasr.utils.postprocess_utils import rich_transcription_postprocess
 
 from server.modules.base_handler import BaseHandler
+from utils.audio_buffer import split_utterance
+from utils.protocol import ControlEvent
+
+SAMPLE_RATE = 16000
+
+
+def load_asr_model():
+    return AutoModel(
+        model="iic/SenseVoiceSmall",
+        # device="cuda",
+        disable_update=True,
+        disable_pbar=True,
+    )
+
+
+def transcribe(model, audio: np.ndarray) -> str:
+    result = model.generate(input=audio, cache={}, language='zh', use_itn=True)
+    return rich_transcription_postprocess(result[0]['text'])
+
+
+def transcribe_batch(model, audios: List[np.ndarray], language: str = 'zh') -> List[str]:
+    """一次识别多段语音（离线批量转写），结果与输入一一对应"""
+    if not audios:
+        return []
+    result = model.generate(input=audios, cache={}, language=language, use_itn=True, batch_size=len(audios))
+    return [rich_transcription_postprocess(item['text']) for item in result]
+
 
 class AsrHandler(BaseHandler):
     def __init__(self, stop_event: Event):
         super().__init__(stop_event)
         self.sense_model = None
+        self.event_queue = None
+        self.scheduler = None
 
-    def setup(self) -> None:
-        self.sense_model = AutoModel(
-            model="iic/SenseVoiceSmall",
-            # device="cuda",
-            disable_update=True,
-            disable_pbar=True,
-        )
+    def setup(self, event_queue: Queue = None, scheduler=None, deadline_ms: float = 1500,
+              max_chunk_s: float = 20.0) -> None:
+        """
+        Args:
+            event_queue: 识别结果同时作为控制消息发给客户端
+            scheduler: 共享的 InferenceScheduler，为空时本会话加载自己的模型
+            deadline_ms: 使用调度器时识别任务的截止时间
+            max_chunk_s: 使用调度器时长语音拆分的块长（秒）
+        """
+        self.event_queue = event_queue
+        self.scheduler = scheduler
+        self.deadline_ms = deadline_ms
+        self.max_chunk_s = max_chunk_s
+        if scheduler is None:
+            self.sense_model = load_asr_model()
     
     def process(self, audio_buffer) -> Generator[str, None, None]:
-        result = self.sense_model.generate(input=audio_buffer, cache={}, language='zh', use_itn=True)
-        data = rich_transcription_postprocess(result[0]['text'])
+        self.tracer.start("asr")
+        if self.scheduler is None:
+            data = transcribe(self.sense_model, audio_buffer)
+        else:
+            # 各块分别排队，其他会话的短语音可以插在长语音的块之间
+            jobs = [
+                self.scheduler.submit(
+                    "asr",
+                    lambda model, chunk=chunk: transcribe(model, chunk),
+                    cost_ms=chunk.shape[0] / SAMPLE_RATE * 1000,
+                    deadline_ms=self.deadline_ms + offset / SAMPLE_RATE * 1000 * self.scheduler.deadline_per_audio,
+                )
+                for chunk, offset in self._chunks(audio_buffer)
+            ]
+            data = "".join(job.result() for job in jobs)
+        self.tracer.end("asr")
 
         logging.info(f"ASR result: {data}")
+        if self.event_queue is not None:
+            self.event_queue.put({"event": ControlEvent.TRANSCRIPT, "text": data, "final": True})
         yield data
 
+    def _chunks(self, audio: np.ndarray):
+        """拆分后的块及其在整句中的起始采样"""
+        offset = 0
+        for chunk in split_utterance(audio, self.max_chunk_s):
+            yield chunk, offset
+            offset += chunk.shape[0]
+
 
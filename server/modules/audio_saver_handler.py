@@ -1,7 +1,13 @@
+import itertools
+import logging
+import os
+import threading
+import time
 from asyncio import Event
 from datetime import datetime
 from pathlib import Path
-from typing import Generator
+from queue import Empty, Full, Queue
+from typing import Any, Dict, Generator, List, Optional
 
 import soundfile
 from numpy import ndarray
@@ -9,27 +15,141 @@ from numpy import ndarray
 from server.modules.base_handler import BaseHandler
 
 
-class AudioSaverHandler(BaseHandler):
-    """音频保存处理器"""
+class AudioSaveWriter:
+    """
+    后台音频保存，所有会话共享
 
-    def __init__(self, stop_event: Event):
-        super().__init__(stop_event)
-        self.channels = None
-        self.sample_rate = None
-        self.save_dir = None
+    处理器只把音频放入有界队列，由 workers 个后台线程编码成 Opus（OGG）并写入文件。
+    队列满时丢弃并计数，不阻塞管道；文件先写到临时名再改名，读到的都是完整文件。
+    fsync 按 fsync_interval 批量进行：一批文件各 fsync 一次，目录只 fsync 一次。
+    """
 
-    def setup(self, save_dir: str = "audio_saves", sample_rate: int = 16000, channels: int = 1):
+    def __init__(self, save_dir: str = "audio_saves", sample_rate: int = 16000, channels: int = 1,
+                 workers: int = 1, max_pending: int = 32, fsync_interval: float = 1.0):
+        """
+        Args:
+            save_dir: 保存目录
+            sample_rate: 采样率
+            channels: 声道数
+            workers: 编码和写入的线程数
+            max_pending: 等待保存的最大条数，超过后丢弃
+            fsync_interval: 批量 fsync 的间隔（秒），0 表示不 fsync
+        """
         self.save_dir = Path(save_dir)
         self.save_dir.mkdir(parents=True, exist_ok=True)
         self.sample_rate = sample_rate
         self.channels = channels
-        
-    def new_file(self) -> str:
-        """创建新的WAV文件"""
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"audio_{timestamp}.ogg"
-        return self.save_dir / filename
+        self.fsync_interval = fsync_interval
+        self._queue: Queue = Queue(maxsize=max_pending)
+        self._sequence = itertools.count()
+        self._unsynced: List[Path] = []
+        self._lock = threading.Lock()
+
+        self.saved = 0
+        self.dropped = 0
+        self.failed = 0
+        self.bytes = 0
+        self.encode_seconds = 0.0
+
+        for i in range(workers):
+            threading.Thread(target=self._worker, name=f"audio-saver-{i}", daemon=True).start()
+        if fsync_interval > 0:
+            threading.Thread(target=self._sync_loop, name="audio-saver-sync", daemon=True).start()
+
+    def new_file(self, session_id: str = "") -> Path:
+        """文件名包含毫秒时间、会话 ID 和进程内序号，不会重名"""
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")[:-3]
+        prefix = f"audio_{timestamp}_{session_id}" if session_id else f"audio_{timestamp}"
+        return self.save_dir / f"{prefix}_{os.getpid()}_{next(self._sequence):06d}.ogg"
+
+    def submit(self, audio: ndarray, session_id: str = "") -> bool:
+        """放入保存队列，队列满时返回 False"""
+        try:
+            self._queue.put_nowait((self.new_file(session_id), audio))
+            return True
+        except Full:
+            self.dropped += 1
+            return False
+
+    def _worker(self) -> None:
+        while True:
+            path, audio = self._queue.get()
+            tmp_path = path.with_name(path.name + ".tmp")
+            start = time.perf_counter()
+            try:
+                soundfile.write(tmp_path, audio, self.sample_rate, format='ogg', subtype='OPUS')
+                os.replace(tmp_path, path)
+            except Exception as e:
+                self.failed += 1
+                logging.warning(f"Failed to save audio {path}: {e}")
+                tmp_path.unlink(missing_ok=True)
+                continue
+            with self._lock:
+                self.encode_seconds += time.perf_counter() - start
+                self.saved += 1
+                self.bytes += path.stat().st_size
+                if self.fsync_interval > 0:
+                    self._unsynced.append(path)
+
+    def _sync_loop(self) -> None:
+        while True:
+            time.sleep(self.fsync_interval)
+            self.sync()
+
+    def sync(self) -> None:
+        """fsync 上次以来写入的文件和目录"""
+        with self._lock:
+            paths, self._unsynced = self._unsynced, []
+        if not paths:
+            return
+        for path in paths:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+            except OSError as e:
+                logging.warning(f"Failed to fsync {path}: {e}")
+        try:
+            fd = os.open(self.save_dir, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass  # 有的平台不能打开目录
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "saved": self.saved,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "pending": self._queue.qsize(),
+            "bytes": self.bytes,
+            "encode_seconds": self.encode_seconds,
+        }
+
+
+class AudioSaverHandler(BaseHandler):
+    """音频保存处理器，编码和写入在 AudioSaveWriter 的后台线程中进行"""
+
+    def __init__(self, stop_event: Event):
+        super().__init__(stop_event)
+        self.writer = None
+        self.session_id = ""
+
+    def setup(self, save_dir: str = "audio_saves", sample_rate: int = 16000, channels: int = 1,
+              writer: Optional[AudioSaveWriter] = None, session_id: str = ""):
+        """
+        Args:
+            writer: 共享的 AudioSaveWriter，为空时按 save_dir 等参数创建本会话自己的
+            session_id: 加在文件名中的会话 ID
+        """
+        self.writer = writer or AudioSaveWriter(save_dir, sample_rate, channels)
+        self.session_id = session_id
 
     def process(self, audio_chunk) -> Generator[ndarray, None, None]:
-        soundfile.write(self.new_file(), audio_chunk, self.sample_rate, format='ogg', subtype='OPUS')
-        yield audio_chunk
\ No newline at end of file
+        # VAD 交给下游的是副本，不会再被修改，不需要复制
+        self.writer.submit(audio_chunk, self.session_id)
+        yield audio_chunk
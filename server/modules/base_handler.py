@@ -1,8 +1,10 @@
 import logging
 from time import perf_counter
-from typing import Any, Generator
+from typing import Any, Callable, Dict, Generator, List, Optional
 from queue import Queue, Empty
-from threading import Event
+from threading import Event, Lock, local
+
+from utils.tracing import TurnTracer
 
 
 class BaseHandler:
@@ -27,7 +29,13 @@ class BaseHandler:
 
         self.input_queues = []
         self.output_queues = []
-        self._times = []
+        self._last_time = 0.0
+        # 耗时统计（utils.metrics.HandlerMetrics），管道登记到 MetricsRegistry 时绑定
+        self.metrics = None
+        # 所在管道的轮次追踪，构建管道时绑定
+        self.tracer = TurnTracer()
+        # 每次输出时以 (处理器类名, 耗时) 调用，用于准入控制统计各阶段耗时
+        self.latency_hook: Optional[Callable[[str, float], None]] = None
 
     def add_input_queue(self, queue: Queue) -> None:
         """添加输入队列"""
@@ -65,7 +73,11 @@ class BaseHandler:
                     else:
                         start_time = perf_counter()
                         for output in self.process(input_data):
-                            self._times.append(perf_counter() - start_time)
+                            self._last_time = perf_counter() - start_time
+                            if self.metrics is not None:
+                                self.metrics.observe(self._last_time)
+                            if self.latency_hook is not None:
+                                self.latency_hook(self.__class__.__name__, self.last_time)
                             if self.last_time > self.min_time_to_debug:
                                 logging.info(f"{self.__class__.__name__}: Processing took {self.last_time:.3f} s")
 
@@ -90,7 +102,7 @@ class BaseHandler:
     @property
     def last_time(self) -> float:
         """获取最后一次处理的耗时"""
-        return self._times[-1] if self._times else 0
+        return self._last_time
 
     @property
     def min_time_to_debug(self) -> float:
@@ -100,3 +112,71 @@ class BaseHandler:
     def cleanup(self) -> None:
         """清理资源"""
         pass
+
+
+class OrderedReplicas:
+    """
+    同一阶段的多个副本共享输入队列，输出按输入的顺序写入下游
+
+    取出输入时按顺序编号；最早的未完成输入的输出直接写入下游，其余的先缓存，
+    前面的输入处理完后再依次写出。只适用于同步处理器（process 生成输出）。
+    """
+
+    def __init__(self, input_queue: Queue, output_queues: List[Queue]):
+        self.input = input_queue
+        self.outputs = output_queues
+        self._get_lock = Lock()
+        self._lock = Lock()
+        self._local = local()
+        self._next_in = 0
+        self._next_out = 0
+        self._pending: Dict[int, List[Any]] = {}
+        self._done = set()
+
+    def get(self, block: bool = True, timeout: Optional[float] = None):
+        with self._get_lock:
+            item = self.input.get(block, timeout)
+            if not (isinstance(item, bytes) and item == b"END"):
+                self._local.seq = self._next_in
+                self._next_in += 1
+        return item
+
+    def qsize(self) -> int:
+        return self.input.qsize()
+
+    def attach(self, handler: BaseHandler) -> None:
+        process = handler.process
+
+        def ordered_process(data):
+            seq = self._local.seq
+            try:
+                for output in process(data):
+                    self._emit(seq, output)
+                    yield output
+            finally:
+                self._finish(seq)
+
+        handler.input_queues = [self]
+        handler.process = ordered_process
+        # 输出由 _emit 写入下游
+        handler.output_queues = []
+
+    def _put(self, output) -> None:
+        for queue in self.outputs:
+            queue.put(output)
+
+    def _emit(self, seq: int, output) -> None:
+        with self._lock:
+            if seq == self._next_out:
+                self._put(output)
+            else:
+                self._pending.setdefault(seq, []).append(output)
+
+    def _finish(self, seq: int) -> None:
+        with self._lock:
+            self._done.add(seq)
+            while self._next_out in self._done:
+                self._done.remove(self._next_out)
+                self._next_out += 1
+                for output in self._pending.pop(self._next_out, []):
+                    self._put(output)
@@ -0,0 +1,190 @@
+import logging
+import random
+import wave
+from asyncio import Event
+from collections import deque
+from pathlib import Path
+from queue import Queue
+from time import perf_counter
+from typing import Callable, Iterable, List, Dict, Any, Optional
+
+import numpy as np
+
+from server.modules.base_handler import BaseHandler
+from utils.pipeline_manager import ResponseGate
+
+SAMPLE_RATE = 16000
+BYTES_PER_MS = SAMPLE_RATE * 2 // 1000
+
+
+class FillerBank:
+    """预先合成好的填充音频（"嗯"、"好的，我看一下"等），所有会话共享"""
+
+    def __init__(self, clips: List[bytes]):
+        self.clips = [clip for clip in clips if clip]
+        self._last = None
+
+    @classmethod
+    def from_dir(cls, path: str) -> "FillerBank":
+        """从目录加载 16kHz 16bit 单声道 WAV 文件"""
+        clips = []
+        for wav_path in sorted(Path(path).glob("*.wav")):
+            with wave.open(str(wav_path), "rb") as wav_file:
+                if wav_file.getsampwidth() != 2 or wav_file.getnchannels() != 1 or wav_file.getframerate() != SAMPLE_RATE:
+                    logging.warning(f"Skip filler {wav_path}: WAV file must be 16kHz, 16-bit, mono")
+                    continue
+                clips.append(wav_file.readframes(wav_file.getnframes()))
+        logging.info(f"Loaded {len(clips)} filler clips from {path}")
+        return cls(clips)
+
+    @classmethod
+    def from_phrases(cls, phrases: Iterable[str], synthesize: Callable[[str], Iterable[bytes]]) -> "FillerBank":
+        """调用 TTS 合成填充短语"""
+        clips = []
+        for phrase in phrases:
+            try:
+                clips.append(b"".join(synthesize(phrase)))
+            except Exception as e:
+                logging.warning(f"Failed to synthesize filler '{phrase}': {e}")
+        logging.info(f"Synthesized {len(clips)} filler clips")
+        return cls(clips)
+
+    def choose(self) -> Optional[bytes]:
+        """随机选择一个片段，尽量不连续重复"""
+        if not self.clips:
+            return None
+        candidates = [clip for clip in self.clips if clip is not self._last] or self.clips
+        self._last = random.choice(candidates)
+        return self._last
+
+
+def fade_out(pcm: bytes) -> bytes:
+    """对一段 int16 PCM 做线性淡出"""
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    if samples.size == 0:
+        return b""
+    ramp = np.linspace(1.0, 0.0, samples.size, dtype=np.float32)
+    return (samples * ramp).astype(np.int16).tobytes()
+
+
+class FillerHandler(BaseHandler):
+    """
+    填充音频处理器
+
+    与 ASR 同时收到 VAD 输出的语音片段，等待一小段时间后如果真正的回复音频
+    还没有开始，就按实时速度把填充音频写入发送队列。回复音频开始时
+    （ResponseGate.open）立即停止，并补一段短淡出避免爆音；VAD 开始新的一轮时也停止。
+    同时统计用户感知的首音延迟（填充或回复，取先到者）和真实的回复首音延迟，在回复开始时
+    由门的回调记录，不等待回复（没有回复的轮次不记录）。
+    """
+
+    def __init__(self, stop_event: Event):
+        super().__init__(stop_event, is_async=True)
+        self.bank = None
+
+    def setup(
+            self,
+            bank: FillerBank,
+            response_gate: ResponseGate,
+            send_queue: Queue,
+            delay_ms: int = 250,
+            min_utterance_ms: int = 800,
+            frame_ms: int = 20,
+            lead_ms: int = 40,
+            fade_ms: int = 10,
+            enabled: Callable[[], bool] = None,
+    ):
+        """
+        Args:
+            bank: 填充音频库
+            response_gate: 管道的回复音频门
+            send_queue: 发送音频队列
+            delay_ms: 语音结束后等待多久再播放填充音频，期间回复已开始（如缓存命中）则跳过
+            min_utterance_ms: 短于该时长的语音（如"嗯"、"好"）不播放填充音频
+            frame_ms: 每次写入发送队列的音频时长
+            lead_ms: 领先实时播放的时长，越小停止时残留的填充音频越少
+            fade_ms: 停止时补充的淡出时长
+            enabled: 可选的开关函数，返回 False 时跳过填充（例如系统过载降级时）
+        """
+        self.bank = bank
+        self.response_gate = response_gate
+        self.send_queue = send_queue
+        self.delay_ms = delay_ms
+        self.min_utterance_ms = min_utterance_ms
+        self.frame_bytes = frame_ms * BYTES_PER_MS
+        self.lead_ms = lead_ms
+        self.fade_bytes = fade_ms * BYTES_PER_MS
+        self.enabled = enabled
+
+        self.played = 0
+        self.skipped = 0
+        self.interrupted = 0
+        self.perceived_latency = deque(maxlen=1000)  # 用户感知的首音延迟（秒）
+        self.response_latency = deque(maxlen=1000)  # 真实回复的首音延迟（秒）
+
+    def should_skip(self, utterance) -> bool:
+        """判断是否跳过填充音频"""
+        if self.enabled is not None and not self.enabled():
+            return True
+        duration_ms = len(utterance) * 1000 / SAMPLE_RATE
+        return duration_ms < self.min_utterance_ms
+
+    def async_process(self, utterance):
+        turn_start = perf_counter()
+        turn = self.response_gate.turn
+        clip = None if self.should_skip(utterance) else self.bank.choose()
+        position = 0
+        first_audio = None
+
+        def on_open():
+            # 回复音频开始时在门的锁内调用：淡出尾音排在回复音频之前，并记录首音延迟
+            tail = clip[position:position + self.fade_bytes] if clip else b""
+            if position > 0 and tail:
+                self.send_queue.put(fade_out(tail))
+            self.record_latency(turn_start, first_audio)
+
+        # 门在 VAD 检测到语音结束时已经重置，这里不能再重置，否则会关上 TTS 刚打开的门
+        if not self.response_gate.set_on_open(on_open):
+            # 回复已经开始（如缓存命中）
+            self.record_latency(turn_start, None)
+            clip = None
+
+        if clip and not self.response_gate.opened.wait(self.delay_ms / 1000):
+            # 按实时速度写入，领先 lead_ms
+            play_start = perf_counter()
+            while position < len(clip) and not self.stop_event.is_set():
+                frame = clip[position:position + self.frame_bytes]
+                if not self.response_gate.put(self.send_queue, frame, turn):
+                    self.interrupted += 1
+                    break
+                if first_audio is None:
+                    first_audio = perf_counter()
+                position += len(frame)
+                ahead = position / BYTES_PER_MS / 1000 - (perf_counter() - play_start) - self.lead_ms / 1000
+                if ahead > 0 and self.response_gate.opened.wait(ahead):
+                    self.interrupted += 1
+                    break
+            self.played += 1
+        else:
+            self.skipped += 1
+
+    def record_latency(self, turn_start: float, first_audio: Optional[float]) -> None:
+        """回复音频开始：记录真实回复和用户感知的首音延迟"""
+        response_latency = perf_counter() - turn_start
+        self.response_latency.append(response_latency)
+        perceived = first_audio - turn_start if first_audio is not None else response_latency
+        self.perceived_latency.append(perceived)
+        logging.info(f"Time to first audio: perceived {perceived:.3f} s, response {response_latency:.3f} s")
+
+    def stats(self) -> Dict[str, Any]:
+        """获取填充音频统计信息"""
+        def mean(values):
+            return sum(values) / len(values) if values else 0.0
+
+        return {
+            "played": self.played,
+            "skipped": self.skipped,
+            "interrupted": self.interrupted,
+            "perceived_first_audio_seconds": mean(self.perceived_latency),
+            "response_first_audio_seconds": mean(self.response_latency),
+        }
@@ -0,0 +1,144 @@
+import heapq
+import itertools
+import logging
+import threading
+from collections import defaultdict, deque
+from time import monotonic
+from typing import Any, Callable, Dict, Optional
+
+
+class InferenceJob:
+    """一次推理任务，由提交任务的处理器线程等待结果"""
+
+    def __init__(self, job_class: str, fn: Callable[[Any], Any], cost_ms: float, deadline: float):
+        self.job_class = job_class
+        self.fn = fn
+        self.cost_ms = cost_ms
+        self.deadline = deadline
+        self.submitted = monotonic()
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def result(self, timeout: Optional[float] = None) -> Any:
+        """等待任务完成并返回结果，任务出错时抛出原来的异常"""
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"{self.job_class} inference job timed out")
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+class InferenceScheduler:
+    """
+    共享推理工作线程的调度器，所有会话共享
+
+    每个工作线程为每类任务加载一份模型，任务按 (类别优先级, 截止时间, 预估耗时) 排序：
+    VAD 分块总是排在 ASR 前面，同类任务先做截止时间早的，截止时间相同时先做音频短的。
+    任务的截止时间 = 提交时间 + deadline_ms + 音频时长 × deadline_per_audio，
+    长语音的截止时间更晚，拆分成多块后不会一直占住工作线程。
+    按类别统计排队延迟和超过截止时间的任务数。
+    """
+
+    def __init__(self, workers: int = 1, deadline_per_audio: float = 0.1):
+        """
+        Args:
+            workers: 工作线程数
+            deadline_per_audio: 每毫秒音频额外放宽的截止时间（毫秒）
+        """
+        self.workers = workers
+        self.deadline_per_audio = deadline_per_audio
+
+        self._factories: Dict[str, Callable[[], Any]] = {}
+        self._priorities: Dict[str, int] = {}
+        self._heap = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._started = False
+
+        self.completed = defaultdict(int)
+        self.missed = defaultdict(int)
+        self.errors = defaultdict(int)
+        self.queue_delay = defaultdict(lambda: deque(maxlen=1000))
+
+    def register(self, job_class: str, factory: Callable[[], Any], priority: int) -> None:
+        """登记一类任务，factory 在每个工作线程中创建一份模型，priority 越小越优先"""
+        self._factories[job_class] = factory
+        self._priorities[job_class] = priority
+
+    def start(self) -> None:
+        if self._started:
+            return
+        self._started = True
+        for i in range(self.workers):
+            threading.Thread(target=self._worker, name=f"inference-{i}", daemon=True).start()
+
+    def submit(self, job_class: str, fn: Callable[[Any], Any], cost_ms: float = 0.0,
+               deadline_ms: float = 1000.0) -> InferenceJob:
+        """
+        提交任务
+
+        Args:
+            job_class: 任务类别（需要先 register）
+            fn: 在工作线程中执行的函数，输入为该线程的模型
+            cost_ms: 预估耗时，使用音频时长（毫秒）
+            deadline_ms: 相对提交时间的截止时间（毫秒），还会按音频时长放宽
+        """
+        deadline = monotonic() + (deadline_ms + cost_ms * self.deadline_per_audio) / 1000
+        job = InferenceJob(job_class, fn, cost_ms, deadline)
+        with self._condition:
+            heapq.heappush(self._heap, (self._priorities[job_class], deadline, cost_ms, next(self._sequence), job))
+            self._condition.notify()
+        return job
+
+    def run(self, job_class: str, fn: Callable[[Any], Any], cost_ms: float = 0.0,
+            deadline_ms: float = 1000.0) -> Any:
+        """提交任务并等待结果"""
+        return self.submit(job_class, fn, cost_ms, deadline_ms).result()
+
+    def _worker(self) -> None:
+        models = {}
+        for job_class, factory in self._factories.items():
+            models[job_class] = factory()
+        logging.info(f"{threading.current_thread().name} loaded models: {list(models)}")
+
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+                job = heapq.heappop(self._heap)[-1]
+            job.started = monotonic()
+            try:
+                job._result = job.fn(models[job.job_class])
+            except Exception as e:
+                logging.error(f"{job.job_class} inference job failed: {e}")
+                job._error = e
+            job.finished = monotonic()
+            with self._condition:
+                self.queue_delay[job.job_class].append(job.started - job.submitted)
+                self.completed[job.job_class] += 1
+                if job._error is not None:
+                    self.errors[job.job_class] += 1
+                if job.finished > job.deadline:
+                    self.missed[job.job_class] += 1
+            job._done.set()
+
+    def pending(self) -> int:
+        return len(self._heap)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取各类任务的排队延迟和截止时间统计"""
+        stats = {"pending": self.pending()}
+        with self._condition:
+            for job_class in self._factories:
+                delays = sorted(self.queue_delay[job_class])
+                stats[job_class] = {
+                    "completed": self.completed[job_class],
+                    "deadline_missed": self.missed[job_class],
+                    "errors": self.errors[job_class],
+                    "queue_delay_p50_ms": delays[len(delays) // 2] * 1000 if delays else 0.0,
+                    "queue_delay_p90_ms": delays[int(len(delays) * 0.9)] * 1000 if delays else 0.0,
+                }
+        return stats
@@ -0,0 +1,194 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from utils.lru_cache import LRUCache
+from utils.text_utils import normalize_text
+
+
+@dataclass
+class CachedResponse:
+    """缓存的LLM回复"""
+    text: str
+    latency: float  # 原始生成耗时（秒），用于统计命中节省的时间
+    created: float  # 写入时间（time.time）
+
+
+class LLMResponseCache:
+    """
+    LLM回复缓存
+
+    缓存键由归一化后的用户文本、系统提示词和最近若干条历史消息的指纹组成。
+    内存层为 LRU + TTL，可选的磁盘层把每条回复保存为一个 JSON 文件，
+    服务重启后仍然可以命中，文件数超过 disk_max_items 时删除最久未使用的文件。
+    条目从写入时起计算有效期，从磁盘层提升到内存层不会延长。所有会话共享同一个实例。
+    """
+
+    def __init__(
+            self,
+            max_items: int = 1024,
+            ttl: Optional[float] = 24 * 3600,
+            disk_dir: Optional[str] = None,
+            history_turns: int = 0,
+            disk_max_items: int = 10000,
+    ):
+        """
+        初始化缓存
+
+        Args:
+            max_items: 内存层最大条目数
+            ttl: 条目存活时间（秒），None 表示永不过期
+            disk_dir: 磁盘层目录，None 表示不启用
+            history_turns: 参与指纹计算的历史消息条数，0 表示与历史无关
+            disk_max_items: 磁盘层最大文件数
+        """
+        self.memory = LRUCache(max_items=max_items, ttl=ttl)
+        self.ttl = ttl
+        self.history_turns = history_turns
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_items = disk_max_items
+        self._disk_keys = OrderedDict()  # 磁盘层的键，按最近使用排序
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.disk_evictions = 0
+        self.misses = 0
+        self.saved_latency = 0.0
+
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._scan_disk()
+
+    def make_key(self, prompt: str, system_prompt: str = "", history: List[Dict[str, Any]] = None) -> Optional[str]:
+        """
+        计算缓存键
+
+        Returns:
+            缓存键，归一化后文本为空时返回 None（不缓存）
+        """
+        normalized = normalize_text(prompt)
+        if not normalized:
+            return None
+        recent = history[-self.history_turns:] if history and self.history_turns > 0 else []
+        fingerprint = json.dumps(
+            [system_prompt or "", [(m["role"], normalize_text(m["content"])) for m in recent], normalized],
+            ensure_ascii=False,
+        )
+        return hashlib.sha1(fingerprint.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """查询缓存，先查内存层再查磁盘层"""
+        if key is None:
+            return None
+        entry = self.memory.get(key)
+        if entry is None and self.disk_dir:
+            entry = self._load_from_disk(key)
+            if entry is not None:
+                # 保留原来的过期时间
+                remaining = entry.created + self.ttl - time.time() if self.ttl is not None else None
+                self.memory.put(key, entry, ttl=remaining)
+                with self._lock:
+                    self.disk_hits += 1
+                    if key in self._disk_keys:
+                        self._disk_keys.move_to_end(key)
+
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def put(self, key: str, text: str, latency: float) -> None:
+        """写入缓存"""
+        if key is None or not text:
+            return
+        entry = CachedResponse(text=text, latency=latency, created=time.time())
+        self.memory.put(key, entry)
+        if self.disk_dir:
+            self._save_to_disk(key, entry)
+
+    def record_saved(self, original_latency: float, replay_latency: float) -> None:
+        """记录一次命中节省的时间"""
+        with self._lock:
+            self.saved_latency += max(0.0, original_latency - replay_latency)
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}.json"
+
+    def _scan_disk(self) -> None:
+        """启动时按修改时间登记已有的文件，删除上次中断留下的临时文件，超出数量的旧文件直接删除"""
+        for tmp_path in self.disk_dir.glob("*.tmp"):
+            tmp_path.unlink(missing_ok=True)
+        paths = sorted(self.disk_dir.glob("*.json"), key=lambda path: path.stat().st_mtime)
+        for path in paths:
+            self._disk_keys[path.stem] = None
+        self._trim_disk()
+
+    def _trim_disk(self) -> None:
+        while len(self._disk_keys) > self.disk_max_items:
+            key, _ = self._disk_keys.popitem(last=False)
+            self._disk_path(key).unlink(missing_ok=True)
+            self.disk_evictions += 1
+
+    def _load_from_disk(self, key: str) -> Optional[CachedResponse]:
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = CachedResponse(**json.load(f))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Failed to load cached response {path}: {e}")
+            return None
+        if self.ttl is not None and entry.created + self.ttl < time.time():
+            path.unlink(missing_ok=True)
+            with self._lock:
+                self._disk_keys.pop(key, None)
+            return None
+        return entry
+
+    def _save_to_disk(self, key: str, entry: CachedResponse) -> None:
+        path = self._disk_path(key)
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry.__dict__, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.warning(f"Failed to save cached response {path}: {e}")
+            try:
+                tmp_path.unlink(missing_ok=True)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._disk_keys[key] = None
+            self._disk_keys.move_to_end(key)
+            self._trim_disk()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "disk_items": len(self._disk_keys),
+            "disk_evictions": self.disk_evictions,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "saved_latency_seconds": self.saved_latency,
+            "memory": self.memory.stats(),
+        }
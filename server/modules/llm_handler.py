@@ -1,17 +1,23 @@
 import logging
 from asyncio import Event
+from time import perf_counter
 from typing import Generator
 from server.modules.base_handler import BaseHandler
 from server.modules.chat import Chat
+from server.modules.llm_cache import LLMResponseCache
 from openai import OpenAI
 
 from server.modules.tts_handler import TTSMessage, TTSMessageType
+from utils.pipeline_manager import TurnCancel
+from utils.text_utils import split_sentences
 
 
 class LLMHandler(BaseHandler):
 
     def __init__(self, stop_event: Event):
         super().__init__(stop_event)
+        self.cache = None
+        self.turn_cancel = None
 
     def setup(
             self,
@@ -25,6 +31,8 @@ class LLMHandler(BaseHandler):
             chat_size=1,
             init_chat_role="system",
             init_chat_prompt="You are a helpful AI assistant, Please reply to my message in chinese.",
+            cache: LLMResponseCache = None,
+            turn_cancel: TurnCancel = None,
     ):
         self.model_name = model_name
         self.stream = stream
@@ -37,12 +45,52 @@ class LLMHandler(BaseHandler):
             self.chat.init_chat({"role": init_chat_role, "content": init_chat_prompt})
         self.user_role = user_role
         self.client = OpenAI(api_key=api_key, base_url=base_url)
+        # 多个会话共享的回复缓存，None 表示不启用
+        self.cache = cache
+        # 客户端取消回复时停止生成
+        self.turn_cancel = turn_cancel
 
         # TODO
         # self.warmup()
 
+    def cache_key(self, prompt):
+        if self.cache is None:
+            return None
+        system_prompt = self.chat.init_chat_message["content"] if self.chat.init_chat_message else ""
+        return self.cache.make_key(prompt, system_prompt, self.chat.buffer)
+
+    def replay(self, prompt, cached) -> Generator[TTSMessage, None, None]:
+        """按照与实时生成相同的 START/TXT/END 协议回放缓存的回复"""
+        start_time = perf_counter()
+        self.tracer.set("llm_cache_hit", True)
+        self.tracer.first("llm.ttft", "llm")
+        self.chat.append({"role": self.user_role, "content": prompt})
+        self.chat.append({"role": "assistant", "content": cached.text})
+        logging.info("assistant (cached): " + cached.text)
+        if self.stream:
+            yield TTSMessage(type=TTSMessageType.START)
+            sentences, rest = split_sentences(cached.text)
+            for sentence in sentences + ([rest] if rest else []):
+                yield TTSMessage(text=sentence, type=TTSMessageType.TXT)
+            yield TTSMessage(type=TTSMessageType.END)
+        else:
+            yield cached.text
+        self.cache.record_saved(cached.latency, perf_counter() - start_time)
+        self.tracer.end("llm")
+
     def process(self, prompt) -> Generator[str, None, None]:
+        self.tracer.start("llm")
+        turn = self.turn_cancel.current() if self.turn_cancel is not None else None
+        key = self.cache_key(prompt)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                logging.info(f"LLM cache hit, hit rate {self.cache.hit_rate:.2%}, saved {self.cache.saved_latency:.2f} s in total")
+                yield from self.replay(prompt, cached)
+                return
+
         logging.debug("call api language model...")
+        start_time = perf_counter()
         self.chat.append({"role": self.user_role, "content": prompt})
         response = self.client.chat.completions.create(
             model=self.model_name,
@@ -54,21 +102,38 @@ class LLMHandler(BaseHandler):
         if self.stream:
             yield TTSMessage(type=TTSMessageType.START)
             generated_text, printable_text = "", ""
+            cancelled = False
             for chunk in response:
+                if turn is not None and self.turn_cancel.is_cancelled(turn):
+                    # 客户端取消了回复：关闭流，不再生成剩余的句子
+                    logging.info("LLM generation cancelled")
+                    cancelled = True
+                    response.close()
+                    break
                 new_text = chunk.choices[0].delta.content or ""
                 generated_text += new_text
-                sentences = printable_text
-                # sentences = sent_tokenize(printable_text)
-                # if len(sentences) > 1:
-                #     yield TTSMessage(sentences[0])
-                #     printable_text = new_text
+                printable_text += new_text
+                # 每生成一个完整的句子就交给TTS
+                sentences, printable_text = split_sentences(printable_text)
+                if new_text:
+                    self.tracer.first("llm.ttft", "llm")
+                for sentence in sentences:
+                    yield TTSMessage(text=sentence, type=TTSMessageType.TXT)
             self.chat.append({"role": "assistant", "content": generated_text})
             logging.info("assistant: " + generated_text)
+            if key is not None and not cancelled:
+                self.cache.put(key, generated_text, perf_counter() - start_time)
             # don't forget last sentence
-            yield TTSMessage(text=generated_text, type=TTSMessageType.TXT)
+            if printable_text.strip() and not cancelled:
+                yield TTSMessage(text=printable_text, type=TTSMessageType.TXT)
+            self.tracer.end("llm")
             yield TTSMessage(type=TTSMessageType.END)
         else:
             generated_text = response.choices[0].message.content
+            self.tracer.first("llm.ttft", "llm")
+            self.tracer.end("llm")
             self.chat.append({"role": "assistant", "content": generated_text})
+            if key is not None:
+                self.cache.put(key, generated_text, perf_counter() - start_time)
             yield generated_text
-            
\ No newline at end of file
+            
@@ -0,0 +1,203 @@
+import hashlib
+import logging
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Any, Iterable, Iterator, Optional, Union
+
+from utils.lru_cache import LRUCache
+from utils.text_utils import normalize_text
+
+AudioBuffer = Union[bytes, memoryview]
+
+
+class TTSAudioCache:
+    """
+    合成音频（16kHz 16bit 单声道 PCM）缓存，放在 TTS 处理器前面
+
+    缓存键由归一化后的文本、音色和模型组成。内存层是按字节数限制的 LRU，
+    可选的磁盘层把每段音频保存为一个 .pcm 文件，命中时通过 mmap 映射，
+    切片后的 memoryview 可以直接放入 send_audio_chunks_queue，不需要复制。
+    磁盘层文件总大小超过 disk_max_bytes 时删除最久未使用的文件（已经映射的音频不受影响）。
+    所有会话共享同一个实例。
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, disk_dir: Optional[str] = None, chunk_size: int = 4096,
+                 disk_max_bytes: int = 1024 * 1024 * 1024):
+        """
+        初始化缓存
+
+        Args:
+            max_bytes: 内存层最大字节数
+            disk_dir: 磁盘层目录，None 表示不启用
+            chunk_size: 输出到发送队列时每块的字节数
+            disk_max_bytes: 磁盘层文件总大小上限（字节）
+        """
+        self.memory = LRUCache(max_bytes=max_bytes)
+        self.chunk_size = chunk_size
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_max_bytes = disk_max_bytes
+        self._disk_keys: "OrderedDict[str, int]" = OrderedDict()  # 磁盘层的键和文件大小，按最近使用排序
+        self._disk_bytes = 0
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.disk_evictions = 0
+        self.misses = 0
+
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            self._scan_disk()
+
+    @staticmethod
+    def make_key(text: str, voice: str, model: str) -> Optional[str]:
+        """计算缓存键，归一化后文本为空时返回 None（不缓存）"""
+        normalized = normalize_text(text)
+        if not normalized:
+            return None
+        return hashlib.sha1(f"{model}\0{voice}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def get(self, text: str, voice: str, model: str) -> Optional[AudioBuffer]:
+        """查询缓存，先查内存层再查磁盘层"""
+        key = self.make_key(text, voice, model)
+        if key is None:
+            return None
+        audio = self.memory.get(key)
+        if audio is None and self.disk_dir:
+            audio = self._load_from_disk(key)
+            if audio is not None:
+                # mmap 的页面由系统页缓存管理，这里只保存引用，不复制数据
+                self.memory.put(key, audio)
+                with self._lock:
+                    self.disk_hits += 1
+                    if key in self._disk_keys:
+                        self._disk_keys.move_to_end(key)
+
+        with self._lock:
+            if audio is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return audio
+
+    def put(self, text: str, voice: str, model: str, audio: bytes) -> None:
+        """写入缓存"""
+        key = self.make_key(text, voice, model)
+        if key is None or not audio:
+            return
+        self.memory.put(key, audio)
+        if self.disk_dir:
+            self._save_to_disk(key, audio)
+
+    def iter_chunks(self, audio: AudioBuffer) -> Iterator[memoryview]:
+        """把缓存的音频切成发送块，返回的是原缓冲区上的视图"""
+        view = memoryview(audio)
+        for i in range(0, len(view), self.chunk_size):
+            yield view[i:i + self.chunk_size]
+
+    def warm(self, phrases: Iterable[str], voice: str, model: str,
+             synthesize: Callable[[str], Iterable[bytes]]) -> int:
+        """
+        预热缓存，对尚未缓存的短语调用 synthesize 合成音频
+
+        Args:
+            phrases: 短语列表
+            voice: 音色
+            model: 模型
+            synthesize: 合成函数，输入文本，返回 PCM 数据块
+
+        Returns:
+            int: 新合成的短语数
+        """
+        warmed = 0
+        for phrase in phrases:
+            phrase = phrase.strip()
+            key = self.make_key(phrase, voice, model)
+            if key is None or key in self.memory:
+                continue
+            if self.disk_dir and self._disk_path(key).exists():
+                continue
+            try:
+                audio = b"".join(synthesize(phrase))
+            except Exception as e:
+                logging.warning(f"Failed to warm TTS cache for '{phrase}': {e}")
+                continue
+            self.put(phrase, voice, model, audio)
+            warmed += 1
+        logging.info(f"TTS cache warmed with {warmed} phrases")
+        return warmed
+
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f"{key}.pcm"
+
+    def _scan_disk(self) -> None:
+        """启动时按修改时间登记已有的文件，删除上次中断留下的临时文件和超出上限的旧文件"""
+        for tmp_path in self.disk_dir.glob("*.tmp"):
+            tmp_path.unlink(missing_ok=True)
+        paths = sorted(self.disk_dir.glob("*.pcm"), key=lambda path: path.stat().st_mtime)
+        for path in paths:
+            size = path.stat().st_size
+            self._disk_keys[path.stem] = size
+            self._disk_bytes += size
+        self._trim_disk()
+
+    def _trim_disk(self) -> None:
+        while self._disk_bytes > self.disk_max_bytes and self._disk_keys:
+            key, size = self._disk_keys.popitem(last=False)
+            self._disk_bytes -= size
+            self._disk_path(key).unlink(missing_ok=True)
+            self.disk_evictions += 1
+
+    def _load_from_disk(self, key: str) -> Optional[memoryview]:
+        path = self._disk_path(key)
+        try:
+            with open(path, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return None
+                # 关闭文件描述符后映射仍然有效
+                return memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Failed to load cached audio {path}: {e}")
+            return None
+
+    def _save_to_disk(self, key: str, audio: bytes) -> None:
+        path = self._disk_path(key)
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(audio)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logging.warning(f"Failed to save cached audio {path}: {e}")
+            try:
+                tmp_path.unlink(missing_ok=True)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._disk_bytes += len(audio) - self._disk_keys.pop(key, 0)
+            self._disk_keys[key] = len(audio)
+            self._trim_disk()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "disk_items": len(self._disk_keys),
+            "disk_bytes": self._disk_bytes,
+            "disk_evictions": self.disk_evictions,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "memory": self.memory.stats(),
+        }
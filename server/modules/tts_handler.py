@@ -2,11 +2,14 @@ import logging
 from asyncio import Event
 from dataclasses import dataclass
 from enum import Enum
+from time import perf_counter
 
 import pyaudio
 import dashscope
 from dashscope.audio.tts_v2 import *
 from server.modules.base_handler import BaseHandler
+from server.modules.tts_cache import TTSAudioCache
+from utils.pipeline_manager import ResponseGate, TurnCancel
 
 class TTSMessageType(Enum):
     START = 1
@@ -23,33 +26,112 @@ class TTSMessage:
         self.type = type
         self.text = text
 
+def dashscope_synthesize(api_key: str, text: str, model: str = "cosyvoice-v1", voice: str = "longxiang"):
+    """非流式调用 DashScope 语音合成，返回 16kHz PCM 数据（用于缓存预热）"""
+    dashscope.api_key = api_key
+    synthesizer = SpeechSynthesizer(model=model, voice=voice, format=AudioFormat.PCM_16000HZ_MONO_16BIT)
+    audio = synthesizer.call(text)
+    return [audio] if audio else []
+
+
 # 对接文档
 # https://help.aliyun.com/zh/model-studio/developer-reference/cosyvoice-large-model-for-speech-synthesis/
 class TTSHandler(BaseHandler):
     def __init__(self, stop_event: Event):
         super().__init__(stop_event, is_async=True)
         self.synthesizer = None
-
-    def setup(self, api_key, should_listen:Event, model = "cosyvoice-v1", voice = "longxiang"):
+        self.cache = None
+        self.response_gate = None
+        self.turn_cancel = None
+        self.turn = 0
+
+    def setup(self, api_key, should_listen:Event, model = "cosyvoice-v1", voice = "longxiang",
+              cache: TTSAudioCache = None, response_gate: ResponseGate = None,
+              turn_cancel: TurnCancel = None):
         dashscope.api_key = api_key
         self.should_listen = should_listen
 
         self.model = model
         self.voice = voice
-
+        # 多个会话共享的音频缓存，None 表示不启用
+        self.cache = cache
+        self.response_gate = response_gate
+        # 当前合成任务的各段文本和音频。流式合成返回的音频无法按句拆开，
+        # 只有一个任务恰好是一句时才写入缓存
+        self.pending_texts = []
+        self.pending_audio = bytearray()
+        self.call_time = None
+        # 客户端取消回复时不再发送文本，丢弃已经合成的音频
+        self.turn_cancel = turn_cancel
+
+
+    def cancelled(self) -> bool:
+        """本轮回复是否已被客户端取消"""
+        return self.turn_cancel is not None and self.turn_cancel.is_cancelled(self.turn)
+
+    def put_output(self, output):
+        if self.cancelled():
+            return
+        # 回复音频开始输出，通知填充音频停止
+        if self.response_gate is not None:
+            self.response_gate.open()
+        self.tracer.first("tts.ttfb", "tts")
+        super().put_output(output)
 
     def async_process(self, message:TTSMessage):
         if message.type == TTSMessageType.START:
-            self.synthesizer = SpeechSynthesizer(
-                model=self.model,
-                voice=self.voice,
-                format=AudioFormat.PCM_16000HZ_MONO_16BIT,
-                callback=Callback(self),
-            )
+            # 合成器延迟到第一段未命中缓存的文本时再创建
+            self.synthesizer = None
+            self.pending_texts = []
+            self.pending_audio = bytearray()
+            self.turn = self.turn_cancel.current() if self.turn_cancel is not None else 0
         elif message.type == TTSMessageType.TXT:
+            self.tracer.start("tts")
+            if self.cancelled():
+                return
+            # 合成任务已经开始后不能再插入缓存音频，否则会打乱顺序
+            if self.synthesizer is None and self.cache is not None:
+                audio = self.cache.get(message.text, self.voice, self.model)
+                if audio is not None:
+                    for chunk in self.cache.iter_chunks(audio):
+                        self.put_output(chunk)
+                    return
+            if self.synthesizer is None:
+                self.synthesizer = SpeechSynthesizer(
+                    model=self.model,
+                    voice=self.voice,
+                    format=AudioFormat.PCM_16000HZ_MONO_16BIT,
+                    callback=Callback(self),
+                )
+                self.call_time = perf_counter()
+            self.pending_texts.append(message.text)
             self.synthesizer.streaming_call(message.text)
         elif message.type == TTSMessageType.END:
-            self.synthesizer.streaming_complete()
+            if self.synthesizer is None:
+                # 全部命中缓存
+                self.tracer.end("tts")
+                self.should_listen.set()
+            else:
+                self.synthesizer.streaming_complete()
+
+    def on_synthesis_data(self, data: bytes):
+        if self.call_time is not None:
+            latency = perf_counter() - self.call_time
+            self.call_time = None
+            logging.debug(f"TTS first audio after {latency:.3f} s")
+        self.put_output(data)
+        if self.cache is not None:
+            self.pending_audio += data
+
+    def on_synthesis_complete(self):
+        if self.cache is not None and self.pending_audio and len(self.pending_texts) == 1 and not self.cancelled():
+            self.cache.put(self.pending_texts[0], self.voice, self.model, bytes(self.pending_audio))
+        self.pending_audio = bytearray()
+        self.tracer.end("tts")
+        self.should_listen.set()
+
+    def on_synthesis_error(self):
+        self.should_listen.set()
 
 class Callback(ResultCallback):
     handler = None
@@ -59,10 +141,11 @@ class Callback(ResultCallback):
 
     def on_complete(self):
         logging.debug("speech synthesis task complete successfully.")
-        self.handler.should_listen.set()
+        self.handler.on_synthesis_complete()
 
     def on_error(self, message: str):
         logging.debug(f"speech synthesis task failed, {message}")
+        self.handler.on_synthesis_error()
 
     def on_close(self):
         logging.debug("websocket is closed.")
@@ -71,4 +154,4 @@ class Callback(ResultCallback):
         logging.debug(f"recv speech synthsis message {message}")
 
     def on_data(self, data: bytes) -> None:
-        self.handler.put_output(data)
+        self.handler.on_synthesis_data(data)
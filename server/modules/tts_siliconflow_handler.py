@@ -1,48 +1,223 @@
 import logging
 from asyncio import Event
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from threading import Semaphore, Thread
+from time import perf_counter
+from typing import Iterator, Callable, Dict, Any
 
 import requests
 
 from server.modules.base_handler import BaseHandler
+from server.modules.tts_cache import TTSAudioCache, AudioBuffer
 from server.modules.tts_handler import TTSMessage, TTSMessageType
+from utils.metrics import RollingHistogram
+from utils.pipeline_manager import ResponseGate, TurnCancel
+from utils.text_utils import split_sentences
+
+SILICONFLOW_TTS_URL = "https://api.siliconflow.cn/v1/audio/speech"
+DEFAULT_MODEL = "FunAudioLLM/CosyVoice2-0.5B"
+DEFAULT_VOICE = "FunAudioLLM/CosyVoice2-0.5B:alex"
+
+
+def siliconflow_synthesize(api_key: str, text: str, model: str = DEFAULT_MODEL, voice: str = DEFAULT_VOICE,
+                           chunk_size: int = 4096, url: str = SILICONFLOW_TTS_URL) -> Iterator[bytes]:
+    """调用 SiliconFlow 语音合成接口，流式返回 16kHz PCM 数据块"""
+    payload = {
+        "model": model,
+        "input": text,
+        "voice": voice,
+        "response_format": "pcm",
+        "sample_rate": 16000,
+        "stream": True,
+        "speed": 1,
+        "gain": 0
+    }
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+    spoken_response = requests.request("POST", url, json=payload, headers=headers, stream=True)
+    if spoken_response.status_code != 200:
+        logging.error(f"SiliconFlow TTS failed: {spoken_response.status_code} {spoken_response.text}")
+        return
+    for chunk in spoken_response.iter_content(chunk_size=chunk_size):
+        yield chunk
+
+
+class TTSLatencyStats:
+    """
+    每轮回复的首音和总耗时，按串行/并行模式统计，所有会话共享
+
+    导出为指标（collector 'tts_latency'），用于比较两种模式：每种模式的首音和总耗时各一个
+    滚动直方图，stats() 返回窗口内的分位数和累计平均值。
+    """
+
+    MODES = ("serial", "parallel")
+
+    def __init__(self):
+        self.histograms = {mode: {"first_audio": RollingHistogram(), "total": RollingHistogram()}
+                           for mode in self.MODES}
+
+    def record(self, mode: str, first_audio: float, total: float) -> None:
+        self.histograms[mode]["first_audio"].observe(first_audio)
+        self.histograms[mode]["total"].observe(total)
+
+    def stats(self) -> Dict[str, Any]:
+        """获取每种模式首音和总耗时的分位数、次数和平均值"""
+        result = {}
+        for mode, histograms in self.histograms.items():
+            result[mode] = {}
+            for name, histogram in histograms.items():
+                snapshot = histogram.snapshot()
+                snapshot["mean"] = histogram.sum / histogram.total if histogram.total else 0.0
+                result[mode][name] = snapshot
+        return result
 
 
 # 对接文档
 # https://docs.siliconflow.cn/api-reference/audio/create-speech
 class TTSSiliconflowHandler(BaseHandler):
+    """
+    SiliconFlow 语音合成处理器
+
+    串行模式（默认）在 END 时把整段回复合成一次；并行模式按句子并发请求合成接口，
+    再按句子顺序把音频写入输出队列，第 k 句输出时第 k+1 句可以同时在合成。
+    """
+
     def __init__(self, stop_event: Event):
         super().__init__(stop_event, is_async=True)
         self.synthesizer = None
+        self.cache = None
+        self.response_gate = None
+        self.executor = None
+        self.turn_cancel = None
+        self.turn = 0
 
-    def setup(self, should_listen: Event, api_key: str):
+    def setup(self, should_listen: Event, api_key: str, model: str = DEFAULT_MODEL, voice: str = DEFAULT_VOICE,
+              cache: TTSAudioCache = None, response_gate: ResponseGate = None,
+              parallel: bool = False, max_concurrency: int = 2, global_limiter: Semaphore = None,
+              url: str = SILICONFLOW_TTS_URL, turn_cancel: TurnCancel = None,
+              latency_stats: TTSLatencyStats = None):
+        """
+        Args:
+            parallel: 是否按句子并行合成
+            max_concurrency: 并行模式下本会话同时进行的合成请求数
+            global_limiter: 所有会话共享的并发限制，None 表示不限制
+            url: 合成接口地址（基准测试时指向本地替身服务）
+            turn_cancel: 客户端取消回复时停止合成，不再输出音频
+            latency_stats: 所有会话共享的首音和总耗时统计，None 表示只统计本会话
+        """
         self.should_listen = should_listen
         self.api_key = api_key
+        self.model = model
+        self.voice = voice
+        self.url = url
+        # 多个会话共享的音频缓存，None 表示不启用
+        self.cache = cache
+        self.response_gate = response_gate
+        self.turn_cancel = turn_cancel
+
+        self.parallel = parallel
+        self.global_limiter = global_limiter
+        if parallel:
+            self.executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="tts-sentence")
+
+        # 每轮回复的首音和总耗时，按模式统计，用于比较串行和并行
+        self.turn_start = None
+        self.first_audio_time = None
+        self.latency_stats = latency_stats if latency_stats is not None else TTSLatencyStats()
+
+    def cancelled(self) -> bool:
+        """本轮回复是否已被客户端取消"""
+        return self.turn_cancel is not None and self.turn_cancel.is_cancelled(self.turn)
+
+    def put_output(self, output):
+        if self.cancelled():
+            return
+        # 回复音频开始输出，通知填充音频停止
+        if self.response_gate is not None:
+            self.response_gate.open()
+        if self.first_audio_time is None and self.turn_start is not None:
+            self.first_audio_time = perf_counter() - self.turn_start
+        self.tracer.first("tts.ttfb", "tts")
+        super().put_output(output)
+
+    def synthesize(self, text: str, output: Callable[[AudioBuffer], None]) -> None:
+        """合成文本并通过 output 输出音频，优先使用缓存"""
+        if self.cache is not None:
+            audio = self.cache.get(text, self.voice, self.model)
+            if audio is not None:
+                for chunk in self.cache.iter_chunks(audio):
+                    output(chunk)
+                return
+
+        audio = bytearray()
+        for chunk in siliconflow_synthesize(self.api_key, text, self.model, self.voice, url=self.url):
+            if self.cancelled():
+                # 不完整的音频不写入缓存
+                return
+            output(chunk)
+            if self.cache is not None:
+                audio += chunk
+        if self.cache is not None:
+            self.cache.put(text, self.voice, self.model, bytes(audio))
+
+    def synthesize_sentence(self, text: str, chunks: Queue) -> None:
+        """并行模式下合成一句话，音频写入该句自己的队列，结束时写入 None"""
+        try:
+            if self.global_limiter is not None:
+                with self.global_limiter:
+                    self.synthesize(text, chunks.put)
+            else:
+                self.synthesize(text, chunks.put)
+        except Exception as e:
+            logging.error(f"Failed to synthesize sentence '{text}': {e}", exc_info=True)
+        finally:
+            chunks.put(None)
+
+    def submit_sentence(self, text: str) -> None:
+        if not text.strip() or self.cancelled():
+            return
+        chunks = Queue()
+        self.sentence_queues.put(chunks)
+        self.executor.submit(self.synthesize_sentence, text, chunks)
+
+    def reassemble(self, sentence_queues: Queue) -> None:
+        """按句子顺序输出音频，None 表示本轮回复结束"""
+        while True:
+            chunks = sentence_queues.get()
+            if chunks is None:
+                return
+            while (chunk := chunks.get()) is not None:
+                self.put_output(chunk)
 
     def async_process(self, message: TTSMessage):
         if message.type == TTSMessageType.START:
             self.input = ""
+            self.turn = self.turn_cancel.current() if self.turn_cancel is not None else 0
+            self.turn_start = perf_counter()
+            self.first_audio_time = None
+            if self.parallel:
+                self.sentence_queues = Queue()
+                self.reassembler = Thread(target=self.reassemble, args=(self.sentence_queues,), daemon=True)
+                self.reassembler.start()
         elif message.type == TTSMessageType.TXT:
+            self.tracer.start("tts")
             self.input += message.text
+            if self.parallel:
+                sentences, self.input = split_sentences(self.input)
+                for sentence in sentences:
+                    self.submit_sentence(sentence)
         elif message.type == TTSMessageType.END:
-            url = "https://api.siliconflow.cn/v1/audio/speech"
-            payload = {
-                "model": "FunAudioLLM/CosyVoice2-0.5B",
-                "input": self.input,
-                "voice": "FunAudioLLM/CosyVoice2-0.5B:alex",
-                "response_format": "pcm",
-                "sample_rate": 16000,
-                "stream": True,
-                "speed": 1,
-                "gain": 0
-            }
-            headers = {
-                "Authorization": f"Bearer {self.api_key}",
-                "Content-Type": "application/json"
-            }
-            spoken_response = requests.request("POST", url, json=payload, headers=headers)
-            if spoken_response.status_code == 200:
-                for chunk in spoken_response.iter_content(chunk_size=4096):
-                    self.put_output(chunk)
+            if self.parallel:
+                self.submit_sentence(self.input)
+                self.sentence_queues.put(None)
+                self.reassembler.join()
+            elif not self.cancelled():
+                self.synthesize(self.input, self.put_output)
+            self.record_turn()
+            self.tracer.end("tts")
 
             # 等待output清空，再继续
             while self.output_queues[0].qsize() > 0:
@@ -50,6 +225,23 @@ class TTSSiliconflowHandler(BaseHandler):
             logging.info("=============================should_listen=============================")
             self.should_listen.set()
 
+    def record_turn(self) -> None:
+        """记录本轮回复的首音和总耗时"""
+        if self.turn_start is None or self.first_audio_time is None:
+            return
+        mode = "parallel" if self.parallel else "serial"
+        total = perf_counter() - self.turn_start
+        self.latency_stats.record(mode, self.first_audio_time, total)
+        logging.info(f"TTS ({mode}) first audio {self.first_audio_time:.3f} s, total {total:.3f} s")
+
+    def stats(self) -> Dict[str, Any]:
+        """获取串行/并行模式的首音和总耗时"""
+        return self.latency_stats.stats()
+
+    def cleanup(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
 
 if __name__ == '__main__':
     handler = TTSSiliconflowHandler(Event())
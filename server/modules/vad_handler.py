@@ -9,23 +9,50 @@ sys.path.append(ROOT_DIR)
 
 import logging
 import numpy as np
+from functools import partial
 from typing import Generator
 from threading import Event
+from queue import Queue
 from funasr import AutoModel
 
 from server.modules.base_handler import BaseHandler
+from utils.audio_buffer import Float32Accumulator, release_buffer
+from utils.protocol import ControlEvent
 logging.getLogger().setLevel(logging.DEBUG)
 logger = logging.getLogger(__name__)
 
 
+def load_vad_model(**kwargs):
+    """kwargs 覆盖默认配置，如离线分段时恢复内部的静音检测（max_end_silence_time）"""
+    options = dict(
+        model="fsmn-vad",
+        model_revision="v2.0.4",
+        disable_pbar=True,  # 禁用进度条
+        disable_update=True,
+        max_end_silence_time=0  # 禁用内部的静音检测
+    )
+    options.update(kwargs)
+    return AutoModel(**options)
+
+
 class VADHandler(BaseHandler):
     """语音活动检测处理器，使用FunASR的FSMN-VAD模型"""
 
     def __init__(self, stop_event: Event):
         super().__init__(stop_event)
 
-    def setup(self, should_listen: Event) -> None:
+    def setup(self, should_listen: Event, event_queue: Queue = None, scheduler=None, response_gate=None,
+              turn_cancel=None) -> None:
         self.should_listen = should_listen
+        # 一句话结束时重置回复音频门、开始新的一轮（之前的取消不再生效）
+        self.response_gate = response_gate
+        self.turn_cancel = turn_cancel
+        # 收到的上行音频块数。句子结束的通知带上这个序号，传输层据此找到那一块的采集时间戳
+        self.frames_in = 0
+        # 检测到一句话结束时通知客户端
+        self.event_queue = event_queue
+        # 共享的 InferenceScheduler，为空时本会话加载自己的模型；流式状态在 vad_cache 中，可以在任意工作线程上运行
+        self.scheduler = scheduler
 
         self.chunk_size_ms = 240  # VAD duration
         self.chunk_size = int(16000 / 1000 * self.chunk_size_ms)
@@ -34,18 +61,15 @@ class VADHandler(BaseHandler):
         self.max_audio_duration = 120000  # 120 seconds
 
         # 初始化VAD模型
-        self.model = AutoModel(
-            model="fsmn-vad",
-            model_revision="v2.0.4",
-            disable_pbar=True,  # 禁用进度条
-            disable_update=True,
-            max_end_silence_time=0  # 禁用内部的静音检测
-        )
+        self.model = None
+        if scheduler is None:
+            self.model = load_vad_model()
+            logging.info("FSMN-VAD model loaded")
         self.reset()
-        logging.info("FSMN-VAD model loaded")
 
     def reset(self):
-        self.audio_buffer = np.array([], dtype=np.float32)
+        # 累积的音频（float32），按帧原地追加
+        self.pcm = Float32Accumulator()
         self.audio_process_last_pos_ms = 0
         self.vad_cache = {}
         self.vad_last_pos_ms = -1
@@ -54,11 +78,15 @@ class VADHandler(BaseHandler):
     def truncate(self):
         if self.audio_process_last_pos_ms < self.truncate_silence_duration:
             return
-        self.audio_buffer = self.audio_buffer[-self.chunk_size_ms * 16:] # Keep the last chunk
+        self.pcm.keep_last(self.chunk_size_ms * 16) # Keep the last chunk
 
         self.audio_process_last_pos_ms = 0 # The last chunk will be processed again
         self.vad_cache = {}
 
+    @property
+    def audio_buffer(self) -> np.ndarray:
+        return self.pcm.array
+
     def get_unprocessed_duration(self):
         return self.audio_buffer.shape[0] / 16 - self.audio_process_last_pos_ms
 
@@ -69,12 +97,14 @@ class VADHandler(BaseHandler):
 
 
     def process(self, frame: bytes) -> Generator[np.ndarray, None, None]:
+        self.frames_in += 1
         if not self.should_listen.is_set():
+            release_buffer(frame)
             return
 
-        # 将音频数据转换为float32格式
-        frame_fp32 = np.frombuffer(frame, dtype=np.int16).astype(np.float32) / 32768
-        self.audio_buffer = np.concatenate([self.audio_buffer, frame_fp32])
+        # 将音频数据转换为float32格式，直接写入累积缓冲；之后接收缓冲即可归还
+        self.pcm.append(frame)
+        release_buffer(frame)
         current_duration = self.audio_buffer.shape[0] / 16
 
         # 如果累积的音频数据足够长，进行VAD处理
@@ -86,12 +116,12 @@ class VADHandler(BaseHandler):
             self.audio_process_last_pos_ms += self.chunk_size_ms
 
             # 获取VAD输出
-            res = self.model.generate(
-                input=chunk,
-                cache=self.vad_cache,
-                is_final=False,
-                chunk_size=self.chunk_size_ms
-            )
+            if self.scheduler is None:
+                res = self.detect(self.model, chunk)
+            else:
+                # 每块必须在下一块到达前处理完，否则会越积越多
+                res = self.scheduler.run("vad", partial(self.detect, chunk=chunk),
+                                         cost_ms=self.chunk_size_ms, deadline_ms=self.chunk_size_ms)
 
             # 未检测到音频
             if len(res[0]['value']) <= 0:
@@ -111,19 +141,41 @@ class VADHandler(BaseHandler):
                 if silence_duration >= self.reply_silence_duration:
                     logger.info(f'Silence detected (duration: {silence_duration:.2f}ms), {self.audio_buffer.shape[0] / 16:.2f}ms of audio data')
                     self.should_listen.clear()
-                    yield self.audio_buffer
+                    self.tracer.begin(endpoint_ms=silence_duration)
+                    self.notify_turn_end()
+                    yield self.audio_buffer.copy()  # 缓冲会被原地修改，交给下游的是副本
                     self.cleanup()
                     break
 
                 if current_duration >= self.max_audio_duration:
                     logger.info(f'Max audio duration reached (duration: {current_duration:.2f}ms)')
                     self.should_listen.clear()
-                    yield self.audio_buffer
+                    self.tracer.begin()
+                    self.notify_turn_end()
+                    yield self.audio_buffer.copy()  # 缓冲会被原地修改，交给下游的是副本
                     self.cleanup()
                     break
 
         # logging.info(f'Processed {current_duration:.2f}ms of audio data')
 
+    def detect(self, model, chunk: np.ndarray):
+        return model.generate(
+            input=chunk,
+            cache=self.vad_cache,
+            is_final=False,
+            chunk_size=self.chunk_size_ms
+        )
+
+    def notify_turn_end(self):
+        if self.response_gate is not None:
+            self.response_gate.reset()
+        if self.turn_cancel is not None:
+            self.turn_cancel.begin()
+        self.tracer.set("utterance_ms", self.audio_buffer.shape[0] / 16)
+        if self.event_queue is not None:
+            self.event_queue.put({"event": ControlEvent.USER_TURN_END, "duration_ms": self.audio_buffer.shape[0] / 16,
+                                  "turn_id": self.tracer.turn_id, "uplink_frame": self.frames_in})
+
     def cleanup(self) -> None:
         """清理资源"""
         self.cache = {}
@@ -0,0 +1,291 @@
+"""
+声明式的管道配置
+
+管道由若干阶段组成，每个阶段指定类型（vad、asr、llm、tts、filler、audio_saver）、输入队列、
+输出队列、副本数和传给处理器的参数（options，未指定的沿用命令行参数）。队列按名称连接，
+名称是 PipelineQueues 的字段时使用该队列，否则创建新的队列；[queues] 中可以限制队列长度。
+
+- 没有阶段读取的输出队列不会连接（如没有配置填充音频时 VAD 不写 filler_prompt_queue），
+  send_audio_chunks_queue 由传输层读取，总是连接
+- 处理器依赖的共享对象不存在时（如没有 --filler_dir/--filler_phrases）该阶段跳过
+- 副本数大于 1 时多个处理器共享输入队列，输出按输入的顺序写入下游；VAD、LLM 有会话状态，
+  只能有一个副本；TTS 的副本数是本会话按句子并行合成的并发数（仅 siliconflow）
+
+配置文件为 TOML（或安装了 PyYAML 时的 YAML），格式与 DEFAULT_PIPELINE 相同，示例见
+server/pipeline.example.toml。
+"""
+import argparse
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from server.modules.asr_handler import AsrHandler
+from server.modules.audio_saver_handler import AudioSaverHandler
+from server.modules.base_handler import BaseHandler, OrderedReplicas
+from server.modules.filler_handler import FillerHandler
+from server.modules.llm_handler import LLMHandler
+from server.modules.tts_handler import TTSHandler
+from server.modules.tts_siliconflow_handler import TTSSiliconflowHandler, DEFAULT_MODEL, DEFAULT_VOICE
+from server.modules.vad_handler import VADHandler
+from utils.pipeline_manager import PipelineManager
+
+# 由传输层写入或读取的队列
+EXTERNAL_INPUTS = {"recv_audio_chunks_queue"}
+EXTERNAL_OUTPUTS = {"send_audio_chunks_queue"}
+
+DEFAULT_PIPELINE: Dict[str, Any] = {
+    "queues": {},
+    "stages": [
+        {"name": "vad", "type": "vad", "input": "recv_audio_chunks_queue",
+         "outputs": ["spoken_prompt_queue", "saver_prompt_queue", "filler_prompt_queue"]},
+        {"name": "audio_saver", "type": "audio_saver", "input": "saver_prompt_queue"},
+        {"name": "filler", "type": "filler", "input": "filler_prompt_queue"},
+        {"name": "asr", "type": "asr", "input": "spoken_prompt_queue", "outputs": ["text_prompt_queue"]},
+        {"name": "llm", "type": "llm", "input": "text_prompt_queue", "outputs": ["lm_response_queue"]},
+        {"name": "tts", "type": "tts", "input": "lm_response_queue", "outputs": ["send_audio_chunks_queue"]},
+    ],
+}
+
+
+@dataclass
+class StageConfig:
+    name: str
+    type: str
+    input: str
+    outputs: List[str] = field(default_factory=list)
+    replicas: int = 1
+    options: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class StageType:
+    # 创建一个处理器（不含队列），依赖的共享对象不存在时返回 None
+    build: Callable[[PipelineManager, argparse.Namespace, StageConfig], Optional[BaseHandler]]
+    max_replicas: int = 0  # 0 表示不限制
+    # True 表示副本数由处理器自己实现（只创建一个处理器）
+    internal_replicas: bool = False
+
+
+STAGE_TYPES: Dict[str, StageType] = {}
+
+
+def register_stage(name: str, max_replicas: int = 0, internal_replicas: bool = False):
+    """注册阶段类型"""
+    def decorator(build):
+        STAGE_TYPES[name] = StageType(build, max_replicas, internal_replicas)
+        return build
+    return decorator
+
+
+@register_stage("vad", max_replicas=1)
+def build_vad(pipeline: PipelineManager, args: argparse.Namespace, stage: StageConfig) -> BaseHandler:
+    handler = VADHandler(stop_event=pipeline.states.stop_event)
+    handler.setup(
+        should_listen=pipeline.states.should_listen,
+        event_queue=pipeline.queues.event_queue,
+        scheduler=args.inference_scheduler,
+        response_gate=pipeline.states.response_gate,
+        turn_cancel=pipeline.states.turn_cancel,
+    )
+    pipeline.states.should_listen.set()
+    return handler
+
+
+@register_stage("audio_saver")
+def build_audio_saver(pipeline: PipelineManager, args: argparse.Namespace, stage: StageConfig) -> Optional[BaseHandler]:
+    if args.audio_saver is None:
+        return None
+    # 编码和写入在共享的后台线程中进行
+    handler = AudioSaverHandler(stop_event=pipeline.states.stop_event)
+    handler.setup(writer=args.audio_saver, session_id=pipeline.states.current_session_id)
+    return handler
+
+
+@register_stage("filler", max_replicas=1)
+def build_filler(pipeline: PipelineManager, args: argparse.Namespace, stage: StageConfig) -> Optional[BaseHandler]:
+    if args.filler_bank is None:
+        return None
+    options = stage.options
+    handler = FillerHandler(stop_event=pipeline.states.stop_event)
+    handler.setup(
+        bank=args.filler_bank,
+        response_gate=pipeline.states.response_gate,
+        send_queue=pipeline.queue(options.get("send_queue", "send_audio_chunks_queue")),
+        delay_ms=options.get("delay_ms", args.filler_delay_ms),
+        min_utterance_ms=options.get("min_utterance_ms", args.filler_min_utterance_ms),
+        # 过载时不播放填充音频
+        enabled=lambda: not args.admission.degraded(),
+    )
+    return handler
+
+
+@register_stage("asr")
+def build_asr(pipeline: PipelineManager, args: argparse.Namespace, stage: StageConfig) -> BaseHandler:
+    options = stage.options
+    handler = AsrHandler(stop_event=pipeline.states.stop_event)
+    handler.setup(
+        event_queue=pipeline.queues.event_queue,
+        scheduler=args.inference_scheduler,
+        deadline_ms=options.get("deadline_ms", args.asr_deadline_ms),
+        max_chunk_s=options.get("max_chunk_s", args.asr_chunk_s),
+    )
+    return handler
+
+
+@register_stage("llm", max_replicas=1)
+def build_llm(pipeline: PipelineManager, args: argparse.Namespace, stage: StageConfig) -> BaseHandler:
+    options = stage.options
+    handler = LLMHandler(stop_event=pipeline.states.stop_event)
+    extra = {"init_chat_prompt": options["prompt"]} if "prompt" in options else {}
+    handler.setup(
+        model_name=options.get("model", args.llm_model_name),
+        base_url=options.get("base_url", args.llm_base_url),
+        api_key=args.llm_api_key,
+        stream=True,
+        cache=args.llm_cache,
+        turn_cancel=pipeline.states.turn_cancel,
+        **extra,
+    )
+    return handler
+
+
+@register_stage("tts", internal_replicas=True)
+def build_tts(pipeline: PipelineManager, args: argparse.Namespace, stage: StageConfig) -> BaseHandler:
+    options = stage.options
+    backend = options.get("backend", args.tts_backend)
+    # 换了后端时不沿用另一个后端的默认模型和音色
+    if backend == args.tts_backend:
+        model, voice = args.tts_model, args.tts_voice
+    elif backend == 'dashscope':
+        model, voice = 'cosyvoice-v1', 'longxiang'
+    else:
+        model, voice = DEFAULT_MODEL, DEFAULT_VOICE
+    model = options.get("model", model)
+    voice = options.get("voice", voice)
+
+    if backend == 'dashscope':
+        if stage.replicas > 1:
+            raise ValueError(f"Stage '{stage.name}': dashscope TTS does not support replicas")
+        handler = TTSHandler(stop_event=pipeline.states.stop_event)
+        handler.setup(
+            api_key=args.tts_api_key,
+            should_listen=pipeline.states.should_listen,
+            model=model,
+            voice=voice,
+            cache=args.tts_cache,
+            response_gate=pipeline.states.response_gate,
+            turn_cancel=pipeline.states.turn_cancel,
+        )
+        return handler
+    if backend != 'siliconflow':
+        raise ValueError(f"Stage '{stage.name}': unknown TTS backend '{backend}'")
+    parallel = stage.replicas > 1 or options.get("parallel", args.tts_parallel)
+    handler = TTSSiliconflowHandler(stop_event=pipeline.states.stop_event)
+    handler.setup(
+        api_key=args.tts_api_key,
+        should_listen=pipeline.states.should_listen,
+        model=model,
+        voice=voice,
+        cache=args.tts_cache,
+        response_gate=pipeline.states.response_gate,
+        parallel=parallel,
+        max_concurrency=stage.replicas if stage.replicas > 1 else args.tts_session_concurrency,
+        global_limiter=args.tts_global_limiter,
+        url=options.get("url", args.tts_url),
+        turn_cancel=pipeline.states.turn_cancel,
+        latency_stats=args.tts_latency,
+    )
+    return handler
+
+
+def parse_pipeline_config(config: Dict[str, Any]) -> List[StageConfig]:
+    """检查配置并返回阶段列表，配置错误时抛出 ValueError"""
+    stages = []
+    inputs: Dict[str, str] = {}
+    for item in config.get("stages", []):
+        try:
+            stage = StageConfig(**item)
+        except TypeError as e:
+            raise ValueError(f"Invalid stage {item}: {e}")
+        stage_type = STAGE_TYPES.get(stage.type)
+        if stage_type is None:
+            raise ValueError(f"Stage '{stage.name}': unknown type '{stage.type}', expected one of {sorted(STAGE_TYPES)}")
+        if stage.replicas < 1:
+            raise ValueError(f"Stage '{stage.name}': replicas must be >= 1, got {stage.replicas}")
+        if stage_type.max_replicas and stage.replicas > stage_type.max_replicas:
+            raise ValueError(f"Stage '{stage.name}': {stage.type} supports at most {stage_type.max_replicas} replicas")
+        # 队列中的每个元素只会被一个处理器取出，扇出需要使用不同的队列
+        if stage.input in inputs:
+            raise ValueError(f"Stages '{inputs[stage.input]}' and '{stage.name}' both read {stage.input}")
+        inputs[stage.input] = stage.name
+        stages.append(stage)
+    if not stages:
+        raise ValueError("Pipeline config has no stages")
+    return stages
+
+
+def load_pipeline_config(path: str) -> Dict[str, Any]:
+    """读取 TOML 或 YAML 管道配置并检查"""
+    if path.endswith((".yaml", ".yml")):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("YAML pipeline config requires PyYAML, use TOML instead")
+        with open(path, encoding="utf-8") as f:
+            config = yaml.safe_load(f)
+    else:
+        import tomllib
+
+        with open(path, "rb") as f:
+            config = tomllib.load(f)
+    parse_pipeline_config(config)
+    return config
+
+
+def build_handlers(pipeline: PipelineManager, args: argparse.Namespace,
+                   config: Optional[Dict[str, Any]] = None) -> List[BaseHandler]:
+    """
+    按管道配置创建处理器并连接队列
+
+    Args:
+        pipeline: 管道管理器实例
+        args: 命令行参数（包含共享对象）
+        config: 管道配置，None 表示使用 DEFAULT_PIPELINE
+
+    Returns:
+        List: 处理器列表
+    """
+    config = config or DEFAULT_PIPELINE
+    for name, spec in config.get("queues", {}).items():
+        pipeline.queue(name, spec.get("maxsize", 0))
+
+    active = []
+    for stage in parse_pipeline_config(config):
+        stage_type = STAGE_TYPES[stage.type]
+        count = 1 if stage_type.internal_replicas else stage.replicas
+        handlers = [stage_type.build(pipeline, args, stage) for _ in range(count)]
+        if handlers[0] is None:
+            logging.debug(f"Pipeline stage '{stage.name}' skipped")
+            continue
+        active.append((stage, handlers))
+
+    consumed = EXTERNAL_OUTPUTS | {stage.input for stage, _ in active}
+    produced = EXTERNAL_INPUTS | {name for stage, _ in active for name in stage.outputs}
+    result = []
+    for stage, handlers in active:
+        if stage.input not in produced:
+            logging.warning(f"Pipeline stage '{stage.name}' reads {stage.input}, which no stage writes")
+        input_queue = pipeline.queue(stage.input)
+        outputs = [pipeline.queue(name) for name in stage.outputs if name in consumed]
+        if len(handlers) > 1 and not handlers[0].is_async:
+            replicas = OrderedReplicas(input_queue, outputs)
+            for handler in handlers:
+                replicas.attach(handler)
+        else:
+            for handler in handlers:
+                handler.add_input_queue(input_queue)
+                for queue in outputs:
+                    handler.add_output_queue(queue)
+        result.extend(handlers)
+    logging.info(f"Pipeline: {', '.join(f'{stage.name}x{stage.replicas}' for stage, _ in active)}")
+    return result
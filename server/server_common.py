@@ -0,0 +1,325 @@
+import argparse
+import json
+import logging
+import threading
+from functools import partial
+from queue import Queue
+from typing import Callable, List, Optional
+
+from server.modules.asr_handler import load_asr_model
+from server.modules.audio_saver_handler import AudioSaveWriter
+from server.modules.filler_handler import FillerBank
+from server.modules.llm_cache import LLMResponseCache
+from server.modules.inference_scheduler import InferenceScheduler
+from server.modules.tts_cache import TTSAudioCache
+from server.modules.tts_handler import dashscope_synthesize
+from server.modules.tts_siliconflow_handler import siliconflow_synthesize, DEFAULT_MODEL, DEFAULT_VOICE, \
+    SILICONFLOW_TTS_URL, TTSLatencyStats
+from server.modules.vad_handler import load_vad_model
+from server.pipeline_graph import build_handlers, load_pipeline_config
+from server.transport import TransportSession
+from utils.admission import AdmissionController
+from utils.metrics import MetricsRegistry, start_metrics_server
+from utils.pipeline_manager import PipelineManager
+from utils.pipeline_pool import PipelinePool
+from utils.profiler import SamplingProfiler, install_signal_toggle
+from utils.session_recorder import SessionRecorder
+from utils.session_registry import SessionRegistry
+from utils.tracing import TraceExporter
+
+
+def add_common_args(parser: argparse.ArgumentParser):
+    """socket 和 websocket 服务器共用的命令行参数，监听地址和传输相关的参数由各服务器添加"""
+    # 下行音频和静音补偿
+    parser.add_argument('--downlink_frame_ms', type=int, default=40, help='下行音频合并成的帧长（毫秒），0表示不合并也不限速')
+    parser.add_argument('--downlink_lead_ms', type=int, default=200, help='下行音频最多领先实时播放进度的时长（毫秒）')
+    parser.add_argument('--dtx_fill_ms', type=int, default=1500, help='客户端静音（DTX）结束时按实际中断时长补给VAD的静音，最长（毫秒）')
+    # 音频配置
+    parser.add_argument('--audio-save-dir', default='audio_saves', help='音频保存目录')
+    parser.add_argument('--save_audio', action='store_true', help='保存VAD检测到的每句话（OGG/Opus）')
+    parser.add_argument('--audio_save_workers', type=int, default=1, help='保存音频的编码和写入线程数')
+    parser.add_argument('--audio_save_max_pending', type=int, default=32, help='等待保存的最大句数，超过后丢弃')
+    parser.add_argument('--audio_save_fsync_s', type=float, default=1.0, help='批量fsync保存文件的间隔（秒），0表示不fsync')
+    # llm
+    parser.add_argument('--llm_model_name', default='cosyvoice-v1', help='LLM模型名称')
+    parser.add_argument('--llm_base_url', default='', help='LLM模型地址')
+    parser.add_argument('--llm_api_key', default='', help='LLM API KEY')
+    parser.add_argument('--llm_cache_size', type=int, default=0, help='LLM回复缓存条目数，0表示不启用')
+    parser.add_argument('--llm_cache_ttl', type=float, default=24 * 3600, help='LLM回复缓存有效期（秒）')
+    parser.add_argument('--llm_cache_dir', default='', help='LLM回复缓存磁盘目录，为空表示只使用内存')
+    parser.add_argument('--llm_cache_disk_items', type=int, default=10000, help='LLM回复缓存磁盘层最大文件数')
+    parser.add_argument('--llm_cache_history_turns', type=int, default=0, help='参与缓存键计算的历史消息条数')
+    # tts
+    parser.add_argument('--tts_api_key', default='', help='TTS API KEY')
+    parser.add_argument('--tts_backend', default='siliconflow', choices=['siliconflow', 'dashscope'], help='TTS后端')
+    parser.add_argument('--tts_model', default='', help='TTS模型，为空时使用后端默认值')
+    parser.add_argument('--tts_voice', default='', help='TTS音色，为空时使用后端默认值')
+    parser.add_argument('--tts_url', default=SILICONFLOW_TTS_URL, help='SiliconFlow语音合成接口地址')
+    parser.add_argument('--tts_cache_bytes', type=int, default=0, help='TTS音频缓存内存上限（字节），0表示不启用')
+    parser.add_argument('--tts_cache_dir', default='', help='TTS音频缓存磁盘目录，为空表示只使用内存')
+    parser.add_argument('--tts_cache_disk_bytes', type=int, default=1024 * 1024 * 1024, help='TTS音频缓存磁盘层总大小上限（字节），超过后删除最久未使用的文件')
+    parser.add_argument('--tts_cache_warm_file', default='', help='启动时预热TTS缓存的短语文件，每行一句')
+    parser.add_argument('--tts_parallel', action='store_true', help='按句子并行合成语音')
+    parser.add_argument('--tts_session_concurrency', type=int, default=2, help='并行合成时每个会话的并发请求数')
+    parser.add_argument('--tts_global_concurrency', type=int, default=0, help='并行合成时全局的并发请求数，0表示不限制')
+    parser.add_argument('--inference_workers', type=int, default=0, help='共享VAD/ASR推理工作线程数，0表示每个会话加载自己的模型')
+    parser.add_argument('--asr_deadline_ms', type=int, default=1500, help='使用共享推理线程时ASR任务的截止时间（毫秒），长语音按时长放宽')
+    parser.add_argument('--asr_chunk_s', type=float, default=20, help='使用共享推理线程时长语音拆分的块长（秒）')
+    parser.add_argument('--filler_dir', default='', help='填充音频目录（16kHz单声道WAV）')
+    parser.add_argument('--filler_phrases', default='', help='启动时合成的填充短语，用|分隔，如"嗯|好的，我看一下"')
+    parser.add_argument('--filler_delay_ms', type=int, default=250, help='语音结束后多久开始播放填充音频')
+    parser.add_argument('--filler_min_utterance_ms', type=int, default=800, help='短于该时长的语音不播放填充音频')
+    parser.add_argument('--max_sessions', type=int, default=0, help='最大活跃会话数，0表示不限制')
+    parser.add_argument('--max_queue_depth', type=int, default=0, help='所有会话推理队列的总积压上限，0表示不限制')
+    parser.add_argument('--asr_latency_slo', type=float, default=0, help='ASR处理耗时P90的SLO（秒），0表示不检查')
+    parser.add_argument('--llm_latency_slo', type=float, default=0, help='LLM每段输出耗时P90的SLO（秒），0表示不检查')
+    parser.add_argument('--admission_wait_s', type=float, default=0, help='负载过高时新连接最多等待的时间（秒），0表示立即拒绝')
+    parser.add_argument('--degrade_load', type=float, default=0.8, help='负载分数超过该值时关闭填充音频等可选功能')
+    parser.add_argument('--metrics_port', type=int, default=0, help='Prometheus指标HTTP端口（/metrics），0表示不启动')
+    parser.add_argument('--profile_interval_ms', type=float, default=5, help='采样分析的采样间隔（毫秒）')
+    parser.add_argument('--profile_dir', type=str, default='.', help='收到SIGUSR1停止采样时collapsed stacks的保存目录')
+    parser.add_argument('--trace_file', type=str, default='', help='按轮次记录各阶段耗时的JSONL文件，为空表示不记录')
+    parser.add_argument('--trace_max_mb', type=int, default=50, help='JSONL文件滚动大小（MB）')
+    parser.add_argument('--otlp_endpoint', type=str, default='', help='OTLP/HTTP traces地址，如 http://localhost:4318/v1/traces，为空表示不发送')
+    parser.add_argument('--record_dir', type=str, default='', help='会话录音目录（上下行音频和控制消息，可重放），为空表示不录音')
+    parser.add_argument('--record_segment_mb', type=int, default=64, help='单个录音文件预分配的大小（MB）')
+    parser.add_argument('--record_max_segments', type=int, default=4, help='每个会话保留的录音文件数，0表示不限制')
+    parser.add_argument('--pipeline_config', type=str, default='', help='管道配置文件（TOML/YAML），为空时使用默认管道')
+    parser.add_argument('--pipeline_pool_min', type=int, default=1, help='预先构建的空闲管道最少保持数')
+    parser.add_argument('--pipeline_pool_max', type=int, default=4, help='预先构建的空闲管道最多保持数（随连接到达速率调整），0表示不预先构建；没有 --inference_workers 时每个管道加载自己的模型，不预先构建')
+    parser.add_argument('--pipeline_pool_max_age_s', type=float, default=600, help='空闲管道的最长保留时间（秒），超过后换成新的')
+    parser.add_argument('--resume_grace_s', type=float, default=30, help='连接断开后保留会话等待客户端重连的时间（秒），0表示不保留')
+
+
+def build_shared(args: argparse.Namespace, queue_factory: Callable[[], Queue] = Queue):
+    """
+    创建所有会话共享的对象并挂到 args 上：准入控制、推理线程、指标、会话恢复、采样分析、
+    轮次追踪、语音保存、LLM/TTS 缓存、填充音频、TTS 耗时统计和并发限制、预构建管道池
+
+    Args:
+        args: 解析后的命令行参数（包含 add_common_args 添加的参数和 --host）
+        queue_factory: 管道队列的类型，asyncio 模式的发送队列需要唤醒事件循环
+    """
+    # 管道的阶段、队列和副本数
+    args.pipeline = load_pipeline_config(args.pipeline_config) if args.pipeline_config else None
+
+    # 所有会话共享的准入控制
+    latency_slo = {}
+    if args.asr_latency_slo > 0:
+        latency_slo['AsrHandler'] = args.asr_latency_slo
+    if args.llm_latency_slo > 0:
+        latency_slo['LLMHandler'] = args.llm_latency_slo
+    args.admission = AdmissionController(
+        max_sessions=args.max_sessions,
+        max_queue_depth=args.max_queue_depth,
+        latency_slo=latency_slo,
+        wait_timeout=args.admission_wait_s,
+        degrade_load=args.degrade_load,
+    )
+
+    # 所有会话共享的VAD/ASR推理工作线程
+    args.inference_scheduler = None
+    if args.inference_workers > 0:
+        args.inference_scheduler = InferenceScheduler(workers=args.inference_workers)
+        args.inference_scheduler.register("vad", load_vad_model, priority=0)
+        args.inference_scheduler.register("asr", load_asr_model, priority=1)
+        args.inference_scheduler.start()
+
+    # 所有会话共享的指标汇总
+    args.metrics = MetricsRegistry()
+    args.metrics.add_collector('admission', args.admission.stats)
+    # 所有会话共享的会话恢复令牌
+    args.sessions = None
+    if args.resume_grace_s > 0:
+        args.sessions = SessionRegistry(grace_s=args.resume_grace_s)
+        args.metrics.add_collector('sessions', args.sessions.stats)
+    if args.inference_scheduler is not None:
+        args.metrics.add_collector('inference', args.inference_scheduler.stats)
+    # 按需开启的采样分析：SIGUSR1 开始/停止，或通过指标端口的 /debug/profile 接口
+    args.profiler = SamplingProfiler(interval=args.profile_interval_ms / 1000, dump_dir=args.profile_dir)
+    install_signal_toggle(args.profiler)
+    args.metrics.add_collector('profiler', args.profiler.stats)
+    if args.metrics_port > 0:
+        start_metrics_server(args.metrics, args.host, args.metrics_port, routes={
+            '/debug/profile': lambda query: args.profiler.profile(float(query.get('seconds', 10))),
+            '/debug/profile/start': lambda query: 'started\n' if args.profiler.start() else 'already running\n',
+            '/debug/profile/stop': lambda query: args.profiler.stop(),
+            '/debug/threads': lambda query: json.dumps(args.profiler.thread_stats(), indent=2),
+        })
+
+    # 所有会话共享的轮次追踪导出
+    args.tracing = None
+    if args.trace_file or args.otlp_endpoint:
+        args.tracing = TraceExporter(
+            path=args.trace_file or None,
+            max_bytes=args.trace_max_mb * 1024 * 1024,
+            otlp_endpoint=args.otlp_endpoint or None,
+        )
+        args.metrics.add_collector('tracing', args.tracing.stats)
+
+    # 所有会话共享的语音保存
+    args.audio_saver = None
+    if args.save_audio:
+        args.audio_saver = AudioSaveWriter(
+            save_dir=args.audio_save_dir,
+            workers=args.audio_save_workers,
+            max_pending=args.audio_save_max_pending,
+            fsync_interval=args.audio_save_fsync_s,
+        )
+        args.metrics.add_collector('audio_saver', args.audio_saver.stats)
+
+    # 所有会话共享的LLM回复缓存
+    args.llm_cache = None
+    if args.llm_cache_size > 0:
+        args.llm_cache = LLMResponseCache(
+            max_items=args.llm_cache_size,
+            ttl=args.llm_cache_ttl,
+            disk_dir=args.llm_cache_dir or None,
+            history_turns=args.llm_cache_history_turns,
+            disk_max_items=args.llm_cache_disk_items,
+        )
+        args.metrics.add_collector('llm_cache', args.llm_cache.stats)
+
+    # TTS后端
+    if args.tts_backend == 'dashscope':
+        default_model, default_voice, synthesize_fn = 'cosyvoice-v1', 'longxiang', dashscope_synthesize
+    else:
+        default_model, default_voice, synthesize_fn = DEFAULT_MODEL, DEFAULT_VOICE, partial(siliconflow_synthesize, url=args.tts_url)
+    args.tts_model = args.tts_model or default_model
+    args.tts_voice = args.tts_voice or default_voice
+    synthesize = partial(synthesize_fn, args.tts_api_key, model=args.tts_model, voice=args.tts_voice)
+
+    # 所有会话共享的TTS音频缓存
+    args.tts_cache = None
+    if args.tts_cache_bytes > 0:
+        args.tts_cache = TTSAudioCache(max_bytes=args.tts_cache_bytes, disk_dir=args.tts_cache_dir or None,
+                                       disk_max_bytes=args.tts_cache_disk_bytes)
+        args.metrics.add_collector('tts_cache', args.tts_cache.stats)
+        if args.tts_cache_warm_file:
+            with open(args.tts_cache_warm_file, encoding='utf-8') as f:
+                phrases = [line for line in f if line.strip()]
+            threading.Thread(
+                target=args.tts_cache.warm,
+                args=(phrases, args.tts_voice, args.tts_model, synthesize),
+                daemon=True,
+            ).start()
+
+    # 所有会话共享的填充音频库
+    args.filler_bank = None
+    if args.filler_dir:
+        args.filler_bank = FillerBank.from_dir(args.filler_dir)
+    elif args.filler_phrases:
+        args.filler_bank = FillerBank.from_phrases(args.filler_phrases.split('|'), synthesize)
+
+    # 所有会话共享的SiliconFlow合成首音和总耗时统计
+    args.tts_latency = TTSLatencyStats()
+    args.metrics.add_collector('tts_latency', args.tts_latency.stats)
+
+    # 所有会话共享的TTS并发限制
+    args.tts_global_limiter = None
+    if args.tts_global_concurrency > 0:
+        args.tts_global_limiter = threading.BoundedSemaphore(args.tts_global_concurrency)
+
+    # 所有连接共享的预构建管道池，依赖上面的共享对象，最后创建
+    # 没有共享推理线程时每个管道加载自己的模型，空闲管道会占用大量内存，不预先构建
+    pool_max = args.pipeline_pool_max if args.inference_scheduler is not None else 0
+    if args.pipeline_pool_max > 0 and pool_max == 0:
+        logging.info("Pipeline pool disabled: pipelines load their own models without --inference_workers")
+    args.pipeline_pool = PipelinePool(
+        partial(create_pipeline, args, queue_factory),
+        min_idle=args.pipeline_pool_min,
+        max_idle=pool_max,
+        max_age_s=args.pipeline_pool_max_age_s,
+    )
+    args.pipeline_pool.start()
+    args.metrics.add_collector('pipeline_pool', args.pipeline_pool.stats)
+
+
+def setup_and_start_pipeline(args: argparse.Namespace, conn_handler):
+    pipeline = acquire_pipeline(args)
+    conn_handler.setup(
+        should_listen=pipeline.states.should_listen,
+        queue_in=pipeline.queues.recv_audio_chunks_queue,
+        queue_out=pipeline.queues.send_audio_chunks_queue,
+        event_queue=pipeline.queues.event_queue,
+        tracer=pipeline.states.tracer,
+        recorder=create_recorder(args, pipeline),
+        turn_cancel=pipeline.states.turn_cancel,
+    )
+    session = conn_handler.session
+    conn_handler.on_close = partial(connection_closed, args, pipeline, session)
+    if args.sessions is not None:
+        args.sessions.register(pipeline, session, on_expire=partial(end_session, args, pipeline, session),
+                               disconnect=conn_handler.disconnect)
+    args.admission.track(pipeline, pipeline.handlers)
+    # 对连接的处理handler接到已经启动的管道上
+    pipeline.add_handler(conn_handler)
+
+
+def create_pipeline(args: argparse.Namespace, queue_factory: Callable[[], Queue] = Queue) -> PipelineManager:
+    """构建并启动一个还没有接上连接的管道，由管道池在后台或在池为空时调用"""
+    pipeline = PipelineManager(queue_factory=queue_factory, tracing=args.tracing)
+    pipeline.build_pipeline(create_handlers(pipeline, args))
+    pipeline.start()
+    return pipeline
+
+
+def acquire_pipeline(args: argparse.Namespace) -> PipelineManager:
+    """从管道池取一个空闲管道，池为空时现场构建"""
+    pipeline = args.pipeline_pool.acquire()
+    if pipeline is None:
+        pipeline = args.pipeline_pool.build()
+    pipeline.bind_metrics(args.metrics)
+    return pipeline
+
+
+def create_recorder(args: argparse.Namespace, pipeline: PipelineManager) -> Optional[SessionRecorder]:
+    """设置了 --record_dir 时为会话创建录音"""
+    if not args.record_dir:
+        return None
+    return SessionRecorder(
+        args.record_dir,
+        pipeline.states.current_session_id,
+        segment_bytes=args.record_segment_mb * 1024 * 1024,
+        max_segments=args.record_max_segments,
+    )
+
+
+def connection_closed(args: argparse.Namespace, pipeline: PipelineManager, session: TransportSession,
+                      resumable: bool = True):
+    """连接断开：开启了会话恢复时保留管道等待客户端重连，客户端正常关闭或没有开启时结束会话"""
+    if resumable and args.sessions is not None and session.framed and args.sessions.detach(session.token):
+        return
+    end_session(args, pipeline, session)
+
+
+def end_session(args: argparse.Namespace, pipeline: PipelineManager, session: TransportSession):
+    """会话结束：令牌失效，关闭录音，释放管道"""
+    if args.sessions is not None:
+        args.sessions.remove(session.token)
+    session.close()
+    close_session(args, pipeline)
+
+
+def close_session(args: argparse.Namespace, pipeline: Optional[PipelineManager]):
+    """连接关闭：释放准入名额并通知管道线程退出，pipeline 为 None 表示连接在接上管道前关闭"""
+    args.admission.release(pipeline)
+    if args.inference_scheduler is not None:
+        logging.info(f"Inference scheduler stats: {args.inference_scheduler.stats()}")
+    if pipeline is not None:
+        args.metrics.unregister_pipeline(pipeline)
+        pipeline.states.stop_event.set()
+
+
+def create_handlers(pipeline: PipelineManager, args: argparse.Namespace) -> List:
+    """
+    按管道配置（--pipeline_config，默认为 server.pipeline_graph.DEFAULT_PIPELINE）创建处理器列表
+
+    Args:
+        pipeline: 管道管理器实例
+        args: 命令行参数
+
+    Returns:
+        List: 处理器列表
+    """
+    return build_handlers(pipeline, args, args.pipeline)
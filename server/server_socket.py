@@ -3,94 +3,19 @@ import asyncio
 import logging
 import socket
 import threading
-from queue import Empty, Queue
+import time
+from functools import partial
+from queue import Queue
 from threading import Event
-from typing import List
-
-from server.modules.asr_handler import AsrHandler
-from server.modules.llm_handler import LLMHandler
-from server.modules.tts_siliconflow_handler import TTSSiliconflowHandler
-from server.modules.vad_handler import VADHandler
-from utils.pipeline_manager import PipelineManager
-
-
-def setup_and_start_pipeline(args: argparse.Namespace, socket_handler):
-    pipeline = PipelineManager()
-    handlers = create_handlers(pipeline, args)
-    # 在handlers头部追加一个对socket conn的处理handler
-    socket_handler.setup(
-        should_listen=pipeline.states.should_listen,
-        queue_in=pipeline.queues.recv_audio_chunks_queue,
-        queue_out=pipeline.queues.send_audio_chunks_queue,
-    )
-    handlers.insert(0, socket_handler)
-
-    pipeline.build_pipeline(handlers)
-    pipeline.start()
+from typing import Any, Dict, Optional
 
-
-def create_handlers(pipeline: PipelineManager, args: argparse.Namespace) -> List:
-    """
-    创建处理器列表
-    
-    Args:
-        pipeline: 管道管理器实例
-        args: 命令行参数
-
-    Returns:
-        List: 处理器列表
-    """
-    handlers = []
-    
-    # 1. 创建VAD处理器
-    vad_handler = VADHandler(stop_event=pipeline.states.stop_event)
-    vad_handler.add_input_queue(pipeline.queues.recv_audio_chunks_queue)
-    vad_handler.add_output_queue(pipeline.queues.spoken_prompt_queue)
-    vad_handler.setup(should_listen=pipeline.states.should_listen)
-    pipeline.states.should_listen.set()
-    handlers.append(vad_handler)
-
-    # 2. 创建原始音频保存处理器
-    # raw_audio_saver = AudioSaverHandler(stop_event=pipeline.states.stop_event)
-    # raw_audio_saver.add_input_queue(pipeline.queues.spoken_prompt_queue)
-    # raw_audio_saver.setup(
-    #     save_dir=args.audio_save_dir,
-    #     sample_rate=args.sample_rate,
-    #     channels=args.channels
-    # )
-    # handlers.append(raw_audio_saver)
-    
-    # 3. asr
-    asr_handler = AsrHandler(stop_event=pipeline.states.stop_event)
-    asr_handler.add_input_queue(pipeline.queues.spoken_prompt_queue)
-    asr_handler.add_output_queue(pipeline.queues.text_prompt_queue)
-    asr_handler.setup()
-    handlers.append(asr_handler)
-
-    # 4. llm
-    llm_handler = LLMHandler(stop_event=pipeline.states.stop_event)
-    llm_handler.add_input_queue(pipeline.queues.text_prompt_queue)
-    llm_handler.add_output_queue(pipeline.queues.lm_response_queue)
-    llm_handler.setup(
-        model_name=args.llm_model_name,
-        base_url=args.llm_base_url,
-        api_key=args.llm_api_key,
-        stream=True,
-    )
-    handlers.append(llm_handler)
-
-    # 5. tts
-    # tts_handler = TTSHandler(stop_event=pipeline.states.stop_event)
-    tts_handler = TTSSiliconflowHandler(stop_event=pipeline.states.stop_event)
-    tts_handler.add_input_queue(pipeline.queues.lm_response_queue)
-    tts_handler.add_output_queue(pipeline.queues.send_audio_chunks_queue)
-    tts_handler.setup(
-        api_key=args.tts_api_key,
-        should_listen=pipeline.states.should_listen,
-    )
-    handlers.append(tts_handler)
-
-    return handlers
+from server.server_common import add_common_args, build_shared, connection_closed, setup_and_start_pipeline
+from server.transport import TransportSession
+from utils.audio_buffer import RecvBufferPool
+from utils.audio_codec import HELLO_MAGIC, encode_hello, read_hello
+from utils.pipeline_manager import TurnCancel
+from utils.session_recorder import SessionRecorder
+from utils.tracing import TurnTracer
 
 
 class SocketServerHandler:
@@ -112,25 +37,108 @@ class SocketServerHandler:
         while True:
             try:
                 conn, addr = self.socket.accept()
+                accepted_at = time.perf_counter()
                 logging.info(f"Connected by {addr}")
-
-                # 使用新的函数来设置和启动管道
-                setup_and_start_pipeline(args=self.args, socket_handler=SocketHandler(socket = conn, args = self.args))
+                # 准入检查可能需要等待，不阻塞accept
+                threading.Thread(target=self.handle_connection, args=(conn, accepted_at), daemon=True).start()
             except Exception as e:
                 logging.error(f"Error accepting connection: {e}")
 
+    def handle_connection(self, conn, accepted_at: Optional[float] = None):
+        try:
+            hello = read_client_hello(conn)
+        except Exception as e:
+            logging.error(f"Error reading hello: {e}")
+            conn.close()
+            return
+        # 带令牌重连的客户端接回原来的管道，不占用新的准入名额
+        if hello is not None and hello.get("resume") and self.resume(conn, hello):
+            return
+        if not self.args.admission.admit():
+            self.reject(conn, hello)
+            return
+        # 使用新的函数来设置和启动管道
+        socket_handler = SocketHandler(socket=conn, args=self.args, hello=hello, accepted_at=accepted_at)
+        setup_and_start_pipeline(self.args, socket_handler)
+
+    def resume(self, conn, hello: Dict[str, Any]) -> bool:
+        """宽限期内重连：新连接接到原来的管道和传输状态上，令牌无效时返回 False"""
+        if self.args.sessions is None:
+            return False
+        start = time.perf_counter()
+        entry = self.args.sessions.resume(hello["resume"])
+        if entry is None:
+            logging.info("Session token unknown or expired, starting a new session")
+            return False
+        handler = SocketHandler(socket=conn, args=self.args, hello=hello, session=entry.transport)
+        handler.on_close = partial(connection_closed, self.args, entry.pipeline, entry.transport)
+        entry.disconnect = handler.disconnect
+        handler.run(name=f"{entry.pipeline.states.current_session_id}/{SocketHandler.__name__}")
+        self.args.sessions.record_resume((time.perf_counter() - start) * 1000)
+        return True
+
+    def reject(self, conn, hello: Optional[Dict[str, Any]]):
+        """负载过高时拒绝连接：先握手的客户端收到busy回复，旧客户端直接断开"""
+        try:
+            if hello is not None:
+                conn.sendall(encode_hello({"error": "busy", "retry_after": self.args.admission.retry_after}))
+        except Exception as e:
+            logging.error(f"Error rejecting connection: {e}")
+        finally:
+            conn.close()
+
+
+def read_client_hello(conn) -> Optional[Dict[str, Any]]:
+    """读取客户端的握手消息，没有握手直接发送原始PCM的旧客户端返回None"""
+    head = conn.recv(len(HELLO_MAGIC), socket.MSG_PEEK | socket.MSG_WAITALL)
+    if head != HELLO_MAGIC:
+        return None
+    return read_hello(conn)
+
+
 class SocketHandler:
-    def __init__(self, socket=None, args: argparse.Namespace=None):
+    def __init__(self, socket=None, args: argparse.Namespace=None, hello: Optional[Dict[str, Any]] = None,
+                 session: Optional[TransportSession] = None, accepted_at: Optional[float] = None):
+        """
+        Args:
+            hello: 客户端的握手消息，旧客户端为 None
+            session: 重连时接回的传输状态，为空时创建新的
+            accepted_at: 接受连接的时间（perf_counter），用于统计到开始监听的耗时
+        """
         self.socket = socket
         self.args = args
-        self.should_listen = None
-        self.queue_in = None
-        self.queue_out = None
-
-    def setup(self, should_listen: Event, queue_in: Queue, queue_out: Queue):
+        self.hello = hello
+        self.accepted_at = accepted_at
+        self.resumed = session is not None
+        self.session = session or TransportSession(args.downlink_frame_ms, args.downlink_lead_ms, args.dtx_fill_ms)
+        self.should_listen = self.session.should_listen
+        self.queue_in = self.session.queue_in
+        self.queue_out = self.session.queue_out
+        self.on_close = None
+        self.disconnected = Event()
+        self.sender = None
+        self.recv_pool = RecvBufferPool(read_size=args.recv_size, count=args.recv_buffers)
+
+    def setup(self, should_listen: Event, queue_in: Queue, queue_out: Queue, event_queue: Queue = None,
+              tracer: TurnTracer = None, recorder: SessionRecorder = None, turn_cancel: TurnCancel = None):
         self.should_listen = should_listen
         self.queue_in = queue_in
         self.queue_out = queue_out
+        self.session.setup(should_listen, queue_in, queue_out, event_queue, tracer, recorder, turn_cancel)
+
+    def negotiate(self):
+        """客户端先发送握手消息时切换到分帧协议，否则按原始PCM处理（兼容旧客户端）"""
+        if self.hello is None:
+            return
+        reply = self.session.resume() if self.resumed else self.session.accept_hello(self.hello)
+        self.socket.sendall(encode_hello(reply))
+
+    def disconnect(self):
+        """断开连接（同一会话的客户端已经重连）"""
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
     def handle_receiving(self):
         """处理接收数据并放入queue_in"""
@@ -138,42 +146,58 @@ class SocketHandler:
         try:
             while True:
                 try:
-                    data = self.socket.recv(1024)
-                    if not data:
+                    data = self.recv_pool.recv(self.socket)
+                    if data is None:
                         logging.info("No data received, closing connection.")
                         break
-                    self.queue_in.put(data)
+                    self.session.on_stream_data(data)
                 except socket.timeout:
                     pass
                 except Exception as e:
                     logging.error(f"Error receiving data: {e}")
                     break
         finally:
+            logging.info(f"Transport stats: {self.session.stats()}, {self.recv_pool.stats()}")
+            self.disconnected.set()
             self.socket.close()
+            # 等发送线程把没有发出的消息交回会话，之后才能被重连的连接接走
+            if self.sender is not None:
+                self.sender.join(timeout=1)
+            if self.on_close:
+                self.on_close()
 
     def handle_sending(self):
         """处理从queue_out获取数据并通过conn发送"""
         logging.info("Starting handle_sending...")
+        messages = self.session.take_unsent()
         try:
-            while True:
+            while not self.disconnected.is_set():
                 try:
-                    data_to_send = self.queue_out.get(timeout=1)
-                    if data_to_send:
-                        self.socket.sendall(data_to_send)
-                        logging.debug(f"Sent {len(data_to_send)} bytes from queue_out.")
-                except Empty:
-                    pass
+                    messages += self.session.poll_outgoing()
+                    if messages:
+                        # 合并成一次写入
+                        self.socket.sendall(b"".join(messages))
+                        messages = []
                 except Exception as e:
                     logging.error(f"Error sending data: {e}")
                     break
         finally:
+            # 没有发出的消息留给重连后的连接
+            self.session.stash(messages)
             self.socket.close()
 
-    def run(self):
+    def run(self, name: Optional[str] = None):
         logging.info("Starting SocketHandler...")
-        threading.Thread(target=self.handle_sending).start()
-        threading.Thread(target=self.handle_receiving).start()
-        self.should_listen.set()
+        self.negotiate()
+        # 线程名沿用 "会话/处理器类"，采样分析时归到本会话
+        name = name or threading.current_thread().name
+        self.sender = threading.Thread(target=self.handle_sending, name=f"{name}/send")
+        self.sender.start()
+        threading.Thread(target=self.handle_receiving, name=f"{name}/receive").start()
+        if not self.resumed:
+            self.should_listen.set()
+            if self.accepted_at is not None:
+                self.args.pipeline_pool.record_ready(time.perf_counter() - self.accepted_at)
 
 def main():
     """主函数"""
@@ -193,16 +217,14 @@ def main():
     # 服务器配置
     parser.add_argument('--host', default='localhost', help='服务器地址')
     parser.add_argument('--port', type=int, default=65432, help='服务器端口')
-    # 音频配置
-    parser.add_argument('--audio-save-dir', default='audio_saves', help='音频保存目录')
-    # llm
-    parser.add_argument('--llm_model_name', default='cosyvoice-v1', help='LLM模型名称')
-    parser.add_argument('--llm_base_url', default='', help='LLM模型地址')
-    parser.add_argument('--llm_api_key', default='', help='LLM API KEY')
-    # tts
-    parser.add_argument('--tts_api_key', default='', help='TTS API KEY')
+    parser.add_argument('--recv_size', type=int, default=4096, help='单次socket读取的最大字节数')
+    parser.add_argument('--recv_buffers', type=int, default=32, help='每个连接预先分配的接收缓冲数')
+    add_common_args(parser)
     args = parser.parse_args()
 
+    # 所有会话共享的对象
+    build_shared(args)
+
     # WebSocket处理器
     SocketServerHandler(args=args).run()
 
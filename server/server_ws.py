@@ -1,113 +1,113 @@
 import argparse
+import asyncio
+import json
 import logging
+import socket
 import threading
-from queue import Queue, Empty
+import time
+from collections import deque
+from functools import partial
+from http import HTTPStatus
+from queue import Queue
 from threading import Event
-from typing import List
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
 
+import websockets
+import websockets.asyncio.server
 import websockets.sync.server
 
-from server.modules.asr_handler import AsrHandler
-from server.modules.llm_handler import LLMHandler
-from server.modules.tts_siliconflow_handler import TTSSiliconflowHandler
-from server.modules.vad_handler import VADHandler
-from utils.pipeline_manager import PipelineManager
-
-
-def setup_and_start_pipeline(args: argparse.Namespace, ws_handler):
-    pipeline = PipelineManager()
-    handlers = create_handlers(pipeline, args)
-    # 在handlers头部追加一个对socket conn的处理handler
-    ws_handler.setup(
-        should_listen=pipeline.states.should_listen,
-        queue_in=pipeline.queues.recv_audio_chunks_queue,
-        queue_out=pipeline.queues.send_audio_chunks_queue,
-    )
-    handlers.insert(0, ws_handler)
+from server.server_common import add_common_args, build_shared, close_session, connection_closed, create_recorder, \
+    end_session, setup_and_start_pipeline
+from server.transport import TransportSession
+from utils.pipeline_manager import NotifyingQueue, TurnCancel
+from utils.session_recorder import SessionRecorder
+from utils.tracing import TurnTracer
 
-    pipeline.build_pipeline(handlers)
-    pipeline.start()
+# 同一会话的客户端已经在新连接上重连，服务器关闭旧连接时使用的关闭码
+RESUMED_CLOSE_CODE = 4000
+# 旧连接的对端往往已经失联，关闭握手最多等待的时间（秒），之后直接断开 TCP 连接
+RESUMED_CLOSE_TIMEOUT = 0.2
 
 
-def create_handlers(pipeline: PipelineManager, args: argparse.Namespace) -> List:
-    """
-    创建处理器列表
+def busy_response(args: argparse.Namespace, connection):
+    """负载过高时在握手阶段返回 503，不建立 WebSocket 连接"""
+    response = connection.respond(HTTPStatus.SERVICE_UNAVAILABLE, "Server busy, please retry later\n")
+    response.headers["Retry-After"] = str(args.admission.retry_after)
+    return response
 
-    Args:
-        pipeline: 管道管理器实例
-        args: 命令行参数
 
-    Returns:
-        List: 处理器列表
+def resume_token(request) -> str:
     """
-    handlers = []
-
-    # 1. 创建VAD处理器
-    vad_handler = VADHandler(stop_event=pipeline.states.stop_event)
-    vad_handler.add_input_queue(pipeline.queues.recv_audio_chunks_queue)
-    vad_handler.add_output_queue(pipeline.queues.spoken_prompt_queue)
-    vad_handler.setup(should_listen=pipeline.states.should_listen)
-    pipeline.states.should_listen.set()
-    handlers.append(vad_handler)
-
-    # 2. 创建原始音频保存处理器
-    # raw_audio_saver = AudioSaverHandler(stop_event=pipeline.states.stop_event)
-    # raw_audio_saver.add_input_queue(pipeline.queues.spoken_prompt_queue)
-    # raw_audio_saver.setup(
-    #     save_dir=args.audio_save_dir,
-    #     sample_rate=args.sample_rate,
-    #     channels=args.channels
-    # )
-    # handlers.append(raw_audio_saver)
-
-    # 3. asr
-    asr_handler = AsrHandler(stop_event=pipeline.states.stop_event)
-    asr_handler.add_input_queue(pipeline.queues.spoken_prompt_queue)
-    asr_handler.add_output_queue(pipeline.queues.text_prompt_queue)
-    asr_handler.setup()
-    handlers.append(asr_handler)
-
-    # 4. llm
-    llm_handler = LLMHandler(stop_event=pipeline.states.stop_event)
-    llm_handler.add_input_queue(pipeline.queues.text_prompt_queue)
-    llm_handler.add_output_queue(pipeline.queues.lm_response_queue)
-    llm_handler.setup(
-        model_name=args.llm_model_name,
-        base_url=args.llm_base_url,
-        api_key=args.llm_api_key,
-        stream=True,
-    )
-    handlers.append(llm_handler)
-
-    # 5. tts
-    # tts_handler = TTSHandler(stop_event=pipeline.states.stop_event)
-    tts_handler = TTSSiliconflowHandler(stop_event=pipeline.states.stop_event)
-    tts_handler.add_input_queue(pipeline.queues.lm_response_queue)
-    tts_handler.add_output_queue(pipeline.queues.send_audio_chunks_queue)
-    tts_handler.setup(
-        api_key=args.tts_api_key,
-        should_listen=pipeline.states.should_listen,
-    )
-    handlers.append(tts_handler)
+    客户端重连时可以在 URL 中带上会话令牌（?resume=...），这样的连接在 HTTP 握手时不做预检：
+    重连的会话已经占有名额，令牌无效时在收到握手消息后和新连接一样检查
+    """
+    return parse_qs(urlsplit(request.path).query).get("resume", [""])[0]
 
-    return handlers
 
 class WebSocketHandler:
-    def __init__(self, websocket, args):
+    def __init__(self, websocket, args, hello: Optional[Dict[str, Any]] = None, first_message: Optional[bytes] = None,
+                 session: Optional[TransportSession] = None, accepted_at: Optional[float] = None):
+        """
+        Args:
+            hello: 客户端的握手消息，旧客户端为 None
+            first_message: 旧客户端的第一条音频消息
+            session: 重连时接回的传输状态，为空时创建新的
+            accepted_at: 接受连接的时间（perf_counter），用于统计到开始监听的耗时
+        """
         self.websocket = websocket
         self.args = args
-        self.should_listen = None
-        self.queue_in = None
-        self.queue_out = None
+        self.accepted_at = accepted_at
+        self.hello = hello
+        self.first_message = first_message
+        self.resumed = session is not None
+        self.session = session or TransportSession(args.downlink_frame_ms, args.downlink_lead_ms, args.dtx_fill_ms)
+        self.should_listen = self.session.should_listen
+        self.queue_in = self.session.queue_in
+        self.queue_out = self.session.queue_out
+        self.disconnected = Event()
+        self.closed = Event()
+        self.sender = None
+        self.on_close = None
 
-    def setup(self, should_listen: Event, queue_in: Queue, queue_out: Queue):
+    def setup(self, should_listen: Event, queue_in: Queue, queue_out: Queue, event_queue: Queue = None,
+              tracer: TurnTracer = None, recorder: SessionRecorder = None, turn_cancel: TurnCancel = None):
         self.should_listen = should_listen
         self.queue_in = queue_in
         self.queue_out = queue_out
+        self.session.setup(should_listen, queue_in, queue_out, event_queue, tracer, recorder, turn_cancel)
+
+    def negotiate(self):
+        """客户端的第一条文本消息为握手消息时切换到分帧协议，否则按原始PCM处理（兼容旧客户端）"""
+        if self.hello is None:
+            if self.first_message is not None:
+                self.session.on_message(self.first_message)
+            return
+        reply = self.session.resume() if self.resumed else self.session.accept_hello(self.hello)
+        self.websocket.send(json.dumps(reply))
+
+    def disconnect(self):
+        """断开连接（同一会话的客户端已经重连），对端没有回应时关闭 socket，收发线程随即退出"""
+        def close():
+            try:
+                self.websocket.close(RESUMED_CLOSE_CODE, "session resumed on another connection")
+            except Exception as e:
+                logging.debug(f"Error closing previous connection: {e}")
+
+        # 发送线程可能阻塞在写满的 socket 上，关闭握手也放到单独的线程中
+        closer = threading.Thread(target=close, daemon=True)
+        closer.start()
+        closer.join(RESUMED_CLOSE_TIMEOUT)
+        if closer.is_alive():
+            try:
+                self.websocket.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
 
     def handle_receiving(self):
         """处理接收数据并放入queue_in"""
         logging.info("Starting handle_receiving...")
+        resumable = True
         try:
             while True:
                 try:
@@ -116,36 +116,275 @@ class WebSocketHandler:
                         logging.info("No data received, closing connection.")
                         break
                     # logging.debug(f"receiving data {data}")
-                    self.queue_in.put(data)
+                    self.session.on_message(data)
+                except websockets.ConnectionClosedOK:
+                    # 客户端正常关闭，不需要保留会话
+                    resumable = False
+                    break
                 except Exception as e:
                     logging.error(f"Error receiving data: {e}")
                     print(e)
                     break
         finally:
+            logging.info(f"Transport stats: {self.session.stats()}")
+            self.disconnected.set()
             self.websocket.close()
+            # 等发送线程把没有发出的消息交回会话，之后才能被重连的连接接走
+            if self.sender is not None:
+                self.sender.join(timeout=1)
+            if self.on_close:
+                self.on_close(resumable)
+            self.closed.set()
 
     def handle_sending(self):
         """处理从queue_out获取数据并通过conn发送"""
         logging.info("Starting handle_sending...")
+        pending = deque(self.session.take_unsent())
         try:
-            while True:
+            while not self.disconnected.is_set():
                 try:
-                    data_to_send = self.queue_out.get(timeout=1)
-                    if data_to_send:
-                        self.websocket.send(data_to_send)
-                        # logging.debug(f"Sent {len(data_to_send)} bytes from queue_out.")
-                except Empty:
-                    pass
+                    pending.extend(self.session.poll_outgoing())
+                    while pending:
+                        self.websocket.send(pending[0])
+                        pending.popleft()
                 except Exception as e:
                     logging.error(f"Error sending data: {e}")
                     break
         finally:
+            # 没有发出的消息留给重连后的连接
+            self.session.stash(list(pending))
             self.websocket.close()
 
-    def run(self):
-        threading.Thread(target=self.handle_sending).start()
-        threading.Thread(target=self.handle_receiving).start()
-        self.should_listen.set()
+    def run(self, name: Optional[str] = None):
+        self.negotiate()
+        # 线程名沿用 "会话/处理器类"，采样分析时归到本会话
+        name = name or threading.current_thread().name
+        self.sender = threading.Thread(target=self.handle_sending, name=f"{name}/send")
+        self.sender.start()
+        threading.Thread(target=self.handle_receiving, name=f"{name}/receive").start()
+        if not self.resumed:
+            self.should_listen.set()
+            if self.accepted_at is not None:
+                self.args.pipeline_pool.record_ready(time.perf_counter() - self.accepted_at)
+
+
+def receive_hello(websocket) -> Tuple[Optional[Dict[str, Any]], Optional[bytes]]:
+    """读取客户端的第一条消息，返回 (握手消息, 旧客户端的第一条音频消息)"""
+    message = websocket.recv()
+    if isinstance(message, bytes):
+        return None, message
+    return json.loads(message), None
+
+
+def resume_session(args: argparse.Namespace, websocket, hello: Dict[str, Any]) -> Optional[WebSocketHandler]:
+    """sync 模式下宽限期内重连：新连接接到原来的管道和传输状态上，令牌无效时返回 None"""
+    start = time.perf_counter()
+    entry = args.sessions.resume(hello["resume"])
+    if entry is None:
+        logging.info("Session token unknown or expired, starting a new session")
+        return None
+    ws_handler = WebSocketHandler(websocket, args, hello, session=entry.transport)
+    ws_handler.on_close = partial(connection_closed, args, entry.pipeline, entry.transport)
+    entry.disconnect = ws_handler.disconnect
+    ws_handler.run(name=f"{entry.pipeline.states.current_session_id}/{WebSocketHandler.__name__}")
+    args.sessions.record_resume((time.perf_counter() - start) * 1000)
+    return ws_handler
+
+
+class AsyncWebSocketHandler:
+    """
+    asyncio 模式的连接处理器，所有连接的收发都在同一个事件循环中
+
+    管道的发送队列和控制消息队列是 NotifyingQueue，管道线程写入时唤醒本连接的
+    发送协程；空闲的连接不占用线程，只有回复进行中才按 idle_timeout 检查回复是否结束。
+    """
+
+    def __init__(self, websocket, args: argparse.Namespace, idle_timeout: float = 0.05):
+        self.websocket = websocket
+        self.args = args
+        self.idle_timeout = idle_timeout
+        self.session = TransportSession(args.downlink_frame_ms, args.downlink_lead_ms, args.dtx_fill_ms)
+        self.pipeline = None
+        self.resumed = False
+        self.loop = None
+        self.wakeup = asyncio.Event()
+
+    def bind_queues(self):
+        """管道线程写入发送队列和控制消息队列时唤醒本连接的发送协程"""
+        queues = self.pipeline.queues
+        notify = partial(self.loop.call_soon_threadsafe, self.wakeup.set)
+        queues.send_audio_chunks_queue.notify = notify
+        queues.event_queue.notify = notify
+
+    async def start_pipeline(self):
+        pool = self.args.pipeline_pool
+        self.pipeline = pool.acquire()
+        if self.pipeline is None:
+            # 池为空时现场构建，加载模型会阻塞，放到线程池中
+            self.pipeline = await self.loop.run_in_executor(None, pool.build)
+        self.pipeline.bind_metrics(self.args.metrics)
+        queues = self.pipeline.queues
+        self.bind_queues()
+        self.args.admission.track(self.pipeline, self.pipeline.handlers)
+        self.session.setup(
+            should_listen=self.pipeline.states.should_listen,
+            queue_in=queues.recv_audio_chunks_queue,
+            queue_out=queues.send_audio_chunks_queue,
+            event_queue=queues.event_queue,
+            tracer=self.pipeline.states.tracer,
+            recorder=create_recorder(self.args, self.pipeline),
+            turn_cancel=self.pipeline.states.turn_cancel,
+        )
+        if self.args.sessions is not None:
+            self.args.sessions.register(
+                self.pipeline, self.session, on_expire=partial(end_session, self.args, self.pipeline, self.session),
+                disconnect=self.disconnect)
+
+    async def resume(self, hello: Optional[Dict[str, Any]]) -> bool:
+        """宽限期内重连：接回原来的管道和传输状态，令牌无效时返回 False"""
+        if self.args.sessions is None or hello is None or not hello.get("resume"):
+            return False
+        # 旧连接还没有断开时要等它交回会话，不能阻塞事件循环
+        entry = await self.loop.run_in_executor(None, self.args.sessions.resume, hello["resume"])
+        if entry is None:
+            logging.info("Session token unknown or expired, starting a new session")
+            return False
+        self.pipeline = entry.pipeline
+        self.session = entry.transport
+        self.resumed = True
+        self.bind_queues()
+        # 断开期间管道的输出唤醒的是旧连接
+        self.wakeup.set()
+        entry.disconnect = self.disconnect
+        return True
+
+    async def receive_hello(self) -> Tuple[Optional[Dict[str, Any]], Optional[bytes]]:
+        """读取客户端的第一条消息，返回 (握手消息, 旧客户端的第一条音频消息)"""
+        message = await self.websocket.recv()
+        if isinstance(message, bytes):
+            return None, message
+        return json.loads(message), None
+
+    async def negotiate(self, hello: Optional[Dict[str, Any]], first_message: Optional[bytes]):
+        """客户端的第一条文本消息为握手消息时切换到分帧协议，否则按原始PCM处理（兼容旧客户端）"""
+        if hello is None:
+            self.session.on_message(first_message)
+            return
+        reply = self.session.resume() if self.resumed else self.session.accept_hello(hello)
+        await self.websocket.send(json.dumps(reply))
+
+    def disconnect(self):
+        """断开连接（同一会话的客户端已经重连），在其他线程中调用；对端没有回应时直接断开 TCP 连接"""
+        async def close():
+            try:
+                await asyncio.wait_for(
+                    self.websocket.close(RESUMED_CLOSE_CODE, "session resumed on another connection"),
+                    RESUMED_CLOSE_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.websocket.transport.abort()
+
+        self.loop.call_soon_threadsafe(lambda: asyncio.ensure_future(close()))
+
+    async def handle_sending(self):
+        """等待管道输出并发送，同一次唤醒取出的消息连续写入，只在超过写缓冲上限时等待"""
+        pending = deque(self.session.take_unsent())
+        try:
+            while True:
+                while pending:
+                    await self.websocket.send(pending[0])
+                    pending.popleft()
+                timeout = self.session.next_wait(self.idle_timeout)
+                idle_wait = not self.session.frame_ready()
+                idle = False
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    idle = idle_wait
+                self.wakeup.clear()
+                pending.extend(self.session.take_events() + self.session.take_audio())
+                if idle:
+                    pending.extend(self.session.on_idle())
+        finally:
+            # 没有发出的消息留给重连后的连接
+            self.session.stash(list(pending))
+
+    async def handle(self):
+        logging.info(f"新的客户端连接: {self.websocket.remote_address}")
+        accepted_at = time.perf_counter()
+        self.loop = asyncio.get_running_loop()
+        # 名额在收到握手消息后占用，重连的会话已经占有名额
+        admitted = False
+        resumable = True
+        sender = None
+        try:
+            hello, first_message = await self.receive_hello()
+            start = time.perf_counter()
+            if not await self.resume(hello):
+                if not await self.args.admission.admit_async():
+                    await reject(self.args, self.websocket, hello)
+                    return
+                admitted = True
+                await self.start_pipeline()
+            await self.negotiate(hello, first_message)
+            sender = asyncio.create_task(self.handle_sending())
+            if self.resumed:
+                self.args.sessions.record_resume((time.perf_counter() - start) * 1000)
+            else:
+                self.session.should_listen.set()
+                self.args.pipeline_pool.record_ready(time.perf_counter() - accepted_at)
+            async for message in self.websocket:
+                self.session.on_message(message)
+            # 客户端正常关闭，不需要保留会话
+            resumable = False
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            if sender is not None:
+                sender.cancel()
+                try:
+                    await sender
+                except (asyncio.CancelledError, websockets.ConnectionClosed):
+                    pass
+            logging.info(f"Transport stats: {self.session.stats()}")
+            # 只通知管道线程退出，不在事件循环中等待它们结束
+            if self.pipeline is not None:
+                connection_closed(self.args, self.pipeline, self.session, resumable)
+            elif admitted:
+                close_session(self.args, None)
+
+
+async def reject(args: argparse.Namespace, websocket, hello: Optional[Dict[str, Any]]):
+    """令牌无效又没有准入名额的重连：先握手的客户端收到busy回复"""
+    if hello is not None:
+        await websocket.send(json.dumps({"error": "busy", "retry_after": args.admission.retry_after}))
+    await websocket.close()
+
+
+async def serve_async(args: argparse.Namespace):
+    """asyncio 模式：所有连接共用一个事件循环"""
+    async def handle_client(websocket):
+        await AsyncWebSocketHandler(websocket, args).handle()
+
+    async def process_request(connection, request):
+        # 只预检不占用名额，握手失败或连接在处理前断开时不会泄漏名额
+        if resume_token(request):
+            return None
+        if not args.admission.precheck():
+            return busy_response(args, connection)
+
+    async with websockets.asyncio.server.serve(
+            handle_client,
+            args.host,
+            args.port,
+            process_request=process_request,
+            compression=None,  # 音频是二进制数据，permessage-deflate 只会浪费CPU
+            ping_interval=args.ws_ping_interval or None,
+            ping_timeout=args.ws_ping_timeout or None,
+            write_limit=args.ws_write_limit,
+            max_queue=args.ws_max_queue,
+            backlog=args.ws_backlog,
+    ) as server:
+        await server.serve_forever()
 
 
 def main():
@@ -161,24 +400,57 @@ def main():
     parser = argparse.ArgumentParser(description='WebSocket服务器')
     parser.add_argument('--host', default='localhost', help='服务器地址')
     parser.add_argument('--port', type=int, default=8765, help='服务器端口')
-    parser.add_argument('--llm_model_name', default='cosyvoice-v1', help='LLM模型名称')
-    parser.add_argument('--llm_base_url', default='', help='LLM模型地址')
-    parser.add_argument('--llm_api_key', default='', help='LLM API KEY')
-    parser.add_argument('--tts_api_key', default='', help='TTS API KEY')
+    parser.add_argument('--server_mode', default='asyncio', choices=['asyncio', 'sync'], help='asyncio: 所有连接共用一个事件循环；sync: 每个连接使用独立线程')
+    parser.add_argument('--ws_ping_interval', type=float, default=20, help='websocket心跳间隔（秒），0表示不发送心跳（仅asyncio模式）')
+    parser.add_argument('--ws_ping_timeout', type=float, default=20, help='websocket心跳超时（秒），0表示不检查（仅asyncio模式）')
+    parser.add_argument('--ws_write_limit', type=int, default=64 * 1024, help='每个连接的发送缓冲上限（字节），超过时等待发送（仅asyncio模式）')
+    parser.add_argument('--ws_max_queue', type=int, default=64, help='每个连接缓存的未处理接收消息数（仅asyncio模式）')
+    parser.add_argument('--ws_backlog', type=int, default=1024, help='监听socket的连接队列长度（仅asyncio模式）')
+    add_common_args(parser)
     args = parser.parse_args()
 
+    # 所有会话共享的对象；asyncio 模式的发送队列需要唤醒事件循环
+    build_shared(args, queue_factory=NotifyingQueue if args.server_mode == 'asyncio' else Queue)
+
     """启动WebSocket服务器"""
-    logging.info(f"启动WebSocket服务器: {args.host}:{args.port}")
-    def echo(websocket):
-        for message in websocket:
-            websocket.send(message)
+    logging.info(f"启动WebSocket服务器: {args.host}:{args.port} ({args.server_mode})")
+    if args.server_mode == 'asyncio':
+        asyncio.run(serve_async(args))
+        return
+
     def handle_client(websocket):
-        """处理单个客户端连接"""
+        """处理单个客户端连接，连接关闭前不能返回"""
         logging.info(f"新的客户端连接: {websocket.remote_address}")
-        setup_and_start_pipeline(args, WebSocketHandler(websocket, args))
-        input(f"新的客户端, 服务中: {websocket.remote_address}")
+        accepted_at = time.perf_counter()
+        try:
+            hello, first_message = receive_hello(websocket)
+        except websockets.ConnectionClosed:
+            return
+        if args.sessions is not None and hello is not None and hello.get("resume"):
+            ws_handler = resume_session(args, websocket, hello)
+            if ws_handler is not None:
+                # 重连的会话已经占有名额
+                ws_handler.closed.wait()
+                return
+        # 名额在收到握手消息后占用
+        if not args.admission.admit():
+            if hello is not None:
+                websocket.send(json.dumps({"error": "busy", "retry_after": args.admission.retry_after}))
+            websocket.close()
+            return
+        ws_handler = WebSocketHandler(websocket, args, hello, first_message, accepted_at=accepted_at)
+        setup_and_start_pipeline(args, ws_handler)
+        ws_handler.closed.wait()
+
+    def process_request(connection, request):
+        # 只预检不占用名额，握手失败或连接在处理前断开时不会泄漏名额
+        if resume_token(request):
+            return None
+        if not args.admission.precheck():
+            return busy_response(args, connection)
 
-    with websockets.sync.server.serve(handle_client, args.host, args.port) as server:
+    with websockets.sync.server.serve(
+            handle_client, args.host, args.port, compression=None, process_request=process_request) as server:
         server.serve_forever()
 
 
@@ -0,0 +1,434 @@
+import logging
+import time
+from collections import deque
+from queue import Empty, Queue
+from threading import Event
+from typing import Any, Dict, List, Optional
+
+from utils.audio_buffer import release_buffer
+from utils.audio_codec import SAMPLE_RATE, SAMPLE_WIDTH, PcmCodec, negotiate_codec
+from utils.pipeline_manager import TurnCancel
+from utils.protocol import ControlEvent, Frame, FrameReader, FrameType, FrameWriter, restamp_frame, unpack_frame
+from utils.session_recorder import SessionRecorder
+from utils.tracing import TurnTracer
+
+
+class DownlinkPacer:
+    """
+    下行音频节拍器
+
+    把 TTS 输出的音频块合并成 frame_ms 的帧，按实时速度发送，最多领先播放进度
+    lead_ms。这样客户端缓冲保持很小，取消或打断时丢弃的是还没有发送的音频。
+    """
+
+    def __init__(self, frame_ms: int = 40, lead_ms: int = 200):
+        self.frame_bytes = SAMPLE_RATE * frame_ms // 1000 * SAMPLE_WIDTH
+        self.lead = lead_ms / 1000
+        self.pending = bytearray()
+        self.start = None  # 本段回复第一帧的发送时间
+        self.sent = 0.0  # 本段回复已发送的音频时长（秒）
+
+        self.frames = 0
+        self.underruns = 0
+        self.dropped_bytes = 0
+
+    def push(self, pcm: bytes) -> None:
+        self.pending += pcm
+
+    def ready(self) -> bool:
+        """是否有完整的一帧"""
+        return len(self.pending) >= self.frame_bytes
+
+    def delay(self) -> float:
+        """距离下一帧可以发送还有多久（秒）"""
+        if self.start is None:
+            return 0.0
+        return max(0.0, self.start + self.sent - self.lead - time.monotonic())
+
+    def pop(self, partial: bool = False) -> Optional[bytes]:
+        """取出一帧，partial=True 时不足一帧也取出"""
+        size = min(len(self.pending), self.frame_bytes)
+        if size == 0 or (size < self.frame_bytes and not partial):
+            return None
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+        elif self.start + self.sent < now:
+            # 客户端已经播完，从现在重新计算播放进度
+            self.underruns += 1
+            self.start = now - self.sent
+        frame = bytes(self.pending[:size])
+        del self.pending[:size]
+        self.sent += size / (SAMPLE_RATE * SAMPLE_WIDTH)
+        self.frames += 1
+        return frame
+
+    def reset(self) -> None:
+        """一段回复结束"""
+        self.start = None
+        self.sent = 0.0
+
+    def clear(self) -> None:
+        """丢弃尚未发送的音频"""
+        self.dropped_bytes += len(self.pending)
+        self.pending.clear()
+        self.reset()
+
+
+class TransportSession:
+    """
+    一个客户端连接的协议状态，由 SocketHandler 和 WebSocketHandler 共用
+
+    - 没有握手的旧客户端：上下行都是原始 PCM，没有控制消息
+    - 握手后的客户端：上下行都使用 utils.protocol 的分帧协议，音频帧携带序号和
+      采集时间戳，另有控制消息（回合开始/结束、识别结果、播放确认、取消）
+
+    客户端在开始播放回复时回传 playback_started（客户端时钟），与触发本轮回复的
+    上行音频帧的采集时间戳（同样是客户端时钟）相减，就是不需要对时的端到端延迟。
+    VAD 的句子结束通知带有它当时处理到的上行音频块序号，这里按序号找到那一块的采集时间戳，
+    而不是发送通知时最近收到的一块（VAD 排队或发送线程等待时后者会偏晚）。
+
+    客户端取消回复时除了丢弃尚未发送的音频，还通过 TurnCancel 通知 LLM 和 TTS 停止生成。
+    取消在接收线程中处理，节拍器和编码器（Opus 有状态）只在发送线程中使用，由发送线程在
+    下一次取数据时清空。
+
+    downlink_frame_ms > 0 时下行音频经过 DownlinkPacer 合并和限速。
+
+    客户端开启静音抑制（DTX）时，进入静音会发送 silence 控制消息（时间戳为第一块没有发送的
+    音频的采集时间），之后不再发送音频，说话结束的尾部静音由客户端的 hangover 提供。VAD 按
+    采样数计时，恢复发送时按第一帧（pre-roll）的采集时间戳算出实际中断的时长，补入等长的
+    静音（最多 dtx_fill_ms），VAD 看到的时间线与连续收到静音时一致；空闲期间 VAD 不消耗 CPU。
+
+    设置了 recorder 时记录解码后的上行音频、编码前的下行音频和双向的控制消息，
+    用 benchmarks.replay_session 可以按原来的时间重放。
+
+    开启会话恢复时（utils.session_registry），连接断开后本对象随管道保留：发送失败的消息
+    存入 unsent，客户端带令牌重连后由新连接的发送线程先补发，帧序号接着原来的继续。
+    """
+
+    def __init__(self, downlink_frame_ms: int = 0, downlink_lead_ms: int = 200, dtx_fill_ms: int = 1500):
+        self.codec = PcmCodec()
+        self.pacer = DownlinkPacer(downlink_frame_ms, downlink_lead_ms) if downlink_frame_ms > 0 else None
+        self.framed = False
+        self.reader = FrameReader()
+        self.writer = FrameWriter()
+
+        self.should_listen = None
+        self.queue_in = None
+        self.queue_out = None
+        self.event_queue = None
+        self.tracer = TurnTracer()
+        self.recorder: Optional[SessionRecorder] = None
+        self.turn_cancel: Optional[TurnCancel] = None
+
+        self.last_capture_us = None  # 最近一帧上行音频的采集时间戳
+        self.uplink_frames = 0  # 交给管道的上行音频块数
+        self.uplink_captures = deque(maxlen=1000)  # 最近各块的采集时间戳，按序号查找
+        self.turn_capture_us = None  # 触发本轮回复时的上行音频采集时间戳
+        self.replying = False
+        self.mouth_to_ear = deque(maxlen=1000)  # 端到端延迟（秒）
+        self.cancelled = 0
+        # 客户端取消时由接收线程设置，发送线程清空节拍器和编码器（两者只在发送线程中使用）
+        self.cancel_pending = Event()
+
+        self.dtx_fill_ms = dtx_fill_ms
+        self.dtx_silence_us = None  # 客户端进入静音时的采集时间戳，恢复发送后清空
+        self.dtx_gaps = 0
+        self.dtx_filled_ms = 0.0
+
+        self.token = None  # 会话恢复令牌
+        self.unsent: List[bytes] = []  # 连接断开时没有发出的消息
+        self.resumed = 0
+
+    def setup(self, should_listen: Event, queue_in: Queue, queue_out: Queue, event_queue: Optional[Queue] = None,
+              tracer: Optional[TurnTracer] = None, recorder: Optional[SessionRecorder] = None,
+              turn_cancel: Optional[TurnCancel] = None):
+        self.should_listen = should_listen
+        self.queue_in = queue_in
+        self.queue_out = queue_out
+        self.event_queue = event_queue
+        if tracer is not None:
+            self.tracer = tracer
+        self.recorder = recorder
+        self.turn_cancel = turn_cancel
+
+    def accept_hello(self, hello: Dict[str, Any]) -> Dict[str, Any]:
+        """处理客户端握手，返回回复给客户端的握手消息"""
+        self.codec = negotiate_codec(hello)
+        self.framed = True
+        reply = {**self.codec.hello(), "protocol": "framed"}
+        if self.token:
+            reply["session_token"] = self.token
+        logging.info(f"Negotiated transport: {reply}")
+        return reply
+
+    def resume(self) -> Dict[str, Any]:
+        """客户端带令牌重连：沿用已经协商的编解码和帧序号，返回握手回复"""
+        self.reader = FrameReader()  # 旧连接中不完整的帧不要了
+        if self.pacer is not None:
+            self.pacer.reset()
+        self.resumed += 1
+        return {**self.codec.hello(), "protocol": "framed", "session_token": self.token, "resumed": True}
+
+    def stash(self, messages: List[bytes]) -> None:
+        """连接断开时没有发出的消息，重连后补发"""
+        self.unsent += messages
+
+    def take_unsent(self) -> List[bytes]:
+        """取出需要补发的消息，时间戳改为现在"""
+        messages, self.unsent = self.unsent, []
+        if self.framed:
+            messages = [restamp_frame(message) for message in messages]
+        return messages
+
+    # 上行
+
+    def on_stream_data(self, data: bytes) -> None:
+        """
+        处理从 TCP 字节流收到的数据
+
+        data 可能是 RecvBufferPool 的缓冲：原始 PCM 直接交给管道，由 VAD 归还；
+        分帧协议下数据已被复制到帧里，这里立即归还。
+        """
+        if not self.framed:
+            self.put_audio(self.codec.decode(data))
+            return
+        frames = self.reader.feed(data)
+        release_buffer(data)
+        for frame in frames:
+            self.on_frame(frame)
+
+    def on_message(self, data: bytes) -> None:
+        """处理从 websocket 收到的一条二进制消息"""
+        if not self.framed:
+            self.put_audio(self.codec.decode(data))
+            return
+        self.on_frame(unpack_frame(data))
+
+    def on_frame(self, frame: Frame) -> None:
+        if frame.type == FrameType.AUDIO:
+            if self.dtx_silence_us is not None:
+                self.fill_dtx_gap(frame.timestamp_us)
+            self.last_capture_us = frame.timestamp_us
+            self.put_audio(self.codec.decode(frame.payload), frame.timestamp_us)
+        elif frame.type == FrameType.CONTROL:
+            self.on_control(frame.control(), frame.timestamp_us)
+
+    def put_audio(self, pcm: bytes, capture_us: Optional[int] = None) -> None:
+        # 先记录再交给管道：原始 PCM 可能是接收缓冲，VAD 处理完就会归还
+        if self.recorder is not None:
+            self.recorder.uplink_audio(pcm, capture_us)
+        self._put_uplink(pcm, capture_us)
+
+    def _put_uplink(self, pcm: bytes, capture_us: Optional[int]) -> None:
+        """交给管道，VAD 每处理一块计数一次，两边的序号一一对应"""
+        self.uplink_frames += 1
+        self.uplink_captures.append(capture_us)
+        self.queue_in.put(pcm)
+
+    def capture_of(self, frame: Optional[int]) -> Optional[int]:
+        """第 frame 块上行音频的采集时间戳，找不到时取最近一块的"""
+        offset = self.uplink_frames - frame if frame is not None else -1
+        if 0 <= offset < len(self.uplink_captures):
+            capture_us = self.uplink_captures[-1 - offset]
+            if capture_us is not None:
+                return capture_us
+        return self.last_capture_us
+
+    def on_control(self, message: Dict[str, Any], timestamp_us: int) -> None:
+        if self.recorder is not None:
+            self.recorder.uplink_control(message, timestamp_us)
+        event = message.get("event")
+        if event == ControlEvent.PLAYBACK_STARTED:
+            if self.turn_capture_us is not None:
+                latency = (timestamp_us - self.turn_capture_us) / 1e6
+                self.turn_capture_us = None
+                self.mouth_to_ear.append(latency)
+                self.tracer.set("mouth_to_ear_ms", latency * 1000)
+                logging.info(f"Mouth-to-ear latency: {latency:.3f} s")
+            self.tracer.first("playback_started")
+        elif event == ControlEvent.CANCEL:
+            self.cancel()
+        elif event == ControlEvent.SILENCE:
+            self.dtx_gaps += 1
+            self.dtx_silence_us = timestamp_us
+        else:
+            logging.debug(f"Control message from client: {message}")
+
+    def fill_dtx_gap(self, resume_us: int) -> None:
+        """客户端恢复发送：补入静音期间没有发送的音频时长"""
+        gap_ms = min(max(0.0, (resume_us - self.dtx_silence_us) / 1000), self.dtx_fill_ms)
+        silence_us, self.dtx_silence_us = self.dtx_silence_us, None
+        size = int(SAMPLE_RATE * gap_ms / 1000) * SAMPLE_WIDTH
+        if size > 0:
+            self.dtx_filled_ms += gap_ms
+            self._put_uplink(bytes(size), silence_us)
+
+    def cancel(self) -> None:
+        """客户端取消当前回复：通知 LLM 和 TTS 停止生成，丢弃尚未发送的音频并重新开始监听"""
+        self.cancelled += 1
+        if self.turn_cancel is not None:
+            self.turn_cancel.cancel()
+        self.tracer.finish("cancelled")
+        self.cancel_pending.set()
+        while True:
+            try:
+                self.queue_out.get_nowait()
+            except Empty:
+                break
+        self.should_listen.set()
+
+    def apply_cancel(self) -> bool:
+        """在发送线程中完成取消：丢弃节拍器中尚未发送的音频和编码器中剩余的数据，返回是否有取消"""
+        if not self.cancel_pending.is_set():
+            return False
+        self.cancel_pending.clear()
+        if self.pacer is not None:
+            self.pacer.clear()
+        self.codec.flush()
+        return True
+
+    # 下行
+
+    def poll_outgoing(self, timeout: float = 0.05) -> List[bytes]:
+        """获取待发送的消息（TCP 时直接写入字节流，websocket 时每条一个消息）"""
+        self.apply_cancel()
+        messages = self.take_events()
+        wait = self.next_wait(timeout)
+        idle_wait = not self.frame_ready()
+        try:
+            data = self.queue_out.get(timeout=timeout if wait is None else wait)
+            messages += self.encode_outgoing(data)
+        except Empty:
+            if idle_wait:
+                return messages + self.on_idle()
+        return messages + self.take_audio()
+
+    def next_wait(self, idle_timeout: float) -> Optional[float]:
+        """
+        下一次需要检查的时间：有完整的帧时为它可以发送的时间，回复进行中为
+        idle_timeout（用于发现回复结束），否则为 None（只需等待新的数据）
+        """
+        if self.frame_ready():
+            return self.pacer.delay()
+        if self.replying:
+            return idle_timeout
+        return None
+
+    def frame_ready(self) -> bool:
+        return self.pacer is not None and self.pacer.ready()
+
+    def take_events(self) -> List[bytes]:
+        """取出管道发来的控制消息"""
+        messages = []
+        if self.event_queue is not None:
+            while True:
+                try:
+                    messages += self._control(self.event_queue.get_nowait())
+                except Empty:
+                    break
+        return messages
+
+    def take_audio(self) -> List[bytes]:
+        """不阻塞地取出发送队列中已有的全部音频，返回现在可以发送的消息"""
+        self.apply_cancel()
+        messages = []
+        while True:
+            try:
+                data = self.queue_out.get_nowait()
+            except Empty:
+                break
+            messages += self.encode_outgoing(data)
+        return messages + self.paced_audio()
+
+    def encode_outgoing(self, data: bytes) -> List[bytes]:
+        messages = []
+        if self.apply_cancel():
+            # 取消前已经从发送队列取出的音频
+            return messages
+        if data:
+            if not self.replying:
+                self.replying = True
+                messages += self._control({"event": ControlEvent.TURN_START})
+            if self.pacer is not None:
+                self.pacer.push(data)
+            else:
+                messages += self._pcm(data)
+        return messages
+
+    def paced_audio(self) -> List[bytes]:
+        """发送已经到时间的完整帧"""
+        messages = []
+        while self.frame_ready() and self.pacer.delay() <= 0:
+            messages += self._pcm(self.pacer.pop())
+        return messages
+
+    def on_idle(self) -> List[bytes]:
+        """
+        发送队列空闲一段时间：发送节拍器中不足一帧的数据。回复已经结束时再补零编码
+        编码器中剩余的数据；回复中途（TTS 两句之间）补零会在音频中间插入静音
+        """
+        self.apply_cancel()
+        messages = []
+        if self.pacer is not None:
+            frame = self.pacer.pop(partial=True)
+            if frame:
+                messages += self._pcm(frame)
+        if self.replying and self.should_listen.is_set():
+            messages += self._audio(self.codec.flush())
+            self.replying = False
+            if self.pacer is not None:
+                self.pacer.reset()
+            messages += self._control({"event": ControlEvent.TURN_END})
+            self.tracer.finish()
+        return messages
+
+    def _pcm(self, pcm: bytes) -> List[bytes]:
+        if self.recorder is not None:
+            self.recorder.downlink_audio(pcm)
+        return self._audio(self.codec.encode(pcm))
+
+    def _audio(self, packets: List[bytes]) -> List[bytes]:
+        if packets:
+            self.tracer.first("first_byte_sent")
+        if not self.framed:
+            return packets
+        return [self.writer.audio(packet) for packet in packets]
+
+    def _control(self, message: Dict[str, Any]) -> List[bytes]:
+        if message.get("event") == ControlEvent.USER_TURN_END:
+            message = dict(message)
+            self.turn_capture_us = self.capture_of(message.pop("uplink_frame", None))
+        if self.recorder is not None:
+            self.recorder.downlink_control(message)
+        if not self.framed:
+            return []
+        return [self.writer.control(**message)]
+
+    def close(self) -> None:
+        """连接关闭"""
+        if self.recorder is not None:
+            self.recorder.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取传输统计信息"""
+        latencies = self.mouth_to_ear
+        return {
+            **self.codec.stats(),
+            "framed": self.framed,
+            "cancelled": self.cancelled,
+            "dtx_gaps": self.dtx_gaps,
+            "dtx_filled_ms": self.dtx_filled_ms,
+            "resumed": self.resumed,
+            "mouth_to_ear_seconds": sum(latencies) / len(latencies) if latencies else 0.0,
+            **self.pacer_stats(),
+        }
+
+    def pacer_stats(self) -> Dict[str, Any]:
+        if self.pacer is None:
+            return {}
+        return {
+            "downlink_frames": self.pacer.frames,
+            "downlink_underruns": self.pacer.underruns,
+            "downlink_dropped_bytes": self.pacer.dropped_bytes,
+        }
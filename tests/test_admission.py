@@ -0,0 +1,70 @@
+import asyncio
+import threading
+import time
+from queue import Queue
+from types import SimpleNamespace
+
+from utils.admission import AdmissionController
+
+
+class FakePipeline:
+    def __init__(self, depth: int):
+        queue, empty = Queue(), Queue()
+        for _ in range(depth):
+            queue.put(b"")
+        self.queues = SimpleNamespace(spoken_prompt_queue=queue, text_prompt_queue=empty, lm_response_queue=empty)
+
+
+def test_max_sessions_and_release():
+    admission = AdmissionController(max_sessions=2)
+    assert admission.admit() and admission.admit()
+    assert not admission.admit()
+    admission.release()
+    assert admission.admit()
+    assert admission.stats()["accepted"] == 3 and admission.stats()["rejected"] == 1
+
+
+def test_precheck_does_not_take_a_slot():
+    admission = AdmissionController(max_sessions=1)
+    assert admission.precheck() and admission.precheck()
+    assert admission.stats()["sessions"] == 0
+    assert admission.admit()
+    assert not admission.precheck()
+    assert admission.stats()["rejected"] == 1
+
+
+def test_precheck_defers_to_admit_when_waiting_is_allowed():
+    admission = AdmissionController(max_sessions=1, wait_timeout=1)
+    assert admission.admit()
+    assert admission.precheck()
+
+
+def test_admit_waits_for_release():
+    admission = AdmissionController(max_sessions=1, wait_timeout=2)
+    assert admission.admit()
+    threading.Timer(0.2, admission.release).start()
+    start = time.monotonic()
+    assert admission.admit()
+    assert 0.1 < time.monotonic() - start < 1.5
+
+
+def test_admit_async_times_out():
+    admission = AdmissionController(max_sessions=1, wait_timeout=0.3)
+    assert admission.try_admit()
+    assert not asyncio.run(admission.admit_async())
+    assert admission.stats()["queued"] == 1
+
+
+def test_queue_depth_and_latency_pressure():
+    admission = AdmissionController(max_queue_depth=4, latency_slo={"AsrHandler": 1.0}, degrade_load=0.5)
+    admission.track(FakePipeline(3), [])
+    assert admission.try_admit()
+    assert admission.degraded()
+    admission.track(FakePipeline(1), [])
+    assert not admission.try_admit()
+
+    admission = AdmissionController(latency_slo={"AsrHandler": 1.0})
+    for _ in range(10):
+        admission.record_latency("AsrHandler", 1.5)
+    assert admission.load_score() == 1.5
+    assert not admission.try_admit()
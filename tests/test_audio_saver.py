@@ -0,0 +1,84 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+audio_saver = pytest.importorskip("server.modules.audio_saver_handler")
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+class FakeSoundfile:
+    """记录写入路径的 soundfile 替身，fail=True 时写入一部分后出错"""
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.paths = []
+
+    def write(self, path, audio, sample_rate, format=None, subtype=None):
+        self.paths.append(path)
+        with open(path, "wb") as f:
+            f.write(b"OggS" + bytes(audio))
+        if self.fail:
+            raise RuntimeError("disk full")
+
+
+def _writer(monkeypatch, tmp_path, soundfile=None, **kwargs):
+    monkeypatch.setattr(audio_saver, "soundfile", soundfile or FakeSoundfile())
+    kwargs.setdefault("fsync_interval", 0)
+    return audio_saver.AudioSaveWriter(save_dir=str(tmp_path), **kwargs)
+
+
+def test_file_names_are_unique(monkeypatch, tmp_path):
+    writer = _writer(monkeypatch, tmp_path, workers=0)
+    paths = [writer.new_file("abc") for _ in range(1000)]
+    assert len(set(paths)) == 1000
+    assert all(path.suffix == ".ogg" and "_abc_" in path.name for path in paths)
+    assert "_abc_" not in writer.new_file().name
+
+
+def test_drops_when_queue_is_full(monkeypatch, tmp_path):
+    writer = _writer(monkeypatch, tmp_path, workers=0, max_pending=2)
+    assert writer.submit(b"\x01")
+    assert writer.submit(b"\x02")
+    assert not writer.submit(b"\x03")
+    stats = writer.stats()
+    assert (stats["dropped"], stats["pending"], stats["saved"]) == (1, 2, 0)
+
+
+def test_writes_to_tmp_then_renames(monkeypatch, tmp_path):
+    soundfile = FakeSoundfile()
+    writer = _writer(monkeypatch, tmp_path, soundfile, fsync_interval=3600)
+    assert writer.submit(b"\x01\x02", "abc")
+    assert _wait_for(lambda: writer.saved == 1)
+    assert soundfile.paths[0].name.endswith(".ogg.tmp")
+    files = list(tmp_path.iterdir())
+    assert [path.name for path in files] == [soundfile.paths[0].name[:-len(".tmp")]]
+    assert writer.stats()["bytes"] == files[0].stat().st_size
+    # 写入的文件等待下一次批量 fsync
+    assert writer._unsynced == files
+    writer.sync()
+    assert writer._unsynced == []
+
+
+def test_failed_write_leaves_no_tmp_file(monkeypatch, tmp_path):
+    writer = _writer(monkeypatch, tmp_path, FakeSoundfile(fail=True))
+    writer.submit(b"\x01\x02")
+    assert _wait_for(lambda: writer.failed == 1)
+    assert list(tmp_path.iterdir()) == []
+    assert writer.saved == 0
+
+
+def test_handler_passes_audio_through(monkeypatch, tmp_path):
+    writer = _writer(monkeypatch, tmp_path, workers=0)
+    handler = audio_saver.AudioSaverHandler(SimpleNamespace(is_set=lambda: False))
+    handler.setup(writer=writer, session_id="abc")
+    assert list(handler.process(b"\x01\x02")) == [b"\x01\x02"]
+    assert writer.stats()["pending"] == 1
@@ -0,0 +1,32 @@
+import numpy as np
+
+from client.dtx import SilenceSuppressor
+from client.session import ClientSession
+from utils.protocol import ControlEvent, FrameType, unpack_frame
+
+BLOCK = 320  # 20 ms
+
+
+def _block(level: int) -> bytes:
+    return (np.ones(BLOCK, dtype=np.int16) * level).tobytes()
+
+
+def test_dtx_preroll_keeps_capture_timestamps(monkeypatch):
+    session = ClientSession(dtx=SilenceSuppressor(hangover_ms=40, preroll_ms=40))
+    session.accept_hello({"codec": "pcm", "protocol": "framed"})
+    clock = iter(range(1_000_000, 10_000_000, 20_000))
+    monkeypatch.setattr("client.session.now_us", lambda: next(clock))
+
+    frames = []
+    for level in [3000] * 3 + [0] * 10 + [3000]:
+        frames += [unpack_frame(message) for message in session.encode_audio(_block(level))]
+
+    silence = [frame for frame in frames if frame.type == FrameType.CONTROL]
+    assert [frame.control()["event"] for frame in silence] == [ControlEvent.SILENCE]
+    # 第 6 块（3 块说话 + 2 块 hangover 之后）开始不发送
+    assert silence[0].timestamp_us == 1_100_000
+
+    audio = [frame.timestamp_us for frame in frames if frame.type == FrameType.AUDIO]
+    # 恢复时先补发最近 40 ms 的 pre-roll，时间戳是原来的采集时间
+    assert audio[-3:] == [1_220_000, 1_240_000, 1_260_000]
+    assert audio == sorted(audio)
@@ -0,0 +1,89 @@
+import threading
+import time
+from queue import Queue
+
+import numpy as np
+
+from server.modules.filler_handler import BYTES_PER_MS, FillerBank, FillerHandler
+from utils.pipeline_manager import ResponseGate
+
+CLIP = (np.ones(BYTES_PER_MS * 400 // 2, dtype=np.int16) * 1000).tobytes()
+UTTERANCE = np.zeros(16000, dtype=np.float32)
+
+
+def _handler(gate: ResponseGate, send_queue: Queue) -> FillerHandler:
+    handler = FillerHandler(stop_event=threading.Event())
+    handler.setup(bank=FillerBank([CLIP]), response_gate=gate, send_queue=send_queue,
+                  delay_ms=0, min_utterance_ms=0, lead_ms=0)
+    return handler
+
+
+def test_gate_opened_before_filler_stays_open():
+    gate, send_queue = ResponseGate(), Queue()
+    gate.reset()  # VAD 检测到语音结束
+    gate.open()   # 回复（如缓存命中）先于填充处理器开始
+    handler = _handler(gate, send_queue)
+    handler.async_process(UTTERANCE)
+    assert gate.opened.is_set()
+    assert send_queue.empty()
+    assert handler.skipped == 1
+
+
+def test_reply_interrupts_filler_with_fade_tail():
+    gate, send_queue = ResponseGate(), Queue()
+    gate.reset()
+    handler = _handler(gate, send_queue)
+    worker = threading.Thread(target=handler.async_process, args=(UTTERANCE,))
+    worker.start()
+    time.sleep(0.1)
+    gate.open()
+    send_queue.put(b"reply")
+    worker.join(2)
+
+    frames = []
+    while not send_queue.empty():
+        frames.append(send_queue.get())
+    assert frames[-1] == b"reply"
+    assert 0 < len(frames) - 1 < len(CLIP) // handler.frame_bytes
+    assert handler.interrupted == 1
+
+
+def test_set_on_open_refused_after_open():
+    gate = ResponseGate()
+    gate.open()
+    assert not gate.set_on_open(lambda: None)
+    gate.reset()
+    assert gate.set_on_open(lambda: None)
+
+
+def test_turn_without_reply_does_not_block():
+    gate, send_queue = ResponseGate(), Queue()
+    gate.reset()
+    handler = _handler(gate, send_queue)
+    short = FillerBank([CLIP[:handler.frame_bytes * 2]])
+    handler.bank = short
+    start = time.perf_counter()
+    handler.async_process(UTTERANCE)  # 回复一直没有开始（识别结果为空、LLM 出错等）
+    assert time.perf_counter() - start < 0.5
+    assert len(handler.response_latency) == 0
+
+    # 回复开始时由门的回调记录首音延迟
+    gate.open()
+    assert len(handler.response_latency) == 1
+    assert handler.perceived_latency[0] <= handler.response_latency[0]
+
+
+def test_new_turn_stops_previous_filler():
+    gate, send_queue = ResponseGate(), Queue()
+    gate.reset()
+    handler = _handler(gate, send_queue)
+    worker = threading.Thread(target=handler.async_process, args=(UTTERANCE,))
+    worker.start()
+    time.sleep(0.1)
+    gate.reset()  # VAD 检测到下一句话结束
+    worker.join(2)
+    assert not worker.is_alive()
+    assert handler.interrupted == 1
+    # 上一轮的回调已经作废，新一轮的回复不会记到上一轮
+    gate.open()
+    assert len(handler.response_latency) == 0
@@ -0,0 +1,49 @@
+import pytest
+
+from server.modules.inference_scheduler import InferenceScheduler
+
+
+def _scheduler():
+    scheduler = InferenceScheduler(workers=1)
+    scheduler.register("vad", lambda: "vad-model", priority=0)
+    scheduler.register("asr", lambda: "asr-model", priority=1)
+    return scheduler
+
+
+def test_runs_by_priority_then_deadline():
+    scheduler = _scheduler()
+    order = []
+
+    def job(name):
+        def fn(model):
+            order.append(name)
+            return model
+        return fn
+
+    # 工作线程启动前提交，全部排队后再按顺序执行
+    jobs = [
+        scheduler.submit("asr", job("asr-late"), cost_ms=100, deadline_ms=2000),
+        scheduler.submit("asr", job("asr-long"), cost_ms=5000, deadline_ms=500),
+        scheduler.submit("asr", job("asr-early"), cost_ms=100, deadline_ms=100),
+        scheduler.submit("vad", job("vad"), cost_ms=200, deadline_ms=1000),
+    ]
+    scheduler.start()
+    results = [job.result(timeout=5) for job in jobs]
+
+    # 长语音的截止时间按音频时长放宽，排在短语音后面
+    assert order == ["vad", "asr-early", "asr-long", "asr-late"]
+    assert results == ["asr-model", "asr-model", "asr-model", "vad-model"]
+    assert scheduler.stats()["asr"]["completed"] == 3
+
+
+def test_job_error_is_raised_to_caller():
+    scheduler = _scheduler()
+    scheduler.start()
+
+    def fail(model):
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError, match="boom"):
+        scheduler.run("asr", fail)
+    assert scheduler.run("vad", lambda model: model) == "vad-model"
+    assert scheduler.stats()["asr"]["errors"] == 1
@@ -0,0 +1,86 @@
+from client.jitter_buffer import BYTES_PER_MS, JitterBuffer
+
+
+def _pcm(ms: int) -> bytes:
+    return b"\x01\x00" * (ms * BYTES_PER_MS // 2)
+
+
+def test_target_follows_late_arrivals():
+    jitter = JitterBuffer(block_ms=10, min_ms=20, max_ms=300)
+    # 按时到达：目标为最小深度
+    for i in range(10):
+        jitter.push(_pcm(20), arrival=1.0 + i * 0.02)
+    assert jitter.target_ms == 20
+    # 一块晚到 100 ms，目标覆盖它的迟到时间再加一个播放块
+    jitter.push(_pcm(20), arrival=1.0 + 10 * 0.02 + 0.1)
+    assert jitter.target_ms == 110
+    assert jitter.jitter_ms > 0
+    # 目标不超过 max_ms
+    jitter.push(_pcm(20), arrival=1.0 + 11 * 0.02 + 0.5)
+    assert jitter.target_ms == 300
+
+
+def test_waits_for_target_before_playing():
+    jitter = JitterBuffer(block_ms=10, min_ms=20)
+    started = []
+    jitter.on_start = lambda: started.append(True)
+    jitter.push(_pcm(10), arrival=1.0)
+    assert jitter.read() == bytes(jitter.block_bytes)
+    assert not jitter.playing and not started
+    jitter.push(_pcm(10), arrival=1.01)
+    assert jitter.read() == _pcm(10)
+    assert started == [True]
+
+
+def test_underrun_versus_drain():
+    jitter = JitterBuffer(block_ms=10, min_ms=20)
+    drained = []
+    jitter.on_drain = lambda: drained.append(True)
+    jitter.push(_pcm(20), arrival=1.0)
+    jitter.read()
+    jitter.read()
+    # 没有收到结束标记就播空，算欠载
+    assert jitter.underruns == 1 and not drained
+
+    jitter.push(_pcm(20), arrival=1.1)
+    jitter.mark_end()
+    assert jitter.read() == _pcm(10)
+    # 最后一块不足时补静音
+    assert jitter.read(jitter.block_bytes * 2) == _pcm(10) + bytes(jitter.block_bytes)
+    assert jitter.underruns == 1 and drained == [True]
+    # 缓冲已空时结束标记立即回调
+    jitter.mark_end()
+    assert drained == [True, True]
+
+
+def test_end_mark_plays_remainder_below_target():
+    jitter = JitterBuffer(block_ms=10, min_ms=40)
+    jitter.push(_pcm(10), arrival=1.0)
+    assert jitter.read() == bytes(jitter.block_bytes)
+    jitter.mark_end()
+    assert jitter.read() == _pcm(10)
+    assert jitter.underruns == 0
+
+
+def test_drops_audio_when_far_above_target():
+    jitter = JitterBuffer(block_ms=10, min_ms=20, drift_ms=60)
+    jitter.push(_pcm(200), arrival=1.0)
+    played = 0
+    while jitter.depth_ms > jitter.target_ms + jitter.drift_ms:
+        played += len(jitter.read()) / BYTES_PER_MS
+    # 每次最多丢弃块长的十分之一
+    assert 0 < jitter.dropped_ms <= played / 10
+    assert played + jitter.dropped_ms + jitter.depth_ms == 200
+    dropped = jitter.dropped_ms
+    jitter.read()
+    assert jitter.dropped_ms == dropped
+
+
+def test_clear_discards_buffer():
+    jitter = JitterBuffer(block_ms=10, min_ms=20)
+    jitter.push(_pcm(100), arrival=1.0)
+    jitter.read()
+    jitter.clear()
+    assert jitter.depth_ms == 0 and not jitter.playing
+    assert jitter.read() == bytes(jitter.block_bytes)
+    assert jitter.underruns == 0
@@ -0,0 +1,87 @@
+import json
+import time
+
+from server.modules.llm_cache import LLMResponseCache
+from utils.lru_cache import LRUCache
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_items=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    cache.put("c", 3)
+    assert "b" not in cache
+    assert cache.get("a") == 1 and cache.get("c") == 3
+    assert cache.evictions == 1
+
+
+def test_lru_per_entry_ttl():
+    cache = LRUCache(ttl=60)
+    cache.put("a", 1, ttl=-1)
+    cache.put("b", 2)
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+
+
+def test_key_ignores_punctuation_and_history_by_default():
+    cache = LLMResponseCache()
+    history = [{"role": "user", "content": "你好"}]
+    assert cache.make_key("你好！") == cache.make_key("你好", history=history)
+    assert cache.make_key("，。") is None
+    assert LLMResponseCache(history_turns=1).make_key("你好", history=history) != cache.make_key("你好")
+
+
+def test_disk_tier_survives_restart(tmp_path):
+    cache = LLMResponseCache(disk_dir=str(tmp_path))
+    key = cache.make_key("今天天气怎么样")
+    cache.put(key, "晴天", latency=1.2)
+
+    restarted = LLMResponseCache(disk_dir=str(tmp_path))
+    entry = restarted.get(key)
+    assert entry.text == "晴天"
+    assert restarted.disk_hits == 1
+    assert restarted.get(key).text == "晴天"
+    assert restarted.disk_hits == 1
+
+
+def test_promotion_keeps_original_expiry(tmp_path):
+    cache = LLMResponseCache(ttl=60, disk_dir=str(tmp_path))
+    key = cache.make_key("讲个笑话")
+    cache.put(key, "好的", latency=1.0)
+    path = tmp_path / f"{key}.json"
+    # 写入时间改到 59.9 秒前，提升到内存层后应在 0.1 秒内过期
+    data = json.loads(path.read_text(encoding="utf-8"))
+    data["created"] = time.time() - 59.9
+    path.write_text(json.dumps(data), encoding="utf-8")
+
+    restarted = LLMResponseCache(ttl=60, disk_dir=str(tmp_path))
+    assert restarted.get(key) is not None
+    time.sleep(0.15)
+    assert restarted.memory.get(key) is None
+    assert restarted.get(key) is None
+    assert not path.exists()
+
+
+def test_disk_tier_is_bounded(tmp_path):
+    cache = LLMResponseCache(disk_dir=str(tmp_path), disk_max_items=3)
+    keys = [cache.make_key(f"问题{i}") for i in range(5)]
+    for i, key in enumerate(keys):
+        cache.put(key, f"回答{i}", latency=0.5)
+    assert sorted(path.stem for path in tmp_path.glob("*.json")) == sorted(keys[2:])
+    assert cache.stats()["disk_evictions"] == 2
+
+    restarted = LLMResponseCache(disk_dir=str(tmp_path), disk_max_items=2)
+    assert len(list(tmp_path.glob("*.json"))) == 2
+    assert restarted.stats()["disk_items"] == 2
+
+
+def test_failed_disk_write_leaves_no_tmp_file(tmp_path, monkeypatch):
+    cache = LLMResponseCache(disk_dir=str(tmp_path))
+
+    def fail(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr("server.modules.llm_cache.os.replace", fail)
+    cache.put(cache.make_key("你好"), "您好", 1.0)
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,105 @@
+from queue import Queue
+from types import SimpleNamespace
+
+import pytest
+
+from utils import metrics
+from utils.metrics import MetricsRegistry, RollingHistogram
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(metrics, "monotonic", clock)
+    return clock
+
+
+def test_quantile_interpolates_within_bucket(clock):
+    histogram = RollingHistogram(buckets=(0.1, 0.2, 0.5))
+    assert histogram.quantile(0.5) == 0.0
+    for value in (0.05, 0.05, 0.05, 0.05, 0.15, 0.15, 0.15, 0.15):
+        histogram.observe(value)
+    # 第 4 个值落在第一个桶的上沿
+    assert histogram.quantile(0.5) == pytest.approx(0.1)
+    assert histogram.quantile(0.25) == pytest.approx(0.05)
+    assert histogram.quantile(0.75) == pytest.approx(0.15)
+    assert histogram.total == 8 and histogram.sum == pytest.approx(0.8)
+
+
+def test_quantile_above_last_bucket_is_capped(clock):
+    histogram = RollingHistogram(buckets=(0.1, 0.2))
+    histogram.observe(5.0)
+    assert histogram.counts == [0, 0, 1]
+    assert histogram.quantile(0.99) == 0.2
+
+
+def test_window_forgets_old_slots(clock):
+    histogram = RollingHistogram(buckets=(0.1, 1.0), slots=3, slot_seconds=10)
+    histogram.observe(0.5)
+    clock.now += 10
+    histogram.observe(0.05)
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 2
+    assert snapshot["rate"] == pytest.approx(2 / 10)
+    # 第一个值所在的段移出窗口，累计计数不变
+    clock.now += 20
+    histogram.observe(0.05)
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 2
+    assert snapshot["p99"] <= 0.1
+    assert histogram.total == 3
+
+
+class AsrHandler:
+    metrics = None
+
+
+def _pipeline(session_id):
+    queue = Queue()
+    queue.put(b"chunk")
+    return SimpleNamespace(
+        states=SimpleNamespace(current_session_id=session_id),
+        handlers=[AsrHandler()],
+        queues_dict={"recv_audio_chunks_queue": queue},
+    )
+
+
+def test_render_prometheus_text(clock):
+    registry = MetricsRegistry()
+    pipeline = _pipeline("s1")
+    registry.register_pipeline(pipeline)
+    pipeline.handlers[0].metrics.observe(0.003)
+    pipeline.handlers[0].metrics.observe(0.03)
+    registry.add_collector("cache", lambda: {"hits": 3, "enabled": True, "name": "x", "disk": {"bytes": 10}})
+    registry.add_collector("broken", lambda: 1 / 0)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE voicechat_handler_latency_seconds histogram" in lines
+    assert 'voicechat_handler_latency_seconds_bucket{handler="AsrHandler",le="0.0025"} 0' in lines
+    assert 'voicechat_handler_latency_seconds_bucket{handler="AsrHandler",le="0.005"} 1' in lines
+    assert 'voicechat_handler_latency_seconds_bucket{handler="AsrHandler",le="+Inf"} 2' in lines
+    assert 'voicechat_handler_latency_seconds_count{handler="AsrHandler"} 2' in lines
+    assert any(line.startswith('voicechat_handler_latency_rolling_seconds{handler="AsrHandler",session="s1",quantile="0.5"}')
+               for line in lines)
+    assert 'voicechat_queue_depth{session="s1",queue="recv_audio_chunks_queue"} 1' in lines
+    assert "voicechat_sessions 1" in lines
+    # collector 只导出数值项，嵌套字典展开，出错的 collector 跳过
+    assert "voicechat_cache_hits 3.0" in lines
+    assert "voicechat_cache_enabled 1.0" in lines
+    assert "voicechat_cache_disk_bytes 10.0" in lines
+    assert not any("cache_name" in line or "broken" in line for line in lines)
+
+    registry.unregister_pipeline(pipeline)
+    text = registry.render()
+    assert 'session="s1"' not in text
+    assert "voicechat_sessions 0" in text
+    # 处理器类的汇总在会话结束后保留
+    assert 'voicechat_handler_latency_seconds_count{handler="AsrHandler"} 2' in text
@@ -0,0 +1,75 @@
+import threading
+import time
+from queue import Queue
+
+from server.modules.base_handler import BaseHandler, OrderedReplicas
+
+
+class SlowHandler(BaseHandler):
+    """输入是处理耗时（秒），每个输入输出两块"""
+
+    def process(self, data):
+        time.sleep(data)
+        yield ("a", data)
+        yield ("b", data)
+
+
+def _run_replicas(inputs, replicas=3):
+    stop_event = threading.Event()
+    input_queue, output_queue = Queue(), Queue()
+    ordered = OrderedReplicas(input_queue, [output_queue])
+    handlers = []
+    for _ in range(replicas):
+        handler = SlowHandler(stop_event)
+        ordered.attach(handler)
+        handlers.append(handler)
+    threads = [threading.Thread(target=handler.run, daemon=True) for handler in handlers]
+    for thread in threads:
+        thread.start()
+    start = time.perf_counter()
+    for item in inputs:
+        input_queue.put(item)
+    outputs = [output_queue.get(timeout=5) for _ in range(len(inputs) * 2)]
+    elapsed = time.perf_counter() - start
+    stop_event.set()
+    for thread in threads:
+        thread.join(timeout=1)
+    return outputs, output_queue, elapsed
+
+
+def test_outputs_follow_input_order():
+    # 前面的输入处理得慢，后面的先完成
+    inputs = [0.2, 0.01, 0.1, 0.0, 0.05, 0.0]
+    outputs, output_queue, _ = _run_replicas(inputs)
+    assert outputs == [(part, data) for data in inputs for part in ("a", "b")]
+    # 副本停止时不向下游写 END，由下游自己的停止信号结束
+    assert output_queue.empty()
+
+
+def test_replicas_run_in_parallel():
+    _, _, elapsed = _run_replicas([0.2, 0.2, 0.2])
+    assert elapsed < 0.5
+
+
+def test_failed_input_does_not_block_later_outputs():
+    class FailingHandler(SlowHandler):
+        def process(self, data):
+            if data is None:
+                raise RuntimeError("boom")
+            yield from super().process(data)
+
+    stop_event = threading.Event()
+    input_queue, output_queue = Queue(), Queue()
+    ordered = OrderedReplicas(input_queue, [output_queue])
+    handlers = [FailingHandler(stop_event) for _ in range(2)]
+    for handler in handlers:
+        ordered.attach(handler)
+    threads = [threading.Thread(target=handler.run, daemon=True) for handler in handlers]
+    for thread in threads:
+        thread.start()
+    for item in (None, 0.0):
+        input_queue.put(item)
+    try:
+        assert [output_queue.get(timeout=5) for _ in range(2)] == [("a", 0.0), ("b", 0.0)]
+    finally:
+        stop_event.set()
@@ -0,0 +1,30 @@
+import copy
+
+import pytest
+
+pipeline_graph = pytest.importorskip("server.pipeline_graph")
+
+
+def _config(**stage_fields):
+    config = copy.deepcopy(pipeline_graph.DEFAULT_PIPELINE)
+    asr = next(stage for stage in config["stages"] if stage["type"] == "asr")
+    asr.update(stage_fields)
+    return config
+
+
+def test_default_pipeline_is_valid():
+    stages = pipeline_graph.parse_pipeline_config(pipeline_graph.DEFAULT_PIPELINE)
+    assert [stage.type for stage in stages][0] == "vad"
+
+
+@pytest.mark.parametrize("replicas", [0, -1])
+def test_rejects_non_positive_replicas(replicas):
+    with pytest.raises(ValueError, match="replicas must be >= 1"):
+        pipeline_graph.parse_pipeline_config(_config(replicas=replicas))
+
+
+def test_rejects_replicas_above_stage_limit():
+    config = copy.deepcopy(pipeline_graph.DEFAULT_PIPELINE)
+    config["stages"][0]["replicas"] = 2
+    with pytest.raises(ValueError, match="at most 1 replicas"):
+        pipeline_graph.parse_pipeline_config(config)
@@ -0,0 +1,83 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from utils.pipeline_pool import PipelinePool
+
+
+class Builder:
+    def __init__(self):
+        self.built = []
+
+    def __call__(self):
+        pipeline = SimpleNamespace(states=SimpleNamespace(stop_event=threading.Event()))
+        self.built.append(pipeline)
+        return pipeline
+
+
+def _wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+def test_target_follows_arrival_rate():
+    pool = PipelinePool(Builder(), min_idle=1, max_idle=4, burst=2.0, window_s=10)
+    assert pool.target() == 1
+    pool.build_seconds = 2.0
+    for _ in range(5):
+        pool.acquire()
+    # 0.5 个/秒 × 2 秒 × 2 倍
+    assert pool.target() == 2
+    for _ in range(45):
+        pool.acquire()
+    assert pool.target() == 4
+
+
+def test_disabled_pool_does_not_build():
+    builder = Builder()
+    pool = PipelinePool(builder, min_idle=1, max_idle=0)
+    pool.start()
+    assert pool.target() == 0
+    assert pool.acquire() is None
+    assert builder.built == []
+    assert pool.stats()["misses"] == 1
+
+
+def test_refills_after_acquire():
+    builder = Builder()
+    pool = PipelinePool(builder, min_idle=2, max_idle=4, check_interval=0.01)
+    pool.start()
+    assert _wait_for(lambda: pool.stats()["idle"] == 2)
+    pipeline = pool.acquire()
+    assert pipeline is builder.built[0]
+    assert _wait_for(lambda: pool.stats()["idle"] == 2)
+    stats = pool.stats()
+    assert (stats["hits"], stats["builds"]) == (1, 3)
+
+
+def test_evicts_expired_pipelines():
+    builder = Builder()
+    pool = PipelinePool(builder, min_idle=1, max_idle=1, max_age_s=0.05, check_interval=0.01)
+    pool.start()
+    assert _wait_for(lambda: pool.evicted >= 1)
+    first = builder.built[0]
+    assert first.states.stop_event.is_set()
+    assert _wait_for(lambda: pool.stats()["idle"] == 1)
+
+
+def test_evicts_idle_pipelines_above_target():
+    builder = Builder()
+    # 构建很快，用很大的 burst 让一次到达就把目标推到 max_idle
+    pool = PipelinePool(builder, min_idle=1, max_idle=3, burst=1e9, window_s=0.2, check_interval=0.01)
+    pool.acquire()
+    pool.build()
+    pool.start()
+    assert _wait_for(lambda: pool.stats()["idle"] == 3)
+    # 到达速率随时间窗口过去降为 0，目标回到 min_idle
+    assert _wait_for(lambda: pool.stats()["idle"] == 1)
+    assert pool.evicted == 2
+    assert sum(pipeline.states.stop_event.is_set() for pipeline in builder.built) == 2
@@ -0,0 +1,69 @@
+import socket
+
+from utils.audio_buffer import RecvBufferPool, release_buffer
+
+
+def _pair():
+    left, right = socket.socketpair()
+    right.settimeout(1)
+    return left, right
+
+
+def test_odd_bytes_are_carried_to_next_read():
+    sender, receiver = _pair()
+    pool = RecvBufferPool(read_size=16, count=2)
+    sender.sendall(b"\x01\x02\x03")
+    first = pool.recv(receiver)
+    assert bytes(first) == b"\x01\x02"
+    sender.sendall(b"\x04\x05\x06")
+    second = pool.recv(receiver)
+    assert bytes(second) == b"\x03\x04\x05\x06"
+    # 数据始终按采样对齐
+    assert len(first) % 2 == 0 and len(second) % 2 == 0
+    sender.close()
+    receiver.close()
+
+
+def test_single_byte_reads_until_aligned():
+    sender, receiver = _pair()
+    pool = RecvBufferPool(read_size=16, count=2)
+    sender.sendall(b"\x01")
+    sender.sendall(b"\x02")
+    data = pool.recv(receiver)
+    assert bytes(data) == b"\x01\x02"
+    sender.close()
+    receiver.close()
+
+
+def test_closed_connection_returns_none_and_releases_buffer():
+    sender, receiver = _pair()
+    pool = RecvBufferPool(read_size=16, count=1)
+    sender.close()
+    assert pool.recv(receiver) is None
+    assert pool.stats()["recv_allocations"] == 1
+    assert pool.acquire() is not None and pool.allocations == 1
+    receiver.close()
+
+
+def test_buffers_are_reused_after_release():
+    sender, receiver = _pair()
+    pool = RecvBufferPool(read_size=16, count=1)
+    sender.sendall(b"\x01\x02")
+    first = pool.recv(receiver)
+    # 消费者没有归还时临时分配新的缓冲
+    sender.sendall(b"\x03\x04")
+    second = pool.recv(receiver)
+    assert bytes(first) == b"\x01\x02" and bytes(second) == b"\x03\x04"
+    assert pool.allocations == 2
+    release_buffer(first)
+    release_buffer(second)
+    sender.sendall(b"\x05\x06")
+    assert bytes(pool.recv(receiver)) == b"\x05\x06"
+    stats = pool.stats()
+    assert stats["recv_allocations"] == 2
+    assert stats["recv_bytes"] == 6
+    # 超过 count 的缓冲归还时丢弃
+    assert len(pool._free) <= pool.count
+    release_buffer(b"not pooled")
+    sender.close()
+    receiver.close()
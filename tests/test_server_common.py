@@ -0,0 +1,80 @@
+import argparse
+from types import SimpleNamespace
+
+import pytest
+
+server_common = pytest.importorskip("server.server_common")
+
+
+class Connection:
+    """只记录 setup 参数的连接处理器"""
+
+    def __init__(self):
+        self.session = SimpleNamespace(framed=True, token=None, closed=False)
+        self.session.close = lambda: setattr(self.session, "closed", True)
+        self.on_close = None
+        self.kwargs = None
+
+    def setup(self, **kwargs):
+        self.kwargs = kwargs
+
+    def disconnect(self):
+        pass
+
+    def run(self):
+        pass
+
+
+def _shared(monkeypatch, *argv):
+    monkeypatch.setattr(server_common, "create_handlers", lambda pipeline, args: [])
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='localhost')
+    server_common.add_common_args(parser)
+    args = parser.parse_args(list(argv))
+    server_common.build_shared(args)
+    return args
+
+
+def test_build_shared_defaults(monkeypatch):
+    args = _shared(monkeypatch)
+    assert args.tts_model and args.tts_voice
+    assert (args.tracing, args.llm_cache, args.tts_cache, args.filler_bank, args.inference_scheduler) == (None,) * 5
+    assert args.sessions is not None
+    # 没有共享推理线程时不预先构建管道
+    assert args.pipeline_pool.target() == 0
+    text = args.metrics.render()
+    for name in ("admission", "sessions", "profiler", "pipeline_pool"):
+        assert f"voicechat_{name}_" in text
+
+
+def test_connection_closed_detaches_until_session_ends(monkeypatch):
+    args = _shared(monkeypatch, "--max_sessions", "1")
+    assert args.admission.admit()
+    connection = Connection()
+    server_common.setup_and_start_pipeline(args, connection)
+    assert args.pipeline_pool.stats()["misses"] == 1
+    assert connection.kwargs["recorder"] is None
+    assert connection.session.token is not None
+
+    # 开启会话恢复时断开连接只挂起会话
+    connection.on_close()
+    assert args.sessions.stats()["detached"] == 1
+    assert args.admission.stats()["sessions"] == 1
+    assert not connection.session.closed
+
+    entry = args.sessions.resume(connection.session.token)
+    server_common.end_session(args, entry.pipeline, connection.session)
+    assert connection.session.closed
+    assert entry.pipeline.states.stop_event.is_set()
+    assert args.admission.stats()["sessions"] == 0
+    assert args.sessions.stats()["sessions"] == 0
+
+
+def test_connection_closed_without_resume_ends_session(monkeypatch):
+    args = _shared(monkeypatch, "--resume_grace_s", "0")
+    assert args.admission.admit()
+    connection = Connection()
+    server_common.setup_and_start_pipeline(args, connection)
+    connection.on_close()
+    assert connection.session.closed
+    assert args.admission.stats()["sessions"] == 0
@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import base64
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+server_ws = pytest.importorskip("server.server_ws")
+websockets = pytest.importorskip("websockets")
+
+ARGS = argparse.Namespace(downlink_frame_ms=0, downlink_lead_ms=200, dtx_fill_ms=0)
+
+
+def _silent_peer(port: int) -> socket.socket:
+    """完成 websocket 握手后不再读写的客户端，模拟已经失联的对端"""
+    peer = socket.create_connection(("127.0.0.1", port))
+    key = base64.b64encode(os.urandom(16)).decode()
+    peer.sendall((f"GET / HTTP/1.1\r\nHost: 127.0.0.1\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Key: {key}\r\nSec-WebSocket-Version: 13\r\n\r\n").encode())
+    peer.recv(4096)
+    return peer
+
+
+def test_async_disconnect_does_not_wait_for_unresponsive_peer():
+    async def main():
+        loop = asyncio.get_running_loop()
+        handlers = []
+        closed = asyncio.Event()
+
+        async def handler(websocket):
+            ws_handler = server_ws.AsyncWebSocketHandler(websocket, ARGS)
+            ws_handler.loop = loop
+            handlers.append(ws_handler)
+            try:
+                async for _ in websocket:
+                    pass
+            except websockets.ConnectionClosed:
+                pass
+            closed.set()
+
+        async with websockets.asyncio.server.serve(handler, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            peer = await loop.run_in_executor(None, _silent_peer, port)
+            while not handlers:
+                await asyncio.sleep(0.01)
+            start = loop.time()
+            # 重连时在其他线程中断开旧连接
+            await loop.run_in_executor(None, handlers[0].disconnect)
+            await asyncio.wait_for(closed.wait(), 2)
+            elapsed = loop.time() - start
+            peer.close()
+        return elapsed
+
+    assert asyncio.run(main()) < 1
+
+
+def test_sync_disconnect_does_not_wait_for_unresponsive_peer():
+    handlers = []
+    closed = threading.Event()
+
+    def handler(websocket):
+        ws_handler = server_ws.WebSocketHandler(websocket, ARGS)
+        handlers.append(ws_handler)
+        try:
+            while True:
+                websocket.recv()
+        except websockets.ConnectionClosed:
+            pass
+        closed.set()
+
+    with websockets.sync.server.serve(handler, "127.0.0.1", 0) as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        peer = _silent_peer(server.socket.getsockname()[1])
+        deadline = time.monotonic() + 2
+        while not handlers and time.monotonic() < deadline:
+            time.sleep(0.01)
+        start = time.monotonic()
+        handlers[0].disconnect()
+        assert time.monotonic() - start < 1
+        assert closed.wait(1)
+        peer.close()
+        server.shutdown()
@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from utils.session_recorder import RecordKind, SessionRecorder, read_segment, read_session, session_files
+
+
+def test_round_trip(tmp_path):
+    recorder = SessionRecorder(str(tmp_path), "abc", segment_bytes=4096)
+    recorder.uplink_audio(b"\x01\x02" * 10, capture_us=123)
+    recorder.uplink_control({"event": "cancel"})
+    recorder.downlink_audio(b"\x03\x04")
+    recorder.downlink_control({"event": "turn_end", "text": "你好"})
+    recorder.close()
+
+    paths = session_files(str(tmp_path), "abc")
+    assert paths == [recorder.path(0)]
+    # 关闭时截断到实际长度
+    header, records = read_segment(paths[0])
+    records = list(records)
+    assert os.path.getsize(paths[0]) < 4096
+    assert header["session_id"] == "abc" and header["segment"] == 0
+    assert [record.kind for record in records] == [
+        RecordKind.UPLINK_AUDIO, RecordKind.UPLINK_CONTROL, RecordKind.DOWNLINK_AUDIO, RecordKind.DOWNLINK_CONTROL]
+    assert records[0].payload == b"\x01\x02" * 10 and records[0].capture_us == 123
+    assert records[1].control() == {"event": "cancel"}
+    assert records[3].control()["text"] == "你好"
+    assert all(a.offset_us <= b.offset_us for a, b in zip(records, records[1:]))
+    # 关闭后的写入忽略
+    recorder.uplink_audio(b"\x00\x00")
+    assert recorder.stats()["records"] == 4
+
+
+def test_rotates_and_keeps_last_segments(tmp_path):
+    recorder = SessionRecorder(str(tmp_path), "s", segment_bytes=1024, max_segments=2)
+    payload = b"\x05" * 200
+    for _ in range(20):
+        recorder.uplink_audio(payload)
+    recorder.close()
+
+    stats = recorder.stats()
+    assert stats["segments"] > 2 and stats["records"] == 20
+    paths = session_files(str(tmp_path), "s")
+    assert paths == [recorder.path(recorder.segment - 1), recorder.path(recorder.segment)]
+    records = list(read_session(paths))
+    # 最早的文件已删除，剩下的记录完整
+    assert 0 < len(records) < 20
+    assert all(record.payload == payload for record in records)
+    assert all(os.path.getsize(path) <= 1024 for path in paths)
+
+
+def test_drops_records_larger_than_half_a_segment(tmp_path):
+    recorder = SessionRecorder(str(tmp_path), "s", segment_bytes=1024)
+    recorder.uplink_audio(b"\x00" * 500)
+    # 当前文件放不下且超过半个文件大小的记录丢弃，不换新文件
+    recorder.uplink_audio(b"\x00" * 600)
+    recorder.uplink_audio(b"\x00" * 100)
+    recorder.close()
+    assert recorder.stats()["dropped"] == 1
+    assert recorder.segment == 0
+    _, records = read_segment(recorder.path(0))
+    assert [len(record.payload) for record in records] == [500, 100]
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "x.rec"
+    path.write_bytes(b"not a recording")
+    with pytest.raises(ValueError):
+        read_segment(str(path))
@@ -0,0 +1,78 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from utils.session_registry import SessionRegistry
+
+
+def _register(registry, **kwargs):
+    expired = threading.Event()
+    transport = SimpleNamespace(token=None)
+    entry = registry.register("pipeline", transport, on_expire=expired.set, **kwargs)
+    return entry, transport, expired
+
+
+def test_resume_within_grace_period():
+    registry = SessionRegistry(grace_s=5)
+    entry, transport, expired = _register(registry)
+    assert transport.token == entry.token
+
+    assert registry.detach(entry.token)
+    assert registry.stats()["detached"] == 1
+    resumed = registry.resume(entry.token)
+    assert resumed is entry
+    assert resumed.attached and not resumed.detached.is_set()
+    assert not expired.is_set()
+    stats = registry.stats()
+    assert (stats["sessions"], stats["detached"], stats["resumed"]) == (1, 0, 1)
+
+
+def test_expires_after_grace_period():
+    registry = SessionRegistry(grace_s=0.05)
+    entry, _, expired = _register(registry)
+    registry.detach(entry.token)
+    assert expired.wait(1)
+    assert registry.resume(entry.token) is None
+    stats = registry.stats()
+    assert (stats["sessions"], stats["expired"], stats["missed"]) == (0, 1, 1)
+
+
+def test_resume_cancels_expiry():
+    registry = SessionRegistry(grace_s=0.1)
+    entry, _, expired = _register(registry)
+    registry.detach(entry.token)
+    registry.resume(entry.token)
+    assert not expired.wait(0.3)
+
+
+def test_unknown_and_removed_tokens_are_missed():
+    registry = SessionRegistry(grace_s=5)
+    entry, _, _ = _register(registry)
+    assert registry.resume("unknown") is None
+    registry.remove(entry.token)
+    assert not registry.detach(entry.token)
+    assert registry.resume(entry.token) is None
+    assert registry.stats()["missed"] == 2
+
+
+def test_takeover_disconnects_attached_connection():
+    registry = SessionRegistry(grace_s=5, takeover_timeout=1)
+    disconnected = []
+
+    def disconnect():
+        # 旧连接的收发线程退出后交回会话
+        disconnected.append(True)
+        threading.Timer(0.05, registry.detach, (entry.token,)).start()
+
+    entry, _, _ = _register(registry, disconnect=disconnect)
+    start = time.monotonic()
+    assert registry.resume(entry.token) is entry
+    assert disconnected == [True]
+    assert time.monotonic() - start < 0.5
+
+
+def test_takeover_gives_up_when_old_connection_does_not_detach():
+    registry = SessionRegistry(grace_s=5, takeover_timeout=0.1)
+    entry, _, _ = _register(registry, disconnect=lambda: None)
+    assert registry.resume(entry.token) is None
+    assert entry.attached
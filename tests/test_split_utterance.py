@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from utils.audio_buffer import SAMPLE_RATE, split_utterance
+
+
+def _audio(seconds: float) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return rng.uniform(-1, 1, int(seconds * SAMPLE_RATE)).astype(np.float32)
+
+
+def test_short_audio_is_not_split():
+    audio = _audio(3)
+    chunks = split_utterance(audio, max_s=5)
+    assert len(chunks) == 1
+    assert chunks[0].shape[0] == audio.shape[0]
+
+
+def test_cuts_at_quietest_window():
+    audio = _audio(12)
+    quiet = int(9.5 * SAMPLE_RATE)
+    audio[quiet:quiet + SAMPLE_RATE // 50] = 0
+    chunks = split_utterance(audio, max_s=10, search_s=2)
+    assert chunks[0].shape[0] == quiet
+    assert sum(chunk.shape[0] for chunk in chunks) == audio.shape[0]
+
+
+@pytest.mark.parametrize("max_s, search_s", [(2, 2), (1, 2), (0.5, 2), (0.001, 2), (10, 0)])
+def test_always_makes_progress(max_s, search_s):
+    audio = _audio(7)
+    chunks = split_utterance(audio, max_s=max_s, search_s=search_s)
+    max_len = int(max_s * SAMPLE_RATE)
+    assert all(0 < chunk.shape[0] <= max_len for chunk in chunks)
+    np.testing.assert_array_equal(np.concatenate(chunks), audio)
+
+
+def test_rejects_non_positive_max_s():
+    with pytest.raises(ValueError):
+        split_utterance(_audio(1), max_s=0)
@@ -0,0 +1,86 @@
+import json
+import sys
+import threading
+import time
+
+from utils.tracing import TraceExporter, TurnTracer
+
+
+def test_turn_record_is_written_by_background_thread(tmp_path):
+    path = tmp_path / "turns.jsonl"
+    exporter = TraceExporter(str(path))
+    tracer = TurnTracer("s1", exporter)
+    tracer.begin(endpoint_ms=200)
+    tracer.start("asr")
+    tracer.end("asr")
+    tracer.first("llm.ttft")
+    tracer.set("llm_cache_hit", True)
+    tracer.finish()
+    assert exporter.flush()
+
+    record = json.loads(path.read_text(encoding="utf-8"))
+    assert record["session_id"] == "s1" and record["status"] == "ok"
+    assert record["attributes"] == {"llm_cache_hit": True}
+    assert {span["name"] for span in record["spans"]} == {"turn", "endpoint", "asr", "llm.ttft"}
+
+
+def test_superseded_turn_is_exported_with_its_own_spans(tmp_path):
+    path = tmp_path / "turns.jsonl"
+    exporter = TraceExporter(str(path))
+    tracer = TurnTracer("s1", exporter)
+    tracer.begin()
+    tracer.start("asr")
+    tracer.begin()
+    tracer.set("k", 1)
+    tracer.finish()
+    assert exporter.flush()
+
+    first, second = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert first["status"] == "superseded" and first["attributes"] == {}
+    assert second["attributes"] == {"k": 1}
+
+
+def test_concurrent_updates_while_turns_finish():
+    exporter = TraceExporter()  # 不写文件，只生成记录
+    tracer = TurnTracer("s1", exporter)
+    stop = threading.Event()
+    errors = []
+
+    def stage(index):
+        try:
+            i = 0
+            while not stop.is_set():
+                name = f"stage{index}.{i % 1000}"
+                tracer.start(name)
+                tracer.end(name)
+                tracer.set(name, i)
+                i += 1
+        except Exception as e:
+            errors.append(e)
+
+    # 频繁切换线程，让生成记录和修改阶段交错
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    threads = [threading.Thread(target=stage, args=(i,)) for i in range(3)]
+    try:
+        for thread in threads:
+            thread.start()
+        for _ in range(300):
+            tracer.begin()
+            time.sleep(0.0005)
+        tracer.finish()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        sys.setswitchinterval(interval)
+    assert errors == []
+    assert exporter.exported == 300
+
+
+def test_tracer_without_exporter_is_a_no_op():
+    tracer = TurnTracer()
+    assert tracer.begin() is None
+    tracer.start("asr")
+    tracer.finish()
+    assert tracer.current is None
@@ -0,0 +1,217 @@
+import threading
+from queue import Queue
+from types import SimpleNamespace
+
+from server import transport
+from server.transport import DownlinkPacer, TransportSession
+from utils.audio_codec import PcmCodec
+from utils.pipeline_manager import TurnCancel
+from utils.protocol import ControlEvent, FrameType, FrameWriter, unpack_frame
+
+
+class CountingCodec(PcmCodec):
+    """记录 flush 调用的 PCM 编解码器"""
+
+    def __init__(self):
+        super().__init__()
+        self.flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+        return [b"\x00" * 4]
+
+
+def _session(**kwargs):
+    session = TransportSession(**kwargs)
+    should_listen = threading.Event()
+    session.setup(should_listen, Queue(), Queue(), Queue())
+    session.accept_hello({"codec": "pcm"})
+    session.codec = CountingCodec()
+    return session, should_listen
+
+
+def _events(messages):
+    frames = [unpack_frame(message) for message in messages]
+    return [frame.control()["event"] for frame in frames if frame.type == FrameType.CONTROL]
+
+
+def test_codec_is_flushed_only_at_end_of_turn():
+    session, should_listen = _session(downlink_frame_ms=40)
+    session.queue_out.put(b"\x01" * 1000)
+    messages = session.poll_outgoing(timeout=0.01)
+    assert _events(messages) == [ControlEvent.TURN_START]
+
+    # 两句之间 TTS 暂时没有输出：发出不足一帧的数据，但不补零
+    session.on_idle()
+    assert session.codec.flushes == 0
+
+    should_listen.set()
+    assert _events(session.on_idle()) == [ControlEvent.TURN_END]
+    assert session.codec.flushes == 1
+
+
+def test_client_codec_stats_swap_directions():
+    codec = PcmCodec()
+    codec.encode(b"\x00" * 3200)
+    server, client = codec.stats(), codec.stats(client=True)
+    assert server["downlink_bytes_per_second"] > 0 and server["uplink_bytes_per_second"] == 0
+    assert client["uplink_bytes_per_second"] > 0 and client["downlink_bytes_per_second"] == 0
+
+
+def test_turn_capture_uses_frame_vad_stopped_at():
+    session, should_listen = _session()
+    writer = FrameWriter()
+    for i in range(5):
+        session.on_message(writer.audio(b"\x00" * 640, timestamp_us=1_000_000 + i * 20_000))
+    # VAD 在第 3 块检测到语音结束，通知发出前又收到了 2 块
+    session.event_queue.put({"event": ControlEvent.USER_TURN_END, "duration_ms": 60, "uplink_frame": 3})
+    messages = session.take_events()
+    assert session.turn_capture_us == 1_040_000
+    assert "uplink_frame" not in unpack_frame(messages[0]).control()
+
+    session.on_message(writer.control(ControlEvent.PLAYBACK_STARTED, timestamp_us=1_540_000))
+    assert list(session.mouth_to_ear) == [0.5]
+
+
+def test_cancel_stops_generation_of_current_turn():
+    session, should_listen = _session()
+    turn_cancel = TurnCancel()
+    session.turn_cancel = turn_cancel
+    turn = turn_cancel.begin()
+    session.queue_out.put(b"\x01" * 640)
+    session.on_message(FrameWriter().control(ControlEvent.CANCEL))
+    assert turn_cancel.is_cancelled(turn)
+    assert session.queue_out.empty() and should_listen.is_set()
+    assert not turn_cancel.is_cancelled(turn_cancel.begin())
+
+
+def test_cancel_clears_pacer_and_codec_on_send_thread():
+    session, should_listen = _session(downlink_frame_ms=40, downlink_lead_ms=0)
+    session.queue_out.put(b"\x01" * 6400)
+    session.poll_outgoing(timeout=0.01)
+    assert session.pacer.pending
+
+    # 接收线程只标记取消，不碰发送线程使用的节拍器和编码器
+    session.on_message(FrameWriter().control(ControlEvent.CANCEL))
+    assert session.pacer.pending and session.codec.flushes == 0
+
+    assert session.take_audio() == []
+    assert not session.pacer.pending and session.codec.flushes == 1
+    assert session.pacer.dropped_bytes > 0
+
+
+def test_audio_dequeued_before_cancel_is_dropped():
+    session, should_listen = _session()
+    session.on_message(FrameWriter().control(ControlEvent.CANCEL))
+    # 发送线程在取消前已经从队列取出的一块
+    assert session.encode_outgoing(b"\x01" * 640) == []
+    assert _events(session.encode_outgoing(b"\x01" * 640)) == [ControlEvent.TURN_START]
+
+
+def test_new_turn_supersedes_previous():
+    turn_cancel = TurnCancel()
+    first = turn_cancel.begin()
+    assert not turn_cancel.is_cancelled(first)
+    turn_cancel.begin()
+    assert turn_cancel.is_cancelled(first)
+
+
+def test_frame_writer_is_thread_safe():
+    writer = FrameWriter()
+
+    def write():
+        for _ in range(2000):
+            writer.audio(b"")
+
+    threads = [threading.Thread(target=write) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert writer.seq == 8000
+
+
+def test_dtx_fill_matches_actual_gap():
+    session, should_listen = _session(dtx_fill_ms=1500)
+    writer = FrameWriter()
+    session.on_message(writer.audio(b"\x01\x00" * 320, timestamp_us=1_000_000))
+    session.on_message(writer.control(ControlEvent.SILENCE, timestamp_us=1_020_000))
+    assert session.queue_in.qsize() == 1
+
+    # 300 ms 后恢复发送（pre-roll 带着原来的采集时间）
+    session.on_message(writer.audio(b"\x01\x00" * 320, timestamp_us=1_320_000))
+    session.queue_in.get()
+    fill = session.queue_in.get()
+    assert fill == bytes(16000 * 300 // 1000 * 2)
+    assert session.queue_in.get() == b"\x01\x00" * 320
+
+    # 很长的静音最多补 dtx_fill_ms
+    session.on_message(writer.control(ControlEvent.SILENCE, timestamp_us=2_000_000))
+    session.on_message(writer.audio(b"\x01\x00" * 320, timestamp_us=60_000_000))
+    assert len(session.queue_in.get()) == 16000 * 1500 // 1000 * 2
+    assert session.stats()["dtx_filled_ms"] == 1800
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+def _pacer(monkeypatch, **kwargs):
+    clock = Clock()
+    monkeypatch.setattr(transport, "time", SimpleNamespace(monotonic=clock.monotonic))
+    return DownlinkPacer(**kwargs), clock
+
+
+def test_pacer_bursts_lead_then_paces_in_real_time(monkeypatch):
+    pacer, clock = _pacer(monkeypatch, frame_ms=40, lead_ms=200)
+    assert pacer.frame_bytes == 1280
+    pacer.push(b"\x00" * 1280 * 10)
+    # 开始时可以连续发送 lead_ms 的音频（5 帧），之后按实时速度
+    sent = 0
+    while pacer.ready() and pacer.delay() == 0:
+        assert len(pacer.pop()) == 1280
+        sent += 1
+    assert sent == 6
+    assert abs(pacer.delay() - 0.04) < 1e-9
+    clock.now += 0.04
+    assert pacer.delay() == 0 and pacer.pop() is not None
+    assert pacer.underruns == 0
+
+
+def test_pacer_keeps_partial_frame_until_asked(monkeypatch):
+    pacer, _ = _pacer(monkeypatch, frame_ms=40, lead_ms=200)
+    pacer.push(b"\x00" * 1000)
+    assert not pacer.ready()
+    assert pacer.pop() is None
+    assert len(pacer.pop(partial=True)) == 1000
+    assert pacer.pop(partial=True) is None
+
+
+def test_pacer_restarts_clock_after_underrun(monkeypatch):
+    pacer, clock = _pacer(monkeypatch, frame_ms=40, lead_ms=0)
+    pacer.push(b"\x00" * 1280 * 2)
+    pacer.pop()
+    # 客户端已经播完第一帧后才有下一帧
+    clock.now += 1.0
+    pacer.pop()
+    assert pacer.underruns == 1
+    pacer.push(b"\x00" * 1280)
+    assert abs(pacer.delay() - 0.04) < 1e-9
+
+
+def test_pacer_clear_drops_pending_and_resets(monkeypatch):
+    pacer, clock = _pacer(monkeypatch, frame_ms=40, lead_ms=0)
+    pacer.push(b"\x00" * 1280 * 3)
+    pacer.pop()
+    assert pacer.delay() > 0
+    pacer.clear()
+    assert pacer.dropped_bytes == 1280 * 2
+    assert not pacer.ready()
+    # 新的一段回复立即开始发送
+    pacer.push(b"\x00" * 1280)
+    assert pacer.delay() == 0
+    assert pacer.pop() is not None
@@ -0,0 +1,83 @@
+import os
+
+from server.modules.tts_cache import TTSAudioCache
+
+
+def test_key_depends_on_voice_and_model():
+    assert TTSAudioCache.make_key("你好。", "longxiang", "cosyvoice-v1") == \
+        TTSAudioCache.make_key("你好", "longxiang", "cosyvoice-v1")
+    assert TTSAudioCache.make_key("你好", "longxiang", "cosyvoice-v1") != \
+        TTSAudioCache.make_key("你好", "longwan", "cosyvoice-v1")
+    assert TTSAudioCache.make_key("……", "longxiang", "cosyvoice-v1") is None
+
+
+def test_memory_tier_is_bounded_by_bytes():
+    cache = TTSAudioCache(max_bytes=10)
+    cache.put("一", "v", "m", b"\x01" * 6)
+    cache.put("二", "v", "m", b"\x02" * 6)
+    assert cache.get("一", "v", "m") is None
+    assert cache.get("二", "v", "m") == b"\x02" * 6
+    assert cache.stats()["misses"] == 1
+
+
+def test_disk_hit_is_mapped_and_chunked(tmp_path):
+    audio = bytes(range(256)) * 40
+    TTSAudioCache(disk_dir=str(tmp_path)).put("欢迎使用", "v", "m", audio)
+
+    cache = TTSAudioCache(disk_dir=str(tmp_path), chunk_size=4096)
+    cached = cache.get("欢迎使用", "v", "m")
+    assert isinstance(cached, memoryview)
+    chunks = list(cache.iter_chunks(cached))
+    assert [len(chunk) for chunk in chunks] == [4096, 4096, 2048]
+    assert b"".join(chunks) == audio
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_warm_skips_cached_phrases():
+    cache = TTSAudioCache()
+    cache.put("你好", "v", "m", b"\x00\x01")
+    calls = []
+
+    def synthesize(text):
+        calls.append(text)
+        return [b"\x00" * 4]
+
+    assert cache.warm(["你好", "稍等", "  "], "v", "m", synthesize) == 1
+    assert calls == ["稍等"]
+
+
+def test_disk_tier_is_bounded_by_bytes(tmp_path):
+    cache = TTSAudioCache(disk_dir=str(tmp_path), disk_max_bytes=250)
+    for i, text in enumerate(["一", "二", "三"]):
+        cache.put(text, "v", "m", bytes([i + 1]) * 100)
+    assert sorted(path.stat().st_size for path in tmp_path.glob("*.pcm")) == [100, 100]
+    stats = cache.stats()
+    assert (stats["disk_items"], stats["disk_bytes"], stats["disk_evictions"]) == (2, 200, 1)
+    assert not tmp_path.joinpath(f"{TTSAudioCache.make_key('一', 'v', 'm')}.pcm").exists()
+
+
+def test_disk_hit_refreshes_lru_order(tmp_path):
+    TTSAudioCache(disk_dir=str(tmp_path)).put("一", "v", "m", b"\x01" * 100)
+    TTSAudioCache(disk_dir=str(tmp_path)).put("二", "v", "m", b"\x02" * 100)
+    for mtime, text in enumerate(["一", "二"]):
+        os.utime(TTSAudioCache(disk_dir=str(tmp_path))._disk_path(TTSAudioCache.make_key(text, "v", "m")),
+                 (mtime, mtime))
+
+    # 重启后按文件修改时间登记，磁盘命中后"一"变为最近使用
+    cache = TTSAudioCache(max_bytes=0, disk_dir=str(tmp_path), disk_max_bytes=250)
+    assert cache.get("一", "v", "m") is not None
+    cache.put("三", "v", "m", b"\x03" * 100)
+    assert cache._disk_path(TTSAudioCache.make_key("一", "v", "m")).exists()
+    assert not cache._disk_path(TTSAudioCache.make_key("二", "v", "m")).exists()
+
+
+def test_failed_disk_write_leaves_no_tmp_file(tmp_path, monkeypatch):
+    cache = TTSAudioCache(disk_dir=str(tmp_path))
+
+    def fail(src, dst):
+        raise OSError("disk full")
+
+    monkeypatch.setattr("server.modules.tts_cache.os.replace", fail)
+    cache.put("一", "v", "m", b"\x01" * 100)
+    assert list(tmp_path.iterdir()) == []
+    assert cache.stats()["disk_items"] == 0
@@ -0,0 +1,84 @@
+import threading
+import time
+from queue import Empty, Queue
+
+import pytest
+
+tts_siliconflow = pytest.importorskip("server.modules.tts_siliconflow_handler")
+from server.modules.tts_handler import TTSMessage, TTSMessageType
+
+
+def _handler(monkeypatch, synthesize, latency_stats=None):
+    monkeypatch.setattr(tts_siliconflow, "siliconflow_synthesize", synthesize)
+    handler = tts_siliconflow.TTSSiliconflowHandler(threading.Event())
+    handler.setup(should_listen=threading.Event(), api_key="", parallel=True, max_concurrency=2,
+                  latency_stats=latency_stats)
+    output = Queue()
+    handler.add_output_queue(output)
+    received = []
+    done = threading.Event()
+
+    # END 等待输出队列清空，需要有下游在读取
+    def consume():
+        while not done.is_set():
+            try:
+                received.append(output.get(timeout=0.01))
+            except Empty:
+                pass
+
+    consumer = threading.Thread(target=consume, daemon=True)
+    consumer.start()
+
+    def stop():
+        done.set()
+        consumer.join()
+        return received
+
+    return handler, stop
+
+
+def test_reassembler_keeps_sentence_order_and_end_waits(monkeypatch):
+    release_first = threading.Event()
+    second_done = threading.Event()
+
+    audio = {"一。": b"1", "二。": b"2", "三": b"3"}
+
+    def synthesize(api_key, text, model, voice, url):
+        if text == "一。":
+            # 第 1 句比第 2 句更晚合成完
+            release_first.wait(2)
+        yield audio[text]
+        if text == "二。":
+            second_done.set()
+
+    stats = tts_siliconflow.TTSLatencyStats()
+    handler, stop = _handler(monkeypatch, synthesize, stats)
+    handler.async_process(TTSMessage(type=TTSMessageType.START))
+    handler.async_process(TTSMessage("一。二。"))
+    handler.async_process(TTSMessage("三"))
+    assert second_done.wait(1)
+    threading.Timer(0.1, release_first.set).start()
+    start = time.monotonic()
+    handler.async_process(TTSMessage(type=TTSMessageType.END))
+    # END 在所有句子输出后才返回
+    assert release_first.is_set() and time.monotonic() - start >= 0.05
+    assert handler.should_listen.is_set()
+    assert not handler.reassembler.is_alive()
+    assert stop() == [b"1", b"2", b"3"]
+    assert stats.stats()["parallel"]["total"]["count"] == 1
+    assert stats.stats()["serial"]["total"]["count"] == 0
+    handler.cleanup()
+
+
+def test_failed_sentence_does_not_block_later_ones(monkeypatch):
+    def synthesize(api_key, text, model, voice, url):
+        if text == "一。":
+            raise RuntimeError("boom")
+        yield b"2"
+
+    handler, stop = _handler(monkeypatch, synthesize)
+    handler.async_process(TTSMessage(type=TTSMessageType.START))
+    handler.async_process(TTSMessage("一。二。"))
+    handler.async_process(TTSMessage(type=TTSMessageType.END))
+    assert stop() == [b"2"]
+    handler.cleanup()
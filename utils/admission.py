@@ -0,0 +1,185 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Dict, Optional
+
+
+class AdmissionController:
+    """
+    会话准入控制，所有会话共享
+
+    负载分数取以下各项的最大值（未配置的项不参与）：
+    - 活跃会话数 / max_sessions
+    - 所有会话推理队列（VAD→ASR、ASR→LLM、LLM→TTS）中的积压 / max_queue_depth
+    - 各阶段最近 latency_window 秒内处理耗时的 P90 / 该阶段的 SLO
+
+    新连接在会话数未满且其余各项都未超过 1 时接受，否则在 wait_timeout 内等待，
+    超时后拒绝。负载超过 degrade_load 时 degraded() 为 True，可用于关闭填充音频等可选功能。
+    """
+
+    def __init__(
+            self,
+            max_sessions: int = 0,
+            max_queue_depth: int = 0,
+            latency_slo: Optional[Dict[str, float]] = None,
+            wait_timeout: float = 0.0,
+            degrade_load: float = 0.8,
+            latency_window: float = 60.0,
+            retry_after: int = 5,
+    ):
+        """
+        Args:
+            max_sessions: 最大活跃会话数，0 表示不限制
+            max_queue_depth: 推理队列总积压上限，0 表示不限制
+            latency_slo: 各处理器（类名）的耗时 SLO（秒），如 {"AsrHandler": 1.0}
+            wait_timeout: 负载过高时新连接最多等待的时间（秒），0 表示立即拒绝
+            degrade_load: 负载分数超过该值时降级
+            latency_window: 计算耗时 P90 的时间窗口（秒）
+            retry_after: 拒绝时建议客户端重试的间隔（秒）
+        """
+        self.max_sessions = max_sessions
+        self.max_queue_depth = max_queue_depth
+        self.latency_slo = latency_slo or {}
+        self.wait_timeout = wait_timeout
+        self.degrade_load = degrade_load
+        self.latency_window = latency_window
+        self.retry_after = retry_after
+
+        self._pipelines = set()
+        self._sessions = 0
+        self._latencies = defaultdict(lambda: deque(maxlen=200))
+        self._condition = threading.Condition()
+
+        self.accepted = 0
+        self.rejected = 0
+        self.queued = 0
+
+    # 负载
+
+    def record_latency(self, stage: str, seconds: float) -> None:
+        """记录一次处理耗时，BaseHandler 在每次输出时调用"""
+        if stage in self.latency_slo:
+            self._latencies[stage].append((time.monotonic(), seconds))
+
+    def queue_depth(self) -> int:
+        depth = 0
+        for pipeline in list(self._pipelines):
+            queues = pipeline.queues
+            depth += queues.spoken_prompt_queue.qsize() + queues.text_prompt_queue.qsize() + queues.lm_response_queue.qsize()
+        return depth
+
+    def latency_p90(self, stage: str) -> float:
+        since = time.monotonic() - self.latency_window
+        recent = sorted(seconds for timestamp, seconds in list(self._latencies[stage]) if timestamp >= since)
+        return recent[int(len(recent) * 0.9)] if recent else 0.0
+
+    def _pressure(self) -> float:
+        """除会话数以外各项的最大值"""
+        pressure = 0.0
+        if self.max_queue_depth > 0:
+            pressure = max(pressure, self.queue_depth() / self.max_queue_depth)
+        for stage, slo in self.latency_slo.items():
+            pressure = max(pressure, self.latency_p90(stage) / slo)
+        return pressure
+
+    def load_score(self) -> float:
+        score = self._pressure()
+        if self.max_sessions > 0:
+            score = max(score, self._sessions / self.max_sessions)
+        return score
+
+    def degraded(self) -> bool:
+        return self.load_score() >= self.degrade_load
+
+    # 准入
+
+    def _has_capacity(self) -> bool:
+        if self.max_sessions > 0 and self._sessions >= self.max_sessions:
+            return False
+        return self._pressure() < 1.0
+
+    def try_admit(self) -> bool:
+        """不等待地尝试接受一个新会话，接受时占用一个会话名额"""
+        with self._condition:
+            if not self._has_capacity():
+                return False
+            self._sessions += 1
+            return True
+
+    def precheck(self) -> bool:
+        """
+        握手前的检查，不占用名额：不允许等待且现在已满时返回 False，调用方直接拒绝（HTTP 503）。
+        名额在连接建立后由 admit 占用，握手失败或客户端提前断开时没有名额需要归还
+        """
+        if self.wait_timeout > 0:
+            return True
+        with self._condition:
+            available = self._has_capacity()
+        if not available:
+            self._record(False)
+        return available
+
+    def admit(self, timeout: Optional[float] = None) -> bool:
+        """接受一个新会话，负载过高时最多等待 timeout 秒（默认 wait_timeout）"""
+        timeout = self.wait_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        admitted = self.try_admit()
+        if not admitted and timeout > 0:
+            self.queued += 1
+            while not admitted and time.monotonic() < deadline:
+                with self._condition:
+                    # 队列积压和耗时的变化不会通知，定期重新检查
+                    self._condition.wait(min(0.1, max(deadline - time.monotonic(), 0)))
+                admitted = self.try_admit()
+        self._record(admitted)
+        return admitted
+
+    async def admit_async(self, timeout: Optional[float] = None) -> bool:
+        """asyncio 版本的 admit，等待时不阻塞事件循环"""
+        timeout = self.wait_timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        admitted = self.try_admit()
+        if not admitted and timeout > 0:
+            self.queued += 1
+            while not admitted and time.monotonic() < deadline:
+                await asyncio.sleep(0.1)
+                admitted = self.try_admit()
+        self._record(admitted)
+        return admitted
+
+    def _record(self, admitted: bool) -> None:
+        with self._condition:
+            if admitted:
+                self.accepted += 1
+            else:
+                self.rejected += 1
+        logging.info(f"Session {'accepted' if admitted else 'rejected'}, admission stats: {self.stats()}")
+
+    def track(self, pipeline, handlers) -> None:
+        """登记已接受会话的管道（统计队列积压）和处理器（统计耗时）"""
+        for handler in handlers:
+            if hasattr(handler, "latency_hook"):
+                handler.latency_hook = self.record_latency
+        with self._condition:
+            self._pipelines.add(pipeline)
+
+    def release(self, pipeline=None) -> None:
+        """会话结束，释放会话名额"""
+        with self._condition:
+            self._pipelines.discard(pipeline)
+            self._sessions = max(self._sessions - 1, 0)
+            self._condition.notify_all()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取准入统计信息"""
+        return {
+            "sessions": self._sessions,
+            "accepted": self.accepted,
+            "rejected": self.rejected,
+            "queued": self.queued,
+            "queue_depth": self.queue_depth(),
+            "load_score": self.load_score(),
+            **{f"{stage}_p90_seconds": self.latency_p90(stage) for stage in self.latency_slo},
+        }
@@ -0,0 +1,160 @@
+from collections import deque
+from typing import List, Optional
+
+import numpy as np
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2  # int16
+_INT16_SCALE = np.float32(1 / 32768)
+
+
+class PooledBuffer(bytearray):
+    """接收缓冲池中的一块缓冲，记录所属的缓冲池以便归还"""
+    pool = None
+
+
+class RecvBufferPool:
+    """
+    socket 接收缓冲池，每个连接一个
+
+    用 recv_into 直接读入预先分配的缓冲，交给管道的是按采样对齐的 memoryview，
+    不为每次读取创建新的 bytes。消费者处理完后调用 release_buffer 归还缓冲；
+    缓冲用完（消费者跟不上）时临时分配新的缓冲，并计入 allocations。
+    """
+
+    def __init__(self, read_size: int = 4096, count: int = 32, align: int = SAMPLE_WIDTH):
+        """
+        Args:
+            read_size: 单次读取的最大字节数
+            count: 预先分配的缓冲数量
+            align: 交给管道的数据按该字节数对齐（int16 采样为 2）
+        """
+        self.read_size = read_size
+        self.count = count
+        self.align = align
+        self._free = deque()
+        self._carry = b""  # 上次读取末尾不完整的采样
+
+        self.allocations = 0
+        self.syscalls = 0
+        self.bytes_received = 0
+        for _ in range(count):
+            self._free.append(self._allocate())
+
+    def _allocate(self) -> PooledBuffer:
+        # 多留对齐余量，用来放上次剩下的不完整采样
+        buffer = PooledBuffer(self.read_size + self.align)
+        buffer.pool = self
+        self.allocations += 1
+        return buffer
+
+    def acquire(self) -> PooledBuffer:
+        try:
+            return self._free.popleft()
+        except IndexError:
+            return self._allocate()
+
+    def release(self, buffer: PooledBuffer) -> None:
+        if len(self._free) < self.count:
+            self._free.append(buffer)
+
+    def recv(self, sock) -> Optional[memoryview]:
+        """从 socket 读取一块数据，连接关闭时返回 None"""
+        buffer = self.acquire()
+        view = memoryview(buffer)
+        end = len(self._carry)
+        view[:end] = self._carry
+        while True:
+            received = sock.recv_into(view[end:end + self.read_size])
+            self.syscalls += 1
+            if not received:
+                self.release(buffer)
+                return None
+            self.bytes_received += received
+            end += received
+            aligned = end - end % self.align
+            if aligned:
+                break
+        self._carry = bytes(view[aligned:end])
+        return view[:aligned]
+
+    def stats(self) -> dict:
+        return {
+            "recv_syscalls": self.syscalls,
+            "recv_allocations": self.allocations,
+            "recv_bytes": self.bytes_received,
+        }
+
+
+def release_buffer(data) -> None:
+    """归还来自 RecvBufferPool 的数据，其他数据忽略"""
+    if isinstance(data, memoryview) and isinstance(data.obj, PooledBuffer):
+        data.obj.pool.release(data.obj)
+
+
+class Float32Accumulator:
+    """
+    把 int16 PCM 追加为 [-1, 1) 的 float32
+
+    转换结果直接写入预先分配的数组，容量不足时按倍数扩容，每帧不产生临时数组。
+    """
+
+    def __init__(self, capacity: int = 16000 * 10):
+        self._data = np.empty(capacity, dtype=np.float32)
+        self._length = 0
+        self.allocations = 1
+
+    def __len__(self) -> int:
+        return self._length
+
+    @property
+    def array(self) -> np.ndarray:
+        """当前数据（视图，后续追加不会修改已有部分）"""
+        return self._data[:self._length]
+
+    def append(self, pcm) -> None:
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        end = self._length + samples.shape[0]
+        if end > self._data.shape[0]:
+            data = np.empty(max(end, self._data.shape[0] * 2), dtype=np.float32)
+            data[:self._length] = self._data[:self._length]
+            self._data = data
+            self.allocations += 1
+        np.multiply(samples, _INT16_SCALE, out=self._data[self._length:end])
+        self._length = end
+
+    def keep_last(self, count: int) -> None:
+        """只保留最后 count 个采样（原地移动）"""
+        if count < self._length:
+            self._data[:count] = self._data[self._length - count:self._length]
+            self._length = count
+
+    def clear(self) -> None:
+        self._length = 0
+
+
+def split_utterance(audio: np.ndarray, max_s: float = 20.0, search_s: float = 2.0) -> List[np.ndarray]:
+    """
+    把长语音拆成不超过 max_s 秒的块，在每块最后 search_s 秒内能量最低的 20ms 处切开，
+    尽量不切断字词。search_s 最多取 max_s 的一半，每块至少前进一个采样
+    """
+    max_len = int(max_s * SAMPLE_RATE)
+    if max_len <= 0:
+        raise ValueError(f"max_s must be positive: {max_s}")
+    search_len = min(int(search_s * SAMPLE_RATE), max_len // 2)
+    window = SAMPLE_RATE // 50
+    chunks = []
+    start = 0
+    while audio.shape[0] - start > max_len:
+        end = start + max_len
+        search_beg = max(start + 1, end - search_len)
+        count = (end - search_beg) // window
+        if count > 0:
+            frames = audio[search_beg:search_beg + count * window].reshape(-1, window)
+            cut = search_beg + int(np.argmin(np.square(frames).sum(axis=1))) * window
+        else:
+            cut = end
+        chunks.append(audio[start:cut])
+        start = cut
+    chunks.append(audio[start:])
+    return chunks
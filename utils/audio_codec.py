@@ -0,0 +1,165 @@
+import json
+import struct
+import time
+from typing import Any, Dict, List, Optional
+
+try:
+    import opuslib
+except ImportError:  # Opus 是可选依赖，未安装时只能使用 PCM
+    opuslib = None
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+OPUS_FRAME_MS = (10, 20, 40, 60)
+
+# TCP 连接建立后客户端先发送握手消息：魔数 + 2字节长度 + JSON，之后使用 utils.protocol 的分帧协议
+HELLO_MAGIC = b"XZHI"
+_LENGTH = struct.Struct("!H")
+
+
+def opus_available() -> bool:
+    return opuslib is not None
+
+
+def encode_hello(hello: Dict[str, Any]) -> bytes:
+    """编码 TCP 握手消息"""
+    payload = json.dumps(hello).encode("utf-8")
+    return HELLO_MAGIC + _LENGTH.pack(len(payload)) + payload
+
+
+def read_hello(sock) -> Dict[str, Any]:
+    """从 TCP 连接读取握手消息"""
+    head = recv_exact(sock, len(HELLO_MAGIC) + _LENGTH.size)
+    if head[:len(HELLO_MAGIC)] != HELLO_MAGIC:
+        raise ValueError("Invalid hello message")
+    (length,) = _LENGTH.unpack_from(head, len(HELLO_MAGIC))
+    return json.loads(recv_exact(sock, length).decode("utf-8"))
+
+
+def recv_exact(sock, size: int) -> bytes:
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        data += chunk
+    return bytes(data)
+
+
+class PcmCodec:
+    """不压缩，直接传输 16kHz int16 PCM"""
+    name = "pcm"
+
+    def __init__(self):
+        self.frame_ms = 0
+        self.raw_bytes_in = 0
+        self.raw_bytes_out = 0
+        self.wire_bytes_in = 0
+        self.wire_bytes_out = 0
+        self.encode_cpu = 0.0
+        self.decode_cpu = 0.0
+        self.started = time.monotonic()
+
+    def encode(self, pcm: bytes) -> List[bytes]:
+        self.raw_bytes_out += len(pcm)
+        self.wire_bytes_out += len(pcm)
+        return [pcm]
+
+    def flush(self) -> List[bytes]:
+        return []
+
+    def pending_ms(self) -> float:
+        """编码器中还没有编码的音频时长（毫秒）"""
+        return 0.0
+
+    def decode(self, packet: bytes) -> bytes:
+        self.raw_bytes_in += len(packet)
+        self.wire_bytes_in += len(packet)
+        return packet
+
+    def hello(self) -> Dict[str, Any]:
+        return {"codec": self.name, "sample_rate": SAMPLE_RATE}
+
+    def stats(self, client: bool = False) -> Dict[str, Any]:
+        """
+        获取带宽和编解码CPU统计
+
+        Args:
+            client: 是否在客户端统计。服务器解码的是上行、编码的是下行，客户端相反
+        """
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        uplink, downlink = (self.wire_bytes_out, self.wire_bytes_in) if client else (self.wire_bytes_in, self.wire_bytes_out)
+        uplink_raw, downlink_raw = (self.raw_bytes_out, self.raw_bytes_in) if client else (self.raw_bytes_in, self.raw_bytes_out)
+        return {
+            "codec": self.name,
+            "uplink_bytes_per_second": uplink / elapsed,
+            "downlink_bytes_per_second": downlink / elapsed,
+            "uplink_raw_bytes_per_second": uplink_raw / elapsed,
+            "downlink_raw_bytes_per_second": downlink_raw / elapsed,
+            "encode_cpu_seconds": self.encode_cpu,
+            "decode_cpu_seconds": self.decode_cpu,
+        }
+
+
+class OpusCodec(PcmCodec):
+    """Opus 编解码，编码时按 frame_ms 缓冲不足一帧的数据"""
+    name = "opus"
+
+    def __init__(self, frame_ms: int = 20, bitrate: Optional[int] = None):
+        super().__init__()
+        if opuslib is None:
+            raise RuntimeError("opuslib is required for Opus transport, please install it first")
+        if frame_ms not in OPUS_FRAME_MS:
+            raise ValueError(f"Opus frame duration must be one of {OPUS_FRAME_MS} ms")
+        self.frame_ms = frame_ms
+        self.frame_samples = SAMPLE_RATE * frame_ms // 1000
+        self.frame_bytes = self.frame_samples * SAMPLE_WIDTH
+        self.encoder = opuslib.Encoder(SAMPLE_RATE, 1, opuslib.APPLICATION_VOIP)
+        if bitrate:
+            self.encoder.bitrate = bitrate
+        self.decoder = opuslib.Decoder(SAMPLE_RATE, 1)
+        self._pending = bytearray()
+
+    def encode(self, pcm: bytes) -> List[bytes]:
+        self.raw_bytes_out += len(pcm)
+        self._pending += pcm
+        packets = []
+        start = time.thread_time()
+        while len(self._pending) >= self.frame_bytes:
+            frame = bytes(self._pending[:self.frame_bytes])
+            del self._pending[:self.frame_bytes]
+            packets.append(self.encoder.encode(frame, self.frame_samples))
+        self.encode_cpu += time.thread_time() - start
+        self.wire_bytes_out += sum(len(packet) for packet in packets)
+        return packets
+
+    def flush(self) -> List[bytes]:
+        """补零编码剩余不足一帧的数据，在一段回复结束时调用"""
+        if not self._pending:
+            return []
+        padding = self.frame_bytes - len(self._pending)
+        self._pending += b"\x00" * padding
+        return self.encode(b"")
+
+    def pending_ms(self) -> float:
+        return len(self._pending) / (SAMPLE_RATE * SAMPLE_WIDTH / 1000)
+
+    def decode(self, packet: bytes) -> bytes:
+        self.wire_bytes_in += len(packet)
+        start = time.thread_time()
+        pcm = self.decoder.decode(packet, self.frame_samples)
+        self.decode_cpu += time.thread_time() - start
+        self.raw_bytes_in += len(pcm)
+        return pcm
+
+    def hello(self) -> Dict[str, Any]:
+        return {"codec": self.name, "sample_rate": SAMPLE_RATE, "frame_ms": self.frame_ms}
+
+
+def negotiate_codec(hello: Optional[Dict[str, Any]]) -> PcmCodec:
+    """根据对端握手消息选择编解码器，不支持时回退到 PCM"""
+    if hello and hello.get("codec") == "opus" and opus_available():
+        frame_ms = hello.get("frame_ms", 20)
+        if frame_ms in OPUS_FRAME_MS:
+            return OpusCodec(frame_ms)
+    return PcmCodec()
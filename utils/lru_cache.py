@@ -0,0 +1,112 @@
+import threading
+from collections import OrderedDict
+from time import monotonic
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """
+    线程安全的 LRU 缓存，支持按条目数、按字节数和 TTL 淘汰。
+    多个会话的管道会共享同一个缓存实例，所以所有操作都加锁。
+    """
+
+    def __init__(
+            self,
+            max_items: Optional[int] = None,
+            max_bytes: Optional[int] = None,
+            ttl: Optional[float] = None,
+            sizeof: Callable[[Any], int] = len,
+    ):
+        """
+        初始化缓存
+
+        Args:
+            max_items: 最大条目数，None 表示不限制
+            max_bytes: 最大字节数（由 sizeof 计算），None 表示不限制
+            ttl: 条目存活时间（秒），None 表示永不过期
+            sizeof: 计算条目大小的函数
+        """
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+
+        self._data = OrderedDict()  # key -> (value, size, expire_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Any:
+        """获取缓存值，未命中或已过期时返回 None"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            value, size, expire_at = item
+            if expire_at is not None and expire_at < monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """
+        写入缓存，超出容量时淘汰最久未使用的条目
+
+        Args:
+            ttl: 本条目的存活时间（秒），None 表示使用缓存的默认值
+        """
+        size = self.sizeof(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            # 单个条目超过总容量，不缓存
+            return
+        ttl = self.ttl if ttl is None else ttl
+        expire_at = monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, size, expire_at)
+            self._bytes += size
+            while self._over_capacity():
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _over_capacity(self) -> bool:
+        if self.max_items is not None and len(self._data) > self.max_items:
+            return True
+        if self.max_bytes is not None and self._bytes > self.max_bytes:
+            return True
+        return False
+
+    def _remove(self, key: Hashable) -> None:
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def bytes(self) -> int:
+        """当前缓存占用的字节数"""
+        return self._bytes
+
+    def stats(self) -> Dict[str, Any]:
+        """获取缓存统计信息"""
+        return {
+            "items": len(self._data),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
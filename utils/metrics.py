@@ -0,0 +1,243 @@
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# 处理耗时的桶上限（秒），最后一个桶为 +Inf
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class RollingHistogram:
+    """
+    固定内存的耗时直方图
+
+    累计的桶计数、总数和总和用于 Prometheus histogram；另外按 slot_seconds 分段保存最近
+    slots 段的桶计数，用来估计滚动窗口内的分位数（桶内线性插值）和速率。
+    内存只与桶数和段数有关，与观测次数无关。
+    """
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS, slots: int = 6, slot_seconds: float = 10.0):
+        self.buckets = buckets
+        self.slot_seconds = slot_seconds
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0
+        self.sum = 0.0
+        self._slots = [[0] * (len(buckets) + 1) for _ in range(slots)]
+        self._slot_ids = [-1] * slots
+        self._created = monotonic()
+        self._lock = threading.Lock()
+
+    def _bucket(self, value: float) -> int:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                return i
+        return len(self.buckets)
+
+    def observe(self, value: float) -> None:
+        index = self._bucket(value)
+        slot_id = int(monotonic() / self.slot_seconds)
+        position = slot_id % len(self._slots)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += 1
+            self.sum += value
+            if self._slot_ids[position] != slot_id:
+                self._slot_ids[position] = slot_id
+                self._slots[position] = [0] * len(self.counts)
+            self._slots[position][index] += 1
+
+    def window(self) -> Tuple[List[int], float]:
+        """滚动窗口内的桶计数和窗口时长（秒）"""
+        current = int(monotonic() / self.slot_seconds)
+        oldest = current - len(self._slots) + 1
+        counts = [0] * len(self.counts)
+        with self._lock:
+            for slot_id, slot in zip(self._slot_ids, self._slots):
+                if slot_id >= oldest:
+                    counts = [a + b for a, b in zip(counts, slot)]
+        seconds = min(len(self._slots) * self.slot_seconds, monotonic() - self._created)
+        return counts, max(seconds, 1e-3)
+
+    def quantile(self, q: float, counts: Optional[List[int]] = None) -> float:
+        counts = counts if counts is not None else self.window()[0]
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, count in enumerate(counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[i - 1] if i > 0 else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def snapshot(self) -> Dict[str, float]:
+        """滚动窗口内的分位数、次数和每秒次数"""
+        counts, seconds = self.window()
+        window_count = sum(counts)
+        result = {f"p{int(q * 100)}": self.quantile(q, counts) for q in QUANTILES}
+        result["count"] = window_count
+        result["rate"] = window_count / seconds
+        return result
+
+
+class HandlerMetrics:
+    """一个处理器实例的耗时统计，同时计入处理器类的汇总和本会话的直方图"""
+
+    def __init__(self, class_histogram: RollingHistogram, session_histogram: RollingHistogram):
+        self.class_histogram = class_histogram
+        self.session_histogram = session_histogram
+
+    def observe(self, seconds: float) -> None:
+        self.class_histogram.observe(seconds)
+        self.session_histogram.observe(seconds)
+
+
+class MetricsRegistry:
+    """
+    指标汇总，所有会话共享
+
+    处理器耗时按处理器类汇总（跨所有管道），同时按 (处理器类, 会话) 单独统计，会话结束后
+    删除会话的直方图；已登记管道的队列积压在导出时读取；collectors 中的函数返回共享对象
+    （准入控制、推理调度等）的 stats()，数值项导出为 gauge。
+    """
+
+    def __init__(self, prefix: str = "voicechat"):
+        self.prefix = prefix
+        self._classes: Dict[str, RollingHistogram] = {}
+        self._sessions: Dict[Tuple[str, str], RollingHistogram] = {}
+        self._pipelines: Dict[str, Any] = {}
+        self._collectors: Dict[str, Callable[[], Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def handler(self, handler_name: str, session_id: str) -> HandlerMetrics:
+        with self._lock:
+            class_histogram = self._classes.setdefault(handler_name, RollingHistogram())
+            session_histogram = self._sessions.setdefault((handler_name, session_id), RollingHistogram())
+        return HandlerMetrics(class_histogram, session_histogram)
+
+    def register_pipeline(self, pipeline) -> None:
+        """登记管道并为其中的处理器绑定耗时统计"""
+        session_id = pipeline.states.current_session_id
+        for handler in pipeline.handlers:
+            if hasattr(handler, "metrics"):
+                handler.metrics = self.handler(handler.__class__.__name__, session_id)
+        with self._lock:
+            self._pipelines[session_id] = pipeline
+
+    def unregister_pipeline(self, pipeline) -> None:
+        """会话结束，删除会话的直方图和队列"""
+        session_id = pipeline.states.current_session_id
+        with self._lock:
+            self._pipelines.pop(session_id, None)
+            for key in [key for key in self._sessions if key[1] == session_id]:
+                del self._sessions[key]
+
+    def add_collector(self, name: str, collector: Callable[[], Dict[str, Any]]) -> None:
+        self._collectors[name] = collector
+
+    def render(self) -> str:
+        """Prometheus 文本格式"""
+        with self._lock:
+            classes = list(self._classes.items())
+            sessions = list(self._sessions.items())
+            pipelines = list(self._pipelines.items())
+            collectors = list(self._collectors.items())
+
+        name = f"{self.prefix}_handler_latency_seconds"
+        lines = [f"# HELP {name} Time spent per handler output", f"# TYPE {name} histogram"]
+        for handler_name, histogram in classes:
+            cumulative = 0
+            for bound, count in zip(list(histogram.buckets) + ["+Inf"], histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{handler="{handler_name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{handler="{handler_name}"}} {histogram.sum}')
+            lines.append(f'{name}_count{{handler="{handler_name}"}} {histogram.total}')
+
+        rolling = f"{self.prefix}_handler_latency_rolling_seconds"
+        rate = f"{self.prefix}_handler_outputs_per_second"
+        total = f"{self.prefix}_handler_outputs_total"
+        lines += [f"# HELP {rolling} Handler latency quantiles over the rolling window", f"# TYPE {rolling} gauge",
+                  f"# HELP {rate} Handler outputs per second over the rolling window", f"# TYPE {rate} gauge",
+                  f"# HELP {total} Handler outputs since start", f"# TYPE {total} counter"]
+        series = [(f'handler="{handler_name}"', histogram) for handler_name, histogram in classes]
+        series += [(f'handler="{handler_name}",session="{session_id}"', histogram)
+                   for (handler_name, session_id), histogram in sessions]
+        for labels, histogram in series:
+            snapshot = histogram.snapshot()
+            for q in QUANTILES:
+                lines.append(f'{rolling}{{{labels},quantile="{q}"}} {snapshot[f"p{int(q * 100)}"]}')
+            lines.append(f"{rate}{{{labels}}} {snapshot['rate']}")
+            lines.append(f"{total}{{{labels}}} {histogram.total}")
+
+        depth = f"{self.prefix}_queue_depth"
+        lines += [f"# HELP {depth} Items waiting in pipeline queues", f"# TYPE {depth} gauge"]
+        for session_id, pipeline in pipelines:
+            for queue_name, queue in pipeline.queues_dict.items():
+                lines.append(f'{depth}{{session="{session_id}",queue="{queue_name}"}} {queue.qsize()}')
+        lines.append(f"{self.prefix}_sessions {len(pipelines)}")
+
+        for collector_name, collector in collectors:
+            try:
+                values = _flatten(collector())
+            except Exception as e:
+                logging.error(f"Metrics collector {collector_name} failed: {e}")
+                continue
+            for key, value in values.items():
+                lines.append(f"{self.prefix}_{collector_name}_{key} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _flatten(values: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    """展开嵌套的 stats() 字典，只保留数值项"""
+    flat = {}
+    for key, value in values.items():
+        key = f"{prefix}{key}".replace("-", "_").replace(".", "_")
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{key}_"))
+        elif isinstance(value, (bool, int, float)):
+            flat[key] = float(value)
+    return flat
+
+
+def start_metrics_server(registry: MetricsRegistry, host: str, port: int,
+                         routes: Optional[Dict[str, Callable[[Dict[str, str]], str]]] = None) -> ThreadingHTTPServer:
+    """
+    在后台线程中提供 GET /metrics
+
+    routes 为额外的管理接口：路径 -> 函数（输入查询参数，返回文本）
+    """
+    routes = routes or {}
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            if url.path == "/metrics":
+                body = registry.render()
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            elif url.path in routes:
+                body = routes[url.path](dict(parse_qsl(url.query)))
+                content_type = "text/plain; charset=utf-8"
+            else:
+                self.send_error(404)
+                return
+            body = body.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Metrics endpoint: http://{host}:{port}/metrics")
+    return server
@@ -1,9 +1,11 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field, fields
 from queue import Queue
-from threading import Event
-from typing import Dict, Any, Optional, List
+from uuid import uuid4
+from threading import Event, Lock
+from typing import Dict, Any, Optional, List, Callable
 
 from utils.thread_manager import ThreadManager
+from utils.tracing import TraceExporter, TurnTracer
 
 
 @dataclass
@@ -20,6 +22,117 @@ class PipelineQueues:
     # LLM相关队列
     lm_response_queue: Queue   # LLM的响应队列
 
+    # 填充音频队列（与 spoken_prompt_queue 同时收到 VAD 输出）
+    filler_prompt_queue: Queue
+
+    # 语音保存队列（与 spoken_prompt_queue 同时收到 VAD 输出）
+    saver_prompt_queue: Queue
+
+    # 发给客户端的控制消息队列（识别结果、回合结束等）
+    event_queue: Queue
+
+
+class NotifyingQueue(Queue):
+    """
+    写入后调用 notify 回调的队列
+
+    asyncio 服务器把 notify 设为 loop.call_soon_threadsafe(event.set)，发送协程
+    等待事件即可得知管道有新的输出，不需要为每个连接占用一个阻塞的线程。
+    """
+
+    def __init__(self, maxsize: int = 0):
+        super().__init__(maxsize)
+        self.notify: Optional[Callable[[], None]] = None
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        if self.notify is not None:
+            self.notify()
+
+
+class ResponseGate:
+    """
+    标记一轮对话中真正的回复音频是否已经开始输出
+
+    VAD 检测到一句话结束时调用 reset()，TTS 处理器在输出第一块音频前调用 open()，
+    填充音频（filler）通过 put() 写入发送队列。两者在同一把锁下执行，保证 open()
+    之后不会再有填充音频插到回复音频后面；open() 时会调用 on_open 回调，用于写入淡出尾音。
+    turn 在每次 reset() 时加一，上一轮的填充音频不会写进新的一轮。
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.opened = Event()
+        self.on_open: Optional[Callable[[], None]] = None
+        self.turn = 0
+
+    def reset(self, on_open: Optional[Callable[[], None]] = None) -> None:
+        """开始新的一轮对话"""
+        with self._lock:
+            self.opened.clear()
+            self.on_open = on_open
+            self.turn += 1
+
+    def set_on_open(self, on_open: Callable[[], None]) -> bool:
+        """设置 open() 时的回调，回复音频已经开始时返回 False"""
+        with self._lock:
+            if self.opened.is_set():
+                return False
+            self.on_open = on_open
+            return True
+
+    def open(self) -> None:
+        """回复音频即将开始输出"""
+        if self.opened.is_set():
+            return
+        with self._lock:
+            if self.opened.is_set():
+                return
+            if self.on_open:
+                self.on_open()
+                self.on_open = None
+            self.opened.set()
+
+    def put(self, queue: Queue, data, turn: Optional[int] = None) -> bool:
+        """回复音频尚未开始、且还是第 turn 轮时写入填充音频，返回是否写入成功"""
+        with self._lock:
+            if self.opened.is_set() or (turn is not None and turn != self.turn):
+                return False
+            queue.put(data)
+            return True
+
+
+class TurnCancel:
+    """
+    客户端取消回复时通知 LLM 和 TTS 停止生成
+
+    VAD 检测到一句话结束时调用 begin() 开始新的一轮，LLM 和 TTS 开始处理时用 current()
+    记下轮次，之后用 is_cancelled() 检查：本轮已被 cancel() 取消或已经开始了新的一轮时
+    停止生成，不再把音频写入发送队列。
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.turn = 0
+        self.cancelled_turn = 0  # 最近被取消的轮次
+
+    def begin(self) -> int:
+        """开始新的一轮"""
+        with self._lock:
+            self.turn += 1
+            return self.turn
+
+    def current(self) -> int:
+        return self.turn
+
+    def cancel(self) -> None:
+        """取消当前一轮"""
+        with self._lock:
+            self.cancelled_turn = self.turn
+
+    def is_cancelled(self, turn: int) -> bool:
+        return turn <= self.cancelled_turn or turn != self.turn
+
 
 @dataclass
 class PipelineStates:
@@ -65,26 +178,45 @@ class PipelineStates:
     stop_event: Event      # 全局停止事件
     should_listen: Event   # 是否应该监听音频输入（False时表示系统正在输出）
     current_session_id: str = ""  # 当前会话ID
+    response_gate: ResponseGate = field(default_factory=ResponseGate)  # 回复音频是否已开始
+    turn_cancel: TurnCancel = field(default_factory=TurnCancel)  # 客户端是否取消了本轮回复
+    tracer: TurnTracer = field(default_factory=TurnTracer)  # 当前轮次各阶段的耗时
 
 
 class PipelineManager:
     """管理整个语音对话管道的核心类"""
     
-    def __init__(self):
+    def __init__(self, queue_factory: Callable[[], Queue] = Queue, metrics=None,
+                 tracing: Optional[TraceExporter] = None):
+        """
+        Args:
+            queue_factory: 创建队列的函数，asyncio 服务器使用 NotifyingQueue
+            metrics: 共享的 MetricsRegistry，构建管道时登记处理器耗时和队列
+            tracing: 共享的 TraceExporter，None 表示不记录轮次
+        """
+        self.metrics = metrics
+        self.queue_factory = queue_factory
+        # 管道配置中自定义阶段使用的额外队列
+        self.extra_queues: Dict[str, Queue] = {}
         # 初始化所有队列
         self.queues = PipelineQueues(
-            recv_audio_chunks_queue=Queue(),
-            send_audio_chunks_queue=Queue(),
-            spoken_prompt_queue=Queue(),
-            text_prompt_queue=Queue(),
-            lm_response_queue=Queue()
+            recv_audio_chunks_queue=queue_factory(),
+            send_audio_chunks_queue=queue_factory(),
+            spoken_prompt_queue=queue_factory(),
+            text_prompt_queue=queue_factory(),
+            lm_response_queue=queue_factory(),
+            filler_prompt_queue=queue_factory(),
+            saver_prompt_queue=queue_factory(),
+            event_queue=queue_factory()
         )
         
         # 初始化所有状态
         self.states = PipelineStates(
             stop_event=Event(),
-            should_listen=Event()
+            should_listen=Event(),
+            current_session_id=uuid4().hex[:8],
         )
+        self.states.tracer = TurnTracer(self.states.current_session_id, tracing)
         
         # 初始化线程管理器
         self.thread_manager = None
@@ -92,6 +224,23 @@ class PipelineManager:
         # 存储所有处理器
         self.handlers = []
 
+    def queue(self, name: str, maxsize: int = 0) -> Queue:
+        """
+        按名称获取队列，用于按管道配置连接处理器
+
+        名称是 PipelineQueues 的字段时返回该队列，否则创建一个额外的队列。
+        maxsize > 0 时限制队列长度，写满后上游阻塞（需在管道启动前设置）。
+        """
+        if name in {item.name for item in fields(PipelineQueues)}:
+            queue = getattr(self.queues, name)
+        else:
+            queue = self.extra_queues.get(name)
+            if queue is None:
+                queue = self.extra_queues[name] = self.queue_factory()
+        if maxsize > 0:
+            queue.maxsize = maxsize
+        return queue
+
     def build_pipeline(self, handlers: List[Any]) -> None:
         """
         构建处理管道
@@ -100,7 +249,12 @@ class PipelineManager:
             handlers: 处理器列表，每个处理器需要实现 run 方法
         """
         self.handlers = handlers
-        self.thread_manager = ThreadManager(self.handlers)
+        self.thread_manager = ThreadManager(self.handlers, name=self.states.current_session_id)
+        for handler in handlers:
+            if hasattr(handler, "tracer"):
+                handler.tracer = self.states.tracer
+        if self.metrics is not None:
+            self.metrics.register_pipeline(self)
 
     def start(self):
         """启动管道"""
@@ -109,11 +263,26 @@ class PipelineManager:
         else:
             raise RuntimeError("Pipeline not built yet. Call build_pipeline first.")
 
+    def add_handler(self, handler: Any) -> None:
+        """向已经启动的管道追加处理器（连接的收发处理器），在新线程中运行"""
+        if not self.thread_manager:
+            raise RuntimeError("Pipeline not built yet. Call build_pipeline first.")
+        # 线程管理器与管道共用处理器列表
+        self.thread_manager.add(handler)
+
+    def bind_metrics(self, metrics) -> None:
+        """登记到 MetricsRegistry（预先构建的管道在接上连接时才登记）"""
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.register_pipeline(self)
+
     def stop(self):
         """停止管道"""
         if self.thread_manager:
             self.states.stop_event.set()
             self.thread_manager.stop()
+        if self.metrics is not None:
+            self.metrics.unregister_pipeline(self)
 
     @property
     def queues_dict(self) -> Dict[str, Queue]:
@@ -123,7 +292,11 @@ class PipelineManager:
             "send_audio_chunks_queue": self.queues.send_audio_chunks_queue,
             "spoken_prompt_queue": self.queues.spoken_prompt_queue,
             "text_prompt_queue": self.queues.text_prompt_queue,
-            "lm_response_queue": self.queues.lm_response_queue
+            "lm_response_queue": self.queues.lm_response_queue,
+            "filler_prompt_queue": self.queues.filler_prompt_queue,
+            "saver_prompt_queue": self.queues.saver_prompt_queue,
+            "event_queue": self.queues.event_queue,
+            **self.extra_queues,
         }
 
     @property
@@ -132,5 +305,8 @@ class PipelineManager:
         return {
             "stop_event": self.states.stop_event,
             "should_listen": self.states.should_listen,
-            "current_session_id": self.states.current_session_id
+            "current_session_id": self.states.current_session_id,
+            "response_gate": self.states.response_gate,
+            "turn_cancel": self.states.turn_cancel,
+            "tracer": self.states.tracer
         } 
\ No newline at end of file
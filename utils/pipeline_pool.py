@@ -0,0 +1,163 @@
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from utils.metrics import RollingHistogram
+
+
+class PipelinePool:
+    """
+    预先构建好的空闲管道，所有连接共享
+
+    为一个连接构建管道要创建全部处理器和队列、LLM 客户端以及 5～7 个线程，这些都发生在
+    收到第一帧音频之前。池中保持若干个已经构建并启动、还没有接上连接的管道，新连接直接
+    取走一个，后台线程随即补充；池为空时连接现场构建。
+
+    目标大小随连接到达速率变化：最近 window_s 秒的到达速率乘以构建一个管道的平均耗时，
+    是补充一个管道期间预计到达的连接数，再乘 burst 应对突发，限制在 [min_idle, max_idle]。
+    超过目标的空闲管道每次检查停掉一个，空闲超过 max_age_s 的管道换成新的。
+    max_idle 为 0 时不预先构建，只统计构建耗时和连接从接受到开始监听的耗时。
+    """
+
+    def __init__(self, build: Callable[[], Any], min_idle: int = 1, max_idle: int = 4, burst: float = 2.0,
+                 window_s: float = 60.0, max_age_s: float = 600.0, check_interval: float = 1.0):
+        """
+        Args:
+            build: 构建并启动一个管道（PipelineManager）
+            min_idle: 最少保持的空闲管道数
+            max_idle: 最多保持的空闲管道数，0 表示不预先构建
+            burst: 目标大小相对预计到达数的倍数
+            window_s: 计算到达速率的时间窗口（秒）
+            max_age_s: 空闲管道的最长保留时间（秒），0 表示不限制
+            check_interval: 后台线程检查目标大小和过期管道的间隔（秒）
+        """
+        self._build = build
+        self.min_idle = min(min_idle, max_idle)
+        self.max_idle = max_idle
+        self.burst = burst
+        self.window_s = window_s
+        self.max_age_s = max_age_s
+        self.check_interval = check_interval
+
+        self._idle: Deque[Tuple[float, Any]] = deque()  # (构建完成的时间, 管道)
+        self._arrivals: Deque[float] = deque()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+        self.build_seconds = 0.0  # 构建耗时的指数滑动平均
+        self.build_latency = RollingHistogram()
+        self.ready_latency = RollingHistogram()  # 接受连接到开始监听
+        self.builds = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.failed = 0
+
+    def start(self) -> None:
+        """启动后台补充线程"""
+        if self.max_idle <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._refill, name="pipeline-pool", daemon=True)
+        self._thread.start()
+
+    def acquire(self) -> Optional[Any]:
+        """取出一个空闲管道，池为空时返回 None"""
+        with self._condition:
+            self._arrivals.append(time.monotonic())
+            if self._idle:
+                _, pipeline = self._idle.popleft()
+                self.hits += 1
+            else:
+                pipeline = None
+                self.misses += 1
+            self._condition.notify()
+        return pipeline
+
+    def build(self) -> Any:
+        """构建一个管道并记录耗时，池为空时连接现场构建也调用这里"""
+        start = time.perf_counter()
+        pipeline = self._build()
+        elapsed = time.perf_counter() - start
+        self.build_latency.observe(elapsed)
+        with self._condition:
+            self.builds += 1
+            self.build_seconds = elapsed if self.builds == 1 else 0.8 * self.build_seconds + 0.2 * elapsed
+        return pipeline
+
+    def record_ready(self, seconds: float) -> None:
+        """连接从接受到开始监听的耗时"""
+        self.ready_latency.observe(seconds)
+
+    def arrival_rate(self) -> float:
+        """最近 window_s 秒内每秒到达的连接数"""
+        cutoff = time.monotonic() - self.window_s
+        while self._arrivals and self._arrivals[0] < cutoff:
+            self._arrivals.popleft()
+        return len(self._arrivals) / self.window_s
+
+    def target(self) -> int:
+        """当前应保持的空闲管道数"""
+        if self.max_idle <= 0:
+            return 0
+        expected = self.arrival_rate() * self.build_seconds * self.burst
+        return max(self.min_idle, min(self.max_idle, math.ceil(expected)))
+
+    def _refill(self) -> None:
+        while True:
+            with self._condition:
+                while True:
+                    retired = self._retire()
+                    if retired is not None or len(self._idle) < self.target():
+                        break
+                    self._condition.wait(self.check_interval)
+            if retired is not None:
+                retired.states.stop_event.set()
+                continue
+            try:
+                pipeline = self.build()
+            except Exception as e:
+                self.failed += 1
+                logging.error(f"Failed to build pipeline for pool: {e}")
+                time.sleep(self.check_interval)
+                continue
+            with self._condition:
+                self._idle.append((time.monotonic(), pipeline))
+
+    def _retire(self) -> Optional[Any]:
+        """取出一个需要停掉的空闲管道：已经过期，或者超过目标大小（最旧的一个）"""
+        if not self._idle:
+            return None
+        built, pipeline = self._idle[0]
+        expired = self.max_age_s > 0 and time.monotonic() - built > self.max_age_s
+        if expired or len(self._idle) > self.target():
+            self._idle.popleft()
+            self.evicted += 1
+            return pipeline
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        """获取管道池统计信息"""
+        with self._condition:
+            idle = len(self._idle)
+            target = self.target()
+            rate = self.arrival_rate()
+        ready = self.ready_latency.snapshot()
+        build = self.build_latency.snapshot()
+        return {
+            "idle": idle,
+            "target": target,
+            "arrival_rate": rate,
+            "hits": self.hits,
+            "misses": self.misses,
+            "builds": self.builds,
+            "evicted": self.evicted,
+            "failed": self.failed,
+            "build_seconds": self.build_seconds,
+            "build_p95_seconds": build["p95"],
+            "accept_to_listen_p50_seconds": ready["p50"],
+            "accept_to_listen_p95_seconds": ready["p95"],
+            "accept_to_listen_p99_seconds": ready["p99"],
+        }
@@ -0,0 +1,169 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from typing import Any, Dict, Optional
+
+# 栈顶为这些函数时线程在等待（锁、队列、网络），不占用也不等待 GIL。
+# C 函数（如 time.sleep、socket.recv_into）不出现在 Python 栈中，按调用它的 Python 函数判断
+WAITING_FUNCTIONS = {
+    "wait", "get", "sleep", "select", "poll", "recv", "recv_into", "recvfrom", "accept", "read", "readinto",
+    "_wait_for_tstate_lock", "join", "acquire", "serve_forever", "_worker", "run_forever", "_run_once",
+}
+
+
+def thread_label(name: str):
+    """ThreadManager 把处理器线程命名为 "会话/处理器类"，返回 (会话, 处理器)"""
+    parts = name.split("/")
+    if len(parts) >= 2:
+        return parts[0], "/".join(parts[1:])
+    return "-", name
+
+
+class SamplingProfiler:
+    """
+    按需开启的采样分析器，所有会话共享
+
+    开启后由一个后台线程每 interval 秒读取所有线程的栈（sys._current_frames），按线程名
+    归到 (会话, 处理器类)，累计成火焰图使用的 collapsed stacks（"会话;处理器;函数 (文件:行);... 次数"）。
+    同时用 pthread_getcpuclockid 读取每个线程的 CPU 时间：栈顶不在等待函数中的采样
+    视为可运行，可运行时间减去 CPU 时间即为等待 GIL 的估计。
+    关闭时没有后台线程，对服务没有额外开销。
+    """
+
+    def __init__(self, interval: float = 0.005, dump_dir: str = "."):
+        """
+        Args:
+            interval: 采样间隔（秒）
+            dump_dir: 信号触发时 collapsed stacks 的保存目录
+        """
+        self.interval = interval
+        self.dump_dir = dump_dir
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self) -> None:
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = None
+        self.duration = 0.0
+        self._threads = defaultdict(lambda: {"cpu": 0.0, "runnable": 0.0, "waiting": 0.0})
+        self._cpu_last: Dict[int, float] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self) -> bool:
+        """开始采样，已经在采样时返回 False"""
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self._reset()
+            self.started = time.monotonic()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+        logging.info(f"Sampling profiler started, interval {self.interval * 1000:.1f} ms")
+        return True
+
+    def stop(self) -> str:
+        """停止采样，返回 collapsed stacks"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return ""
+        self._stop.set()
+        thread.join()
+        self.duration = time.monotonic() - self.started
+        logging.info(f"Sampling profiler stopped after {self.duration:.1f} s, {self.samples} samples")
+        return self.collapsed()
+
+    def profile(self, seconds: float) -> str:
+        """采样 seconds 秒并返回 collapsed stacks"""
+        if not self.start():
+            return ""
+        time.sleep(seconds)
+        return self.stop()
+
+    def toggle(self) -> None:
+        """开始或停止采样，停止时把结果写入 dump_dir（用于信号处理）"""
+        if not self.running:
+            self.start()
+            return
+        # 信号处理函数在主线程执行，不在其中等待采样线程
+        threading.Thread(target=self._stop_and_dump, daemon=True).start()
+
+    def _stop_and_dump(self) -> None:
+        collapsed = self.stop()
+        path = os.path.join(self.dump_dir, f"profile-{time.strftime('%Y%m%d-%H%M%S')}.collapsed")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(collapsed)
+        logging.info(f"Profile written to {path}, thread times: {self.thread_stats()}")
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        last = time.monotonic()
+        while not self._stop.wait(self.interval):
+            now = time.monotonic()
+            elapsed, last = now - last, now
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                self._sample(ident, names.get(ident, str(ident)), frame, elapsed)
+            self.samples += 1
+
+    def _sample(self, ident: int, name: str, frame, elapsed: float) -> None:
+        session, handler = thread_label(name)
+        functions = []
+        while frame is not None:
+            code = frame.f_code
+            functions.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        top = functions[0].split(" ")[0] if functions else ""
+        self.stacks[";".join([session, handler] + functions[::-1])] += 1
+
+        times = self._threads[name]
+        times["waiting" if top in WAITING_FUNCTIONS else "runnable"] += elapsed
+        cpu = _thread_cpu_time(ident)
+        if cpu is not None:
+            if ident in self._cpu_last:
+                times["cpu"] += cpu - self._cpu_last[ident]
+            self._cpu_last[ident] = cpu
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def thread_stats(self) -> Dict[str, Any]:
+        """每个线程的 CPU、可运行、等待时间和估计的 GIL 等待时间（秒）"""
+        return {
+            name: {**times, "gil_wait": max(times["runnable"] - times["cpu"], 0.0)}
+            for name, times in self._threads.items()
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        return {"running": self.running, "samples": self.samples}
+
+
+def _thread_cpu_time(ident: int) -> Optional[float]:
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+
+def install_signal_toggle(profiler: SamplingProfiler, signal_name: str = "SIGUSR1") -> bool:
+    """收到信号时开始/停止采样，平台不支持该信号时返回 False"""
+    import signal
+
+    signum = getattr(signal, signal_name, None)
+    if signum is None:
+        return False
+    signal.signal(signum, lambda *_: profiler.toggle())
+    logging.info(f"Send {signal_name} to pid {os.getpid()} to start/stop profiling")
+    return True
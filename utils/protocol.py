@@ -0,0 +1,138 @@
+import json
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from enum import IntEnum
+from typing import Any, Dict, List, Optional
+
+# 帧头：类型(1) + 标志(1) + 序号(4) + 时间戳微秒(8) + 负载长度(4)
+HEADER = struct.Struct("!BBIQI")
+MAX_PAYLOAD = 1 << 20
+
+
+class FrameType(IntEnum):
+    AUDIO = 1    # 音频帧，负载为编码后的音频包
+    CONTROL = 2  # 控制消息，负载为 JSON
+
+
+class ControlEvent:
+    """控制消息的 event 字段"""
+    TURN_START = "turn_start"              # 服务器开始回复
+    TURN_END = "turn_end"                  # 服务器回复结束，重新开始监听
+    USER_TURN_END = "user_turn_end"        # 检测到用户说完一句话
+    TRANSCRIPT = "transcript"              # 识别结果
+    PLAYBACK_STARTED = "playback_started"  # 客户端开始播放回复（携带客户端时间戳）
+    PLAYBACK_DONE = "playback_done"        # 客户端播放完回复
+    CANCEL = "cancel"                      # 客户端取消当前回复
+    SILENCE = "silence"                    # 客户端进入静音（DTX），之后暂停发送音频
+
+
+def now_us() -> int:
+    """当前时间（微秒），作为帧时间戳"""
+    return time.time_ns() // 1000
+
+
+@dataclass
+class Frame:
+    type: FrameType
+    seq: int
+    timestamp_us: int
+    payload: bytes
+    flags: int = 0
+
+    def control(self) -> Dict[str, Any]:
+        """解析控制消息"""
+        return json.loads(bytes(self.payload).decode("utf-8"))
+
+
+def pack_frame(frame_type: FrameType, seq: int, payload: bytes, timestamp_us: Optional[int] = None, flags: int = 0) -> bytes:
+    """编码一帧"""
+    if timestamp_us is None:
+        timestamp_us = now_us()
+    return HEADER.pack(frame_type, flags, seq & 0xFFFFFFFF, timestamp_us, len(payload)) + bytes(payload)
+
+
+def unpack_frame(data: bytes) -> Frame:
+    """解码一条完整的帧（websocket 每条消息是一帧）"""
+    frame_type, flags, seq, timestamp_us, length = HEADER.unpack_from(data)
+    payload = data[HEADER.size:HEADER.size + length]
+    if len(payload) != length:
+        raise ValueError("Truncated frame")
+    return Frame(FrameType(frame_type), seq, timestamp_us, payload, flags)
+
+
+def restamp_frame(data: bytes, timestamp_us: Optional[int] = None) -> bytes:
+    """改写一条已编码帧的时间戳，序号不变（重连后补发的帧，避免被接收端当作迟到丢弃）"""
+    if timestamp_us is None:
+        timestamp_us = now_us()
+    frame_type, flags, seq, _, length = HEADER.unpack_from(data)
+    return HEADER.pack(frame_type, flags, seq, timestamp_us, length) + bytes(data[HEADER.size:])
+
+
+class FrameReader:
+    """从 TCP 字节流中拆出完整的帧"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data: bytes) -> List[Frame]:
+        self._buffer += data
+        frames = []
+        while len(self._buffer) >= HEADER.size:
+            frame_type, flags, seq, timestamp_us, length = HEADER.unpack_from(self._buffer)
+            if length > MAX_PAYLOAD:
+                raise ValueError(f"Frame payload too large: {length}")
+            end = HEADER.size + length
+            if len(self._buffer) < end:
+                break
+            frames.append(Frame(FrameType(frame_type), seq, timestamp_us, bytes(self._buffer[HEADER.size:end]), flags))
+            del self._buffer[:end]
+        return frames
+
+
+class FrameWriter:
+    """为发送的帧分配序号，可以在多个线程中使用（如客户端的音频回调和发送线程）"""
+
+    def __init__(self):
+        self.seq = 0
+        self._lock = threading.Lock()
+
+    def next_seq(self) -> int:
+        with self._lock:
+            self.seq += 1
+            return self.seq
+
+    def audio(self, payload: bytes, timestamp_us: Optional[int] = None) -> bytes:
+        return pack_frame(FrameType.AUDIO, self.next_seq(), payload, timestamp_us)
+
+    def control(self, event: str, timestamp_us: Optional[int] = None, **fields) -> bytes:
+        payload = json.dumps({"event": event, **fields}, ensure_ascii=False).encode("utf-8")
+        return pack_frame(FrameType.CONTROL, self.next_seq(), payload, timestamp_us)
+
+
+class LateFrameFilter:
+    """
+    接收端丢弃迟到的音频帧
+
+    用 (到达时间 - 发送时间戳) 的最小值估计两端时钟差和最小传输延迟，
+    超过该基线 max_late_ms 的帧视为迟到；序号回退（重复或乱序）的帧也丢弃。
+    """
+
+    def __init__(self, max_late_ms: float = 500):
+        self.max_late_us = max_late_ms * 1000
+        self.base_delay_us = None
+        self.last_seq = 0
+        self.dropped = 0
+
+    def accept(self, frame: Frame, arrival_us: Optional[int] = None) -> bool:
+        if arrival_us is None:
+            arrival_us = now_us()
+        delay = arrival_us - frame.timestamp_us
+        if self.base_delay_us is None or delay < self.base_delay_us:
+            self.base_delay_us = delay
+        if frame.seq <= self.last_seq or delay - self.base_delay_us > self.max_late_us:
+            self.dropped += 1
+            return False
+        self.last_seq = frame.seq
+        return True
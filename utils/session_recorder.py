@@ -0,0 +1,180 @@
+import glob
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from enum import IntEnum
+from typing import Any, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+FILE_MAGIC = b"XZREC\x00\x01\x00"
+_HEADER_LENGTH = struct.Struct("!I")
+# 类型、距会话开始的微秒数、客户端采集时间戳（微秒，没有时为 0）、数据长度
+RECORD = struct.Struct("!BxQQI")
+
+
+class RecordKind(IntEnum):
+    # 0 保留：预分配文件中未写入的部分全为 0，读到 0 即为结束
+    UPLINK_AUDIO = 1  # 解码后的上行 PCM
+    UPLINK_CONTROL = 2  # 客户端发来的控制消息（JSON）
+    DOWNLINK_AUDIO = 3  # 发送给客户端的 PCM（编码前）
+    DOWNLINK_CONTROL = 4  # 发送给客户端的控制消息（JSON）
+
+
+class Record(NamedTuple):
+    kind: RecordKind
+    offset_us: int
+    capture_us: int
+    payload: bytes
+
+    def control(self) -> Dict[str, Any]:
+        return json.loads(self.payload)
+
+
+class SessionRecorder:
+    """
+    会话录音，由 TransportSession 在收发线程中调用
+
+    每个会话写入预分配大小的内存映射文件（{session_id}.{序号}.rec），记录上行音频及其到达时间、
+    客户端采集时间戳、下行音频和双向的控制消息。写入只是一次内存拷贝，不经过系统调用；
+    文件写满后截断到实际长度并换一个新文件，只保留最近 max_segments 个文件。
+    """
+
+    def __init__(self, directory: str, session_id: str, segment_bytes: int = 64 * 1024 * 1024,
+                 max_segments: int = 4):
+        """
+        Args:
+            directory: 录音目录
+            session_id: 会话 ID，用于文件名
+            segment_bytes: 单个文件预分配的大小
+            max_segments: 每个会话保留的文件数，0 表示不限制
+        """
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.session_id = session_id
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        self.started = time.monotonic()
+        self.started_unix = time.time()
+        self._lock = threading.Lock()
+        self._file = None
+        self._map: Optional[mmap.mmap] = None
+        self._pos = 0
+        self.segment = -1
+        self.records = 0
+        self.bytes = 0
+        self.dropped = 0
+        self.closed = False
+        self._open_segment()
+
+    def path(self, segment: int) -> str:
+        return os.path.join(self.directory, f"{self.session_id}.{segment:04d}.rec")
+
+    def _open_segment(self) -> None:
+        self.segment += 1
+        if self.max_segments > 0 and self.segment >= self.max_segments:
+            try:
+                os.remove(self.path(self.segment - self.max_segments))
+            except FileNotFoundError:
+                pass
+        self._file = open(self.path(self.segment), "w+b")
+        try:
+            os.posix_fallocate(self._file.fileno(), 0, self.segment_bytes)
+        except (AttributeError, OSError):
+            self._file.truncate(self.segment_bytes)
+        self._map = mmap.mmap(self._file.fileno(), self.segment_bytes)
+        header = json.dumps({
+            "session_id": self.session_id,
+            "segment": self.segment,
+            "started_unix": self.started_unix,
+        }).encode("utf-8")
+        data = FILE_MAGIC + _HEADER_LENGTH.pack(len(header)) + header
+        self._map[:len(data)] = data
+        self._pos = len(data)
+
+    def _close_segment(self) -> None:
+        self._map.close()
+        self._file.truncate(self._pos)
+        self._file.close()
+        self._map = None
+
+    def _write(self, kind: RecordKind, payload: bytes, capture_us: int = 0) -> None:
+        size = RECORD.size + len(payload)
+        offset_us = int((time.monotonic() - self.started) * 1e6)
+        with self._lock:
+            if self.closed:
+                return
+            if self._pos + size > self.segment_bytes:
+                if size > self.segment_bytes // 2:
+                    self.dropped += 1
+                    return
+                self._close_segment()
+                self._open_segment()
+            end = self._pos + RECORD.size
+            self._map[self._pos:end] = RECORD.pack(kind, offset_us, capture_us or 0, len(payload))
+            self._map[end:end + len(payload)] = payload
+            self._pos = end + len(payload)
+            self.records += 1
+            self.bytes += size
+
+    def uplink_audio(self, pcm: bytes, capture_us: Optional[int] = None) -> None:
+        self._write(RecordKind.UPLINK_AUDIO, pcm, capture_us)
+
+    def uplink_control(self, message: Dict[str, Any], capture_us: Optional[int] = None) -> None:
+        self._write(RecordKind.UPLINK_CONTROL, json.dumps(message, ensure_ascii=False).encode("utf-8"), capture_us)
+
+    def downlink_audio(self, pcm: bytes) -> None:
+        self._write(RecordKind.DOWNLINK_AUDIO, pcm)
+
+    def downlink_control(self, message: Dict[str, Any]) -> None:
+        self._write(RecordKind.DOWNLINK_CONTROL, json.dumps(message, ensure_ascii=False).encode("utf-8"))
+
+    def close(self) -> None:
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+            self._close_segment()
+        logging.info(f"Session recording closed: {self.stats()}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {"segments": self.segment + 1, "records": self.records, "bytes": self.bytes, "dropped": self.dropped}
+
+
+def session_files(directory: str, session_id: str) -> List[str]:
+    """一个会话的录音文件，按序号排列"""
+    return sorted(glob.glob(os.path.join(glob.escape(directory), f"{glob.escape(session_id)}.*.rec")))
+
+
+def read_segment(path: str) -> Tuple[Dict[str, Any], Iterator[Record]]:
+    """读取一个录音文件，返回 (文件头, 记录迭代器)"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:len(FILE_MAGIC)] != FILE_MAGIC:
+        raise ValueError(f"{path} is not a session recording")
+    pos = len(FILE_MAGIC)
+    (length,) = _HEADER_LENGTH.unpack_from(data, pos)
+    pos += _HEADER_LENGTH.size
+    header = json.loads(data[pos:pos + length])
+    pos += length
+
+    def records() -> Iterator[Record]:
+        offset = pos
+        while offset + RECORD.size <= len(data):
+            kind, offset_us, capture_us, size = RECORD.unpack_from(data, offset)
+            if kind == 0:
+                return
+            offset += RECORD.size
+            yield Record(RecordKind(kind), offset_us, capture_us, data[offset:offset + size])
+            offset += size
+
+    return header, records()
+
+
+def read_session(paths: List[str]) -> Iterator[Record]:
+    """按顺序读取一个会话的多个录音文件"""
+    for path in paths:
+        _, records = read_segment(path)
+        yield from records
@@ -0,0 +1,137 @@
+import logging
+import secrets
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+
+@dataclass
+class ResumableSession:
+    token: str
+    pipeline: Any  # PipelineManager
+    transport: Any  # TransportSession
+    on_expire: Callable[[], None]  # 宽限期内没有重连时结束会话
+    disconnect: Optional[Callable[[], None]] = None  # 断开当前连接
+    attached: bool = True
+    detached: threading.Event = field(default_factory=threading.Event)
+    detached_at: float = 0.0
+    timer: Optional[threading.Timer] = None
+
+
+class SessionRegistry:
+    """
+    可恢复的会话，所有连接共享
+
+    新会话在握手时拿到一个令牌。连接断开后会话不立即结束：管道（VAD 缓存、对话历史）
+    和传输状态（没有发出的下行音频、帧序号）保留 grace_s 秒，客户端在这段时间内带着令牌
+    重连就接回原来的管道，不重新加载模型；超时后调用 on_expire 结束会话。
+
+    客户端重连时服务器可能还没发现旧连接已经断开，这时先断开旧连接，等它交回会话。
+    """
+
+    def __init__(self, grace_s: float = 30.0, takeover_timeout: float = 1.0):
+        """
+        Args:
+            grace_s: 连接断开后保留会话的时间（秒）
+            takeover_timeout: 重连时等待旧连接交回会话的最长时间（秒）
+        """
+        self.grace_s = grace_s
+        self.takeover_timeout = takeover_timeout
+        self._sessions: Dict[str, ResumableSession] = {}
+        self._lock = threading.Lock()
+
+        self.registered = 0
+        self.resumed = 0
+        self.expired = 0
+        self.missed = 0  # 令牌未知或已过期
+        self.resume_ms = deque(maxlen=1000)  # 重连到可以收发的耗时
+        self.offline_seconds = deque(maxlen=1000)  # 断开到重连的间隔
+
+    def register(self, pipeline, transport, on_expire: Callable[[], None],
+                 disconnect: Optional[Callable[[], None]] = None) -> ResumableSession:
+        """登记新会话，令牌写入 transport.token，在握手回复中发给客户端"""
+        entry = ResumableSession(secrets.token_urlsafe(16), pipeline, transport, on_expire, disconnect)
+        transport.token = entry.token
+        with self._lock:
+            self._sessions[entry.token] = entry
+            self.registered += 1
+        return entry
+
+    def detach(self, token: Optional[str]) -> bool:
+        """连接断开，返回 True 表示会话保留到宽限期结束"""
+        with self._lock:
+            entry = self._sessions.get(token)
+            if entry is None or not entry.attached:
+                return False
+            entry.attached = False
+            entry.detached_at = time.monotonic()
+            entry.timer = threading.Timer(self.grace_s, self._expire, (token,))
+            entry.timer.daemon = True
+            entry.timer.start()
+        entry.detached.set()
+        logging.info(f"Session {token[:6]}… detached, resumable for {self.grace_s:.0f} s")
+        return True
+
+    def resume(self, token: str) -> Optional[ResumableSession]:
+        """客户端带令牌重连，返回可以接回的会话，令牌未知或已过期时返回 None"""
+        entry = self._sessions.get(token)
+        if entry is not None and not entry.detached.is_set():
+            # 旧连接还没有断开：断开它，等收发线程交回会话
+            if entry.disconnect is not None:
+                try:
+                    entry.disconnect()
+                except Exception as e:
+                    logging.debug(f"Error closing previous connection: {e}")
+            entry.detached.wait(self.takeover_timeout)
+        with self._lock:
+            if entry is None or self._sessions.get(token) is not entry or entry.attached:
+                self.missed += 1
+                return None
+            entry.timer.cancel()
+            entry.attached = True
+            entry.detached.clear()
+            self.resumed += 1
+            self.offline_seconds.append(time.monotonic() - entry.detached_at)
+        return entry
+
+    def record_resume(self, elapsed_ms: float) -> None:
+        self.resume_ms.append(elapsed_ms)
+        logging.info(f"Session resumed in {elapsed_ms:.1f} ms")
+
+    def remove(self, token: Optional[str]) -> None:
+        """会话结束，令牌失效"""
+        with self._lock:
+            entry = self._sessions.pop(token, None)
+        if entry is not None and entry.timer is not None:
+            entry.timer.cancel()
+
+    def _expire(self, token: str) -> None:
+        with self._lock:
+            entry = self._sessions.get(token)
+            if entry is None or entry.attached:
+                return
+            del self._sessions[token]
+            self.expired += 1
+        logging.info(f"Session {token[:6]}… expired without reconnect")
+        entry.on_expire()
+
+    def stats(self) -> Dict[str, Any]:
+        """获取会话恢复统计信息"""
+        with self._lock:
+            detached = sum(not entry.attached for entry in self._sessions.values())
+            total = len(self._sessions)
+        resume_ms = sorted(self.resume_ms)
+        offline = self.offline_seconds
+        return {
+            "sessions": total - detached,
+            "detached": detached,
+            "registered": self.registered,
+            "resumed": self.resumed,
+            "expired": self.expired,
+            "missed": self.missed,
+            "resume_p50_ms": resume_ms[len(resume_ms) // 2] if resume_ms else 0.0,
+            "resume_max_ms": resume_ms[-1] if resume_ms else 0.0,
+            "offline_seconds": sum(offline) / len(offline) if offline else 0.0,
+        }
@@ -0,0 +1,41 @@
+import re
+import unicodedata
+from typing import List, Tuple
+
+# 句末标点（中英文），用于切分句子
+SENTENCE_END_CHARS = "。！？!?；;…\n"
+_SENTENCE_RE = re.compile(f"[^{SENTENCE_END_CHARS}]*[{SENTENCE_END_CHARS}]+")
+
+
+def normalize_text(text: str) -> str:
+    """
+    归一化文本，用于缓存键的计算
+
+    - NFKC 归一化（全角转半角等）
+    - 转小写
+    - 去掉空白、标点和符号（包括 ASR 输出的表情符号）
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return "".join(
+        ch for ch in text
+        if unicodedata.category(ch)[0] not in ("P", "S", "Z", "C")
+    )
+
+
+def split_sentences(text: str) -> Tuple[List[str], str]:
+    """
+    按句末标点切分文本
+
+    Returns:
+        (完整的句子列表, 剩余未结束的文本)
+    """
+    sentences = []
+    pos = 0
+    for match in _SENTENCE_RE.finditer(text):
+        sentence = match.group().strip()
+        if sentence:
+            sentences.append(sentence)
+        pos = match.end()
+    return sentences, text[pos:]
@@ -8,14 +8,16 @@ class ThreadManager:
     用于执行给定的handler任务。
     """
 
-    def __init__(self, handlers: List):
+    def __init__(self, handlers: List, name: str = ""):
         """
         初始化线程管理器
         
         Args:
             handlers: 需要在独立线程中运行的handler列表
+            name: 线程名前缀（会话ID），线程命名为 "name/处理器类名"，采样分析按此归类
         """
         self.handlers = handlers
+        self.name = name
         self.threads = []
 
     def start(self):
@@ -23,11 +25,19 @@ class ThreadManager:
         启动所有handler对应的线程
         """
         for handler in self.handlers:
-            thread = threading.Thread(target=handler.run)
+            thread = threading.Thread(target=handler.run, name=f"{self.name}/{handler.__class__.__name__}")
             thread.daemon = True  # 设置为守护线程，这样主程序退出时线程会自动结束
             self.threads.append(thread)
             thread.start()
 
+    def add(self, handler) -> None:
+        """向已经启动的线程组追加一个handler，在新线程中运行"""
+        self.handlers.append(handler)
+        thread = threading.Thread(target=handler.run, name=f"{self.name}/{handler.__class__.__name__}")
+        thread.daemon = True
+        self.threads.append(thread)
+        thread.start()
+
     def stop(self):
         """
         停止所有正在运行的线程
@@ -0,0 +1,262 @@
+import json
+import logging
+import logging.handlers
+import threading
+import time
+import urllib.request
+import uuid
+from queue import Empty, Full, Queue
+from typing import Any, Dict, List, Optional
+
+
+class Turn:
+    """一轮对话的各阶段耗时，时间为 time.monotonic()"""
+
+    def __init__(self, session_id: str, start: float):
+        self.session_id = session_id
+        self.turn_id = uuid.uuid4().hex[:12]
+        self.trace_id = uuid.uuid4().hex
+        self.start = start
+        # 单调时钟与墙上时钟的差，导出时换算成 Unix 时间
+        self.wall_offset = time.time() - time.monotonic()
+        self.spans: Dict[str, List[Optional[float]]] = {"turn": [start, None]}
+        self.attributes: Dict[str, Any] = {}
+
+    def to_record(self, status: str) -> Dict[str, Any]:
+        end = self.spans["turn"][1]
+        return {
+            "session_id": self.session_id,
+            "turn_id": self.turn_id,
+            "trace_id": self.trace_id,
+            "status": status,
+            "start_unix": self.start + self.wall_offset,
+            "duration_ms": (end - self.start) * 1000,
+            "attributes": dict(self.attributes),
+            "spans": [
+                {
+                    "name": name,
+                    "start_ms": (span_start - self.start) * 1000,
+                    "duration_ms": (span_end - span_start) * 1000,
+                }
+                for name, (span_start, span_end) in self.spans.items()
+                if span_start is not None and span_end is not None
+            ],
+        }
+
+
+class TurnTracer:
+    """
+    一个会话的轮次追踪，处理器和传输层共用（PipelineStates.tracer）
+
+    同一会话的轮次是顺序的：VAD 检测到一句话结束时 begin() 开始新的一轮，停止监听直到
+    回复结束，所以 ASR、LLM、TTS 和发送线程记录的阶段都属于当前轮次；发送 TURN_END
+    或客户端取消时 finish() 把这一轮交给 exporter。没有 exporter 时所有方法直接返回。
+    各线程对当前轮次的修改和结束时生成记录都在同一把锁下进行。
+
+    阶段名：endpoint、asr、llm、llm.ttft、tts、tts.ttfb、first_byte_sent、playback_started、turn
+    """
+
+    def __init__(self, session_id: str = "", exporter: Optional["TraceExporter"] = None):
+        self.session_id = session_id
+        self.exporter = exporter
+        self.current: Optional[Turn] = None
+        self._lock = threading.Lock()
+
+    @property
+    def turn_id(self) -> Optional[str]:
+        turn = self.current
+        return turn.turn_id if turn is not None else None
+
+    def begin(self, endpoint_ms: float = 0.0) -> Optional[str]:
+        """检测到一句话结束，endpoint_ms 为检测到的尾部静音时长，返回新一轮的 ID"""
+        if self.exporter is None:
+            return None
+        now = time.monotonic()
+        speech_end = now - endpoint_ms / 1000
+        with self._lock:
+            if self.current is not None:
+                self._finish(self.current, "superseded", now)
+            self.current = Turn(self.session_id, speech_end)
+            self.current.spans["endpoint"] = [speech_end, now]
+            return self.current.turn_id
+
+    def start(self, name: str) -> None:
+        """阶段开始，已经开始过的阶段不变"""
+        if self.current is None:
+            return
+        with self._lock:
+            turn = self.current
+            if turn is not None and name not in turn.spans:
+                turn.spans[name] = [time.monotonic(), None]
+
+    def end(self, name: str) -> None:
+        """阶段结束，多次调用以最后一次为准"""
+        if self.current is None:
+            return
+        with self._lock:
+            turn = self.current
+            if turn is not None and name in turn.spans:
+                turn.spans[name][1] = time.monotonic()
+
+    def first(self, name: str, since: str = "turn") -> None:
+        """记录从 since 阶段开始到第一次发生 name 的耗时（如首字、首包）"""
+        if self.current is None:
+            return
+        with self._lock:
+            turn = self.current
+            if turn is not None and name not in turn.spans and since in turn.spans:
+                turn.spans[name] = [turn.spans[since][0], time.monotonic()]
+
+    def set(self, key: str, value: Any) -> None:
+        if self.current is None:
+            return
+        with self._lock:
+            turn = self.current
+            if turn is not None:
+                turn.attributes[key] = value
+
+    def finish(self, status: str = "ok") -> None:
+        with self._lock:
+            if self.current is not None:
+                self._finish(self.current, status, time.monotonic())
+                self.current = None
+
+    def _finish(self, turn: Turn, status: str, now: float) -> None:
+        # 在锁内生成记录，之后其他线程对这一轮的修改不影响导出
+        turn.spans["turn"][1] = now
+        self.exporter.export(turn.to_record(status))
+
+
+class TraceExporter:
+    """
+    轮次记录的导出，所有会话共享
+
+    由后台线程写入按大小滚动的 JSONL 文件（每行一轮），管道线程只把记录放入队列；配置
+    otlp_endpoint 时另一个后台线程按批以 OTLP/HTTP JSON 格式发送到 OpenTelemetry collector
+    （如 http://localhost:4318/v1/traces），发送失败只计数，不影响对话。队列满时丢弃记录。
+    """
+
+    def __init__(
+            self,
+            path: Optional[str] = None,
+            max_bytes: int = 50 * 1024 * 1024,
+            backups: int = 5,
+            otlp_endpoint: Optional[str] = None,
+            service_name: str = "voice-chat",
+            batch_interval: float = 1.0,
+    ):
+        """
+        Args:
+            path: JSONL 文件路径，None 表示不写文件
+            max_bytes: 单个文件的最大字节数，超过后滚动
+            backups: 保留的历史文件数
+            otlp_endpoint: OTLP/HTTP traces 接口地址，None 表示不发送
+            service_name: OTLP 中的 service.name
+            batch_interval: 发送 OTLP 的批间隔（秒）
+        """
+        self.logger = None
+        if path:
+            handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger = logging.getLogger(f"{__name__}.turns")
+            self.logger.propagate = False
+            self.logger.setLevel(logging.INFO)
+            self.logger.addHandler(handler)
+
+        self.otlp_endpoint = otlp_endpoint
+        self.service_name = service_name
+        self.batch_interval = batch_interval
+        self._records: Queue = Queue(maxsize=10000)  # 待写入文件
+        self._pending: Queue = Queue(maxsize=10000)  # 待发送 OTLP
+        self.exported = 0
+        self.dropped = 0
+        self.otlp_errors = 0
+        if self.logger is not None:
+            threading.Thread(target=self._write_loop, name="trace-writer", daemon=True).start()
+        if otlp_endpoint:
+            threading.Thread(target=self._otlp_loop, name="trace-otlp", daemon=True).start()
+
+    def export(self, record: Dict[str, Any]) -> None:
+        """导出一轮的记录（Turn.to_record），不阻塞调用的管道线程"""
+        self.exported += 1
+        queues = ([self._records] if self.logger is not None else []) + ([self._pending] if self.otlp_endpoint else [])
+        for queue in queues:
+            try:
+                queue.put_nowait(record)
+            except Full:
+                self.dropped += 1
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待已导出的记录写入文件，返回是否在 timeout 秒内写完"""
+        deadline = time.monotonic() + timeout
+        while self._records.unfinished_tasks:
+            if time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def _write_loop(self) -> None:
+        while True:
+            record = self._records.get()
+            try:
+                self.logger.info(json.dumps(record, ensure_ascii=False))
+            except Exception as e:
+                logging.warning(f"Failed to write turn record: {e}")
+            finally:
+                self._records.task_done()
+
+    def _otlp_loop(self) -> None:
+        while True:
+            batch = [self._pending.get()]
+            deadline = time.monotonic() + self.batch_interval
+            while (timeout := deadline - time.monotonic()) > 0:
+                try:
+                    batch.append(self._pending.get(timeout=timeout))
+                except Empty:
+                    break
+            try:
+                self._post(batch)
+            except Exception as e:
+                self.otlp_errors += 1
+                logging.warning(f"Failed to export {len(batch)} turns to {self.otlp_endpoint}: {e}")
+
+    def _post(self, records: List[Dict[str, Any]]) -> None:
+        body = json.dumps(otlp_payload(records, self.service_name)).encode("utf-8")
+        request = urllib.request.Request(self.otlp_endpoint, data=body, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=5) as response:
+            response.read()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"exported": self.exported, "dropped": self.dropped, "otlp_errors": self.otlp_errors}
+
+
+def otlp_payload(records: List[Dict[str, Any]], service_name: str) -> Dict[str, Any]:
+    """把轮次记录转成 OTLP/HTTP JSON（ExportTraceServiceRequest），每轮一个 trace，turn 为根 span"""
+    spans = []
+    for record in records:
+        start_ns = int(record["start_unix"] * 1e9)
+        root_id = uuid.uuid4().hex[:16]
+        attributes = [
+            {"key": "session.id", "value": {"stringValue": record["session_id"]}},
+            {"key": "turn.id", "value": {"stringValue": record["turn_id"]}},
+            {"key": "turn.status", "value": {"stringValue": record["status"]}},
+        ] + [{"key": key, "value": {"stringValue": str(value)}} for key, value in record["attributes"].items()]
+        for span in record["spans"]:
+            is_root = span["name"] == "turn"
+            span_start = start_ns + int(span["start_ms"] * 1e6)
+            spans.append({
+                "traceId": record["trace_id"],
+                "spanId": root_id if is_root else uuid.uuid4().hex[:16],
+                "parentSpanId": "" if is_root else root_id,
+                "name": span["name"],
+                "kind": 1,
+                "startTimeUnixNano": str(span_start),
+                "endTimeUnixNano": str(span_start + int(span["duration_ms"] * 1e6)),
+                "attributes": attributes if is_root else [],
+            })
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "voice-chat.turns"}, "spans": spans}],
+        }]
+    }